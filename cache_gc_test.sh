@@ -0,0 +1,68 @@
+#!/bin/bash -e
+
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for cache_gc.par
+
+function expect_output() {
+  local output=$1
+  local expected=$2
+
+  if [[ "${output}" != *"${expected}"* ]]; then
+    echo "Expected '${expected}' in:"
+    echo "${output}"
+    return 1
+  fi
+}
+
+# Test collecting the cache of a pull, which keeps the layers while the
+# image's directory links to them, and reclaims them once it is gone.
+function test_cache_gc() {
+  local image=$1
+  local cache=$(mktemp -d)
+  local tmpdir=$(mktemp -d)
+
+  echo "TESTING: ${image}"
+
+  puller.par --name="${image}" --directory="${tmpdir}" --cache="${cache}"
+
+  output="$(cache_gc.par --cache="${cache}" --dry-run)"
+  expect_output "${output}" "Would reclaim 0 bytes in 0 entries"
+
+  output="$(cache_gc.par --cache="${cache}" --directory="${tmpdir}")"
+  expect_output "${output}" "Reclaimed 0 bytes in 0 entries"
+
+  rm -rf "${tmpdir}"
+
+  output="$(cache_gc.par --cache="${cache}" --dry-run)"
+  expect_output "${output}" "Would reclaim"
+  if [[ "${output}" == *"Would reclaim 0 bytes"* ]]; then
+    echo "Expected the unlinked layers to be reclaimable:"
+    echo "${output}"
+    return 1
+  fi
+
+  output="$(cache_gc.par --cache="${cache}" --no-wait)"
+  expect_output "${output}" "0 bytes remain"
+
+  rm -rf "${cache}"
+}
+
+
+# Test collecting the cache of a trivial image.
+test_cache_gc gcr.io/google-containers/pause:2.0
+
+# Test collecting the cache of a non-trivial image.
+test_cache_gc gcr.io/google-appengine/python:latest
@@ -28,3 +28,23 @@ from containerregistry.client import monitor_
 setattr(x, 'monitor', monitor_)
 
 
+from containerregistry.client import stream_
+setattr(x, 'stream', stream_)
+
+
+from containerregistry.client import whiteout_
+setattr(x, 'whiteout', whiteout_)
+
+
+from containerregistry.client import filesystem_
+setattr(x, 'filesystem', filesystem_)
+
+
+from containerregistry.client import known_blobs_
+setattr(x, 'known_blobs', known_blobs_)
+
+
+from containerregistry.client import registry_capabilities_
+setattr(x, 'registry_capabilities', registry_capabilities_)
+
+
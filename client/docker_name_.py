@@ -291,6 +291,27 @@ class Digest(Repository):
     return hash((self.registry, self.repository, self.digest))
 
 
+def manifest_path(name):
+  """The path of the manifest of a Tag or Digest, relative to /v2/.
+
+  This is also the key under which the FromRegistry images (and lists)
+  cache the content they fetch from that path.
+
+  Args:
+    name: the Tag or Digest.
+
+  Returns:
+    e.g. 'foo/bar/manifests/latest', or 'foo/bar/manifests/sha256:...'.
+  """
+  if isinstance(name, Tag):
+    ref = name.tag
+  else:
+    assert isinstance(name, Digest)
+    ref = name.digest
+  return '{repository}/manifests/{ref}'.format(
+      repository=name.repository, ref=ref)
+
+
 def from_string(name):
   """Parses the given name string.
 
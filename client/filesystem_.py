@@ -0,0 +1,348 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package materializes tar entries as a directory tree."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import errno
+import fcntl
+import hashlib
+import io
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+import concurrent.futures
+from containerregistry.client import stream
+
+import six
+
+# Ways in which a ContentStore places its payloads into the directory tree.
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+
+# The Linux ioctl with which one file is made a copy-on-write clone of another.
+_FICLONE = 0x40049409
+
+# Files up to this size are read into memory and written by the worker pool,
+# larger ones are copied through on the calling thread.
+_POOLED_FILE_SIZE = stream.CHUNK_SIZE
+
+# The number of pooled writes which may be outstanding per thread, which caps
+# the payloads held in memory.
+_PENDING_PER_THREAD = 8
+
+
+def _makedirs(path):
+  try:
+    os.makedirs(path)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      raise e
+
+
+def _copy(content, path):
+  with io.open(path, u'wb') as f:
+    if isinstance(content, six.binary_type):
+      f.write(content)
+    else:
+      shutil.copyfileobj(content, f, stream.CHUNK_SIZE)
+
+
+def _reflink(source, dest):
+  """Makes dest a copy-on-write clone of source, or failing that a copy."""
+  with io.open(source, u'rb') as src, io.open(dest, u'wb') as dst:
+    try:
+      fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    except (IOError, OSError) as e:
+      if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL,
+                         errno.ENOTTY):
+        raise e
+      shutil.copyfileobj(src, dst, stream.CHUNK_SIZE)
+
+
+def _hardlink(source, dest):
+  """Makes dest a hardlink to source, or failing that a copy."""
+  try:
+    os.link(source, dest)
+  except OSError as e:
+    if e.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+      raise e
+    shutil.copyfile(source, dest)
+
+
+class ContentStore(object):
+  """A directory of file payloads keyed by their sha256.
+
+  Files whose payload is already in the store are reflinked (or hardlinked)
+  from it rather than written again, so that identical files across images
+  (and within one) share their storage.
+
+  Args:
+    directory: the directory holding the payloads; created if missing.
+    mode: REFLINK to clone payloads copy-on-write (falling back on a copy
+        where the filesystem cannot), or HARDLINK to link them.  Hardlinked
+        files share their inode, so they are only shared between files with
+        the same mode, ownership and mtime, and changes made to one through
+        the directory tree will be visible in all of them.
+  """
+
+  def __init__(self, directory, mode=REFLINK):
+    if mode not in (REFLINK, HARDLINK):
+      raise ValueError('Unknown content store mode: %r' % mode)
+    _makedirs(directory)
+    self._directory = directory
+    self._mode = mode
+
+  def _path(self, digest, tarinfo):
+    if self._mode == HARDLINK:
+      # A hardlink shares the metadata of its payload.
+      digest = '%s-%o-%d-%d-%d' % (digest, tarinfo.mode, tarinfo.uid,
+                                   tarinfo.gid, int(tarinfo.mtime))
+    return os.path.join(self._directory, digest)
+
+  def _put(self, content, tarinfo):
+    """Stores content, returning the path holding it."""
+    if isinstance(content, six.binary_type):
+      stored = self._path(hashlib.sha256(content).hexdigest(), tarinfo)
+      if os.path.exists(stored):
+        return stored
+      content = io.BytesIO(content)
+
+    fd, temp = tempfile.mkstemp(dir=self._directory)
+    try:
+      hasher = hashlib.sha256()
+      with os.fdopen(fd, 'wb') as f:
+        for chunk in iter(lambda: content.read(stream.CHUNK_SIZE), b''):
+          hasher.update(chunk)
+          f.write(chunk)
+      stored = self._path(hasher.hexdigest(), tarinfo)
+      if os.path.exists(stored):
+        os.unlink(temp)
+      else:
+        # Concurrent writers of the same payload are harmless, as the rename
+        # atomically replaces one identical file with another.
+        os.rename(temp, stored)
+    except:
+      if os.path.exists(temp):
+        os.unlink(temp)
+      raise
+    return stored
+
+  def materialize(self, path, content, tarinfo):
+    """Writes a file at path with the given content, sharing its storage.
+
+    Args:
+      path: the path of the file to create.
+      content: the file's payload, as bytes or a file-like object.
+      tarinfo: the tarfile.TarInfo describing the file.
+    """
+    stored = self._put(content, tarinfo)
+    if self._mode == HARDLINK:
+      _hardlink(stored, path)
+    else:
+      _reflink(stored, path)
+
+
+class Writer(object):
+  """Materializes a stream of tar entries under a directory.
+
+  Entries are written as they are added, with file payloads written from a
+  pool of worker threads.  Metadata is applied to directories once all of
+  their entries have been written, and hardlinks are created once their
+  targets exist.  Ownership is only applied when running as root.
+
+  Symlinks are created once everything else has been written, so that no
+  entry is written through one.  As with tarfile's data_filter, entries
+  whose names (or, for hardlinks, targets) would place them outside of the
+  directory once symlinks are resolved are skipped.
+
+  Args:
+    directory: the directory under which to write; created if missing.
+    threads: the number of threads with which to write file payloads.
+    content_store: an optional ContentStore through which files are written.
+  """
+
+  def __init__(self, directory, threads=8, content_store=None):
+    self._directory = directory
+    self._threads = threads
+    self._content_store = content_store
+    self._chown = hasattr(os, 'geteuid') and os.geteuid() == 0
+    self._executor = None
+    self._pending = threading.BoundedSemaphore(threads * _PENDING_PER_THREAD)
+    self._errors = []
+    self._directories = []
+    self._symlinks = []
+    self._hardlinks = []
+    self._root = None
+
+  def _path(self, name):
+    name = os.path.normpath(name.lstrip('/'))
+    if name == os.curdir:
+      return self._directory
+    if name == os.pardir or name.startswith(os.pardir + os.sep):
+      return None
+    return os.path.join(self._directory, name)
+
+  def _within(self, path):
+    """Whether path, with any symlinks resolved, lies within the directory."""
+    path = os.path.realpath(path)
+    return path == self._root or path.startswith(os.path.join(self._root, ''))
+
+  def _apply(self, path, tarinfo):
+    """Applies the metadata of tarinfo to the entry at path."""
+    if self._chown:
+      os.lchown(path, tarinfo.uid, tarinfo.gid)
+    if not tarinfo.issym():
+      os.chmod(path, stat.S_IMODE(tarinfo.mode))
+      os.utime(path, (tarinfo.mtime, tarinfo.mtime))
+
+  def _write(self, path, tarinfo, content):
+    if not self._within(path):
+      # e.g. a symlink already in the directory points outside of it.
+      logging.warning('Skipping %s, which is outside of the filesystem.',
+                      tarinfo.name)
+      return
+    _makedirs(os.path.dirname(path))
+    if tarinfo.isfile():
+      if self._content_store:
+        self._content_store.materialize(path, content, tarinfo)
+      else:
+        _copy(content, path)
+    else:
+      try:
+        if tarinfo.isfifo():
+          os.mkfifo(path)
+        else:
+          kind = stat.S_IFCHR if tarinfo.ischr() else stat.S_IFBLK
+          os.mknod(path, stat.S_IMODE(tarinfo.mode) | kind,
+                   os.makedev(tarinfo.devmajor, tarinfo.devminor))
+      except OSError as e:
+        if e.errno != errno.EPERM:
+          raise e
+        logging.warning('Insufficient permissions to create %s, skipping.',
+                        tarinfo.name)
+        return
+    self._apply(path, tarinfo)
+
+  def _done(self, future):
+    self._pending.release()
+    if future.exception():
+      self._errors.append(future.exception())
+
+  def _submit(self, *args):
+    if self._errors:
+      raise self._errors[0]
+    self._pending.acquire()
+    self._executor.submit(self._write, *args).add_done_callback(self._done)
+
+  def add(self, tarinfo, fileobj=None):
+    """Writes the entry described by tarinfo.
+
+    Args:
+      tarinfo: the tarfile.TarInfo describing the entry.
+      fileobj: for regular files, the file-like object with its payload,
+          which is fully read before add() returns.
+    """
+    path = self._path(tarinfo.name)
+    if path is None:
+      logging.warning('Skipping %s, which is outside of the filesystem.',
+                      tarinfo.name)
+      return
+
+    if tarinfo.isdir():
+      if not self._within(path):
+        logging.warning('Skipping %s, which is outside of the filesystem.',
+                        tarinfo.name)
+        return
+      _makedirs(path)
+      self._directories.append((path, tarinfo))
+    elif tarinfo.issym():
+      self._symlinks.append((path, tarinfo))
+    elif tarinfo.islnk():
+      self._hardlinks.append((path, tarinfo))
+    elif tarinfo.isfile() and tarinfo.size > _POOLED_FILE_SIZE:
+      self._write(path, tarinfo, fileobj)
+    elif tarinfo.isfile():
+      self._submit(path, tarinfo, fileobj.read())
+    elif tarinfo.isdev():
+      self._submit(path, tarinfo, None)
+    else:
+      logging.warning('Skipping %s, of unsupported type %r.', tarinfo.name,
+                      tarinfo.type)
+
+  def _finish(self):
+    """Creates the links, and applies the metadata of directories."""
+    for path, tarinfo in self._symlinks:
+      # A symlink may point anywhere, being resolved within the image's own
+      # root, but mustn't be placed through another one.
+      if not self._within(os.path.dirname(path)):
+        logging.warning('Skipping %s, which is outside of the filesystem.',
+                        tarinfo.name)
+        continue
+      _makedirs(os.path.dirname(path))
+      try:
+        os.symlink(tarinfo.linkname, path)
+      except OSError as e:
+        if e.errno != errno.EEXIST:
+          raise e
+        # e.g. a directory, created for the entries of a lower layer.
+        logging.warning('Skipping symlink %s, in place of an existing entry.',
+                        tarinfo.name)
+        continue
+      self._apply(path, tarinfo)
+
+    for path, tarinfo in self._hardlinks:
+      target = self._path(tarinfo.linkname)
+      if target is None or not os.path.lexists(target):
+        logging.warning('Skipping hardlink %s to missing %s.', tarinfo.name,
+                        tarinfo.linkname)
+        continue
+      # Link to the target as resolved, e.g. through the symlinks above, and
+      # only if it (and the hardlink) stays within the directory.
+      target = os.path.realpath(target)
+      if not (self._within(target) and
+              self._within(os.path.dirname(path))):
+        logging.warning('Skipping hardlink %s to %s, which is outside of the '
+                        'filesystem.', tarinfo.name, tarinfo.linkname)
+        continue
+      _makedirs(os.path.dirname(path))
+      os.link(target, path)
+
+    # Deepest first, so that no directory is made read-only (or has its mtime
+    # changed) before its children are in place.
+    for path, tarinfo in sorted(
+        self._directories, key=lambda x: x[0].count(os.sep), reverse=True):
+      self._apply(path, tarinfo)
+
+  # __enter__ and __exit__ allow use as a context manager.
+  def __enter__(self):
+    _makedirs(self._directory)
+    self._root = os.path.realpath(self._directory)
+    self._executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=self._threads)
+    return self
+
+  def __exit__(self, exception_type, unused_value, unused_traceback):
+    self._executor.shutdown(wait=True)
+    if exception_type is None:
+      if self._errors:
+        raise self._errors[0]
+      self._finish()
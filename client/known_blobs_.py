@@ -0,0 +1,147 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package records which blobs are known to exist in which repositories."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import errno
+import hashlib
+import io
+import os
+import time
+
+from containerregistry.client import docker_name
+import six.moves.urllib.parse
+
+# How long, in seconds, an entry is trusted after it was last confirmed.
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class KnownBlobs(object):
+  """A persistent record of the blobs confirmed to exist in repositories.
+
+  Pushes consult this before checking for a blob with a HEAD request, and
+  record each blob they find, upload or mount, as do pulls for the blobs of
+  the images they fetch.  Pushes also find the other repositories on the same
+  registry holding a blob, from which to mount it rather than upload it.
+
+  Entries are grouped by registry and blob, and each is a file holding the
+  name of a repository, whose mtime is when the blob was last confirmed to
+  exist there, so the record may be shared between processes (e.g. the many
+  pushes of a build).
+
+  Registries may garbage collect blobs that no manifest references, which is
+  what the TTL guards against: an entry older than ttl is ignored, and the
+  blob checked for again.
+
+  Args:
+    directory: the directory holding the record; created if missing.
+    ttl: the number of seconds for which an entry is trusted.
+  """
+
+  def __init__(self, directory, ttl = DEFAULT_TTL):
+    self._directory = directory
+    self._ttl = ttl
+
+  def _blob_directory(self, registry, digest):
+    return os.path.join(self._directory,
+                        six.moves.urllib.parse.quote(registry, ''),
+                        digest.replace(':', '-'))
+
+  def _path(self, name, digest):
+    return os.path.join(
+        self._blob_directory(name.registry, digest),
+        hashlib.sha256(name.repository.encode('utf8')).hexdigest())
+
+  def contains(self, name, digest):
+    """Whether digest was recently confirmed to exist in name's repository.
+
+    Args:
+      name: a docker_name.Repository (or Tag or Digest) to look in.
+      digest: the 'algo:digest' of the blob.
+
+    Returns:
+      Whether the blob was confirmed to exist within the TTL.
+    """
+    try:
+      mtime = os.stat(self._path(name, digest)).st_mtime
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise e
+      return False
+    return time.time() - mtime < self._ttl
+
+  def add(self, name, digest):
+    """Records that digest exists in name's repository, as of now.
+
+    Args:
+      name: a docker_name.Repository (or Tag or Digest) holding the blob.
+      digest: the 'algo:digest' of the blob.
+    """
+    path = self._path(name, digest)
+    try:
+      os.utime(path, None)
+      return
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise e
+    try:
+      os.makedirs(os.path.dirname(path))
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise e
+    # Concurrent writers write the same name, so need not be atomic.
+    with io.open(path, u'wb') as f:
+      f.write(name.repository.encode('utf8'))
+
+  def repositories(self, registry, digest):
+    """The repositories on registry recently confirmed to hold digest.
+
+    Args:
+      registry: the registry, e.g. 'gcr.io'.
+      digest: the 'algo:digest' of the blob.
+
+    Returns:
+      A list of docker_name.Repository, most recently confirmed first.
+    """
+    directory = self._blob_directory(registry, digest)
+    try:
+      names = os.listdir(directory)
+    except OSError as e:
+      if e.errno != errno.ENOENT:
+        raise e
+      return []
+
+    now = time.time()
+    found = []
+    for name in names:
+      path = os.path.join(directory, name)
+      try:
+        mtime = os.stat(path).st_mtime
+        with io.open(path, u'rb') as f:
+          repository = f.read().decode('utf8')
+      except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+          raise e
+        continue
+      if repository and now - mtime < self._ttl:
+        found.append((mtime, repository))
+    return [
+        docker_name.Repository('{registry}/{repository}'.format(
+            registry=registry, repository=repository))
+        for (_, repository) in sorted(found, reverse=True)
+    ]
@@ -0,0 +1,133 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package records which upload features registries support."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import errno
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+import six.moves.urllib.parse
+
+# How long, in seconds, what was learned about a registry is trusted.
+DEFAULT_TTL = 24 * 60 * 60
+
+# Whether a blob may be uploaded in a single POST to
+# /v2/<name>/blobs/uploads/?digest=<digest>
+MONOLITHIC = 'monolithic'
+
+# Whether a blob may be uploaded in the PUT that completes an upload,
+# after the POST that starts it, without a PATCH in between.
+PUT = 'put'
+
+# Whether blobs may be mounted from another repository on the registry.
+MOUNT = 'mount'
+
+# Whether the status of an interrupted upload may be queried, for it to be
+# resumed from the Range the registry reports having received.
+RANGE = 'range'
+
+# The minimum length the registry accepts for all but the last chunk of an
+# upload, per the OCI-Chunk-Min-Length header, or None.
+CHUNK_MIN_LENGTH = 'chunk_min_length'
+
+
+class Capabilities(object):
+  """A persistent record of what each registry was found to support.
+
+  Pushes start out assuming the fastest upload strategies work, and record
+  here which ones a registry rejected (or accepted), so that later pushes
+  go straight to the strategy with the fewest round trips that the registry
+  supports.
+
+  Each registry's record is a JSON file, whose mtime is when something was
+  last learned about the registry, so the record may be shared between
+  processes.  Registries are upgraded and reconfigured, which is what the
+  TTL guards against: a record older than ttl is ignored, and the registry
+  probed again.
+
+  Args:
+    directory: the directory holding the record; created if missing.
+    ttl: the number of seconds for which a registry's record is trusted.
+  """
+
+  def __init__(self, directory, ttl = DEFAULT_TTL):
+    self._directory = directory
+    self._ttl = ttl
+    self._lock = threading.Lock()
+
+  def _path(self, registry):
+    return os.path.join(self._directory,
+                        six.moves.urllib.parse.quote(registry, '') + '.json')
+
+  def get(self, registry):
+    """What registry was recently found to support.
+
+    Args:
+      registry: the registry, e.g. 'gcr.io'.
+
+    Returns:
+      A dict mapping capabilities (e.g. MONOLITHIC) to what was learned of
+      them within the TTL; capabilities not yet probed are absent.
+    """
+    path = self._path(registry)
+    try:
+      mtime = os.stat(path).st_mtime
+      with io.open(path, u'rb') as f:
+        content = f.read()
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise e
+      return {}
+    if time.time() - mtime >= self._ttl:
+      return {}
+    try:
+      return json.loads(content.decode('utf8'))
+    except ValueError:
+      # e.g. a record left by an incompatible version, so probe again.
+      return {}
+
+  def set(self, registry, capability, value):
+    """Records what was learned of one of registry's capabilities.
+
+    Args:
+      registry: the registry, e.g. 'gcr.io'.
+      capability: the capability, e.g. MONOLITHIC.
+      value: whether it is supported, or e.g. the CHUNK_MIN_LENGTH.
+    """
+    try:
+      os.makedirs(self._directory)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise e
+    with self._lock:
+      record = self.get(registry)
+      record[capability] = value
+      # Write and rename, so that concurrent readers never see partial files.
+      fd, temp = tempfile.mkstemp(dir=self._directory)
+      try:
+        with io.open(fd, u'wb') as f:
+          f.write(json.dumps(record, sort_keys=True).encode('utf8'))
+        os.rename(temp, self._path(registry))
+      finally:
+        if os.path.exists(temp):
+          os.unlink(temp)
@@ -0,0 +1,560 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package provides file-like streams over (compressed) blobs."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import collections
+import gzip
+import hashlib
+import io
+import re
+import sys
+import threading
+import zlib
+
+import concurrent.futures
+import six
+from six.moves import queue
+import six.moves.http_client
+
+try:
+  # zstd compressed layers are only supported when zstandard is installed.
+  import zstandard  # pylint: disable=g-import-not-at-top
+except ImportError:
+  zstandard = None
+
+# The size of the chunks in which we read and decompress blobs.  This bounds
+# the amount of compressed and uncompressed data held in memory per stream.
+CHUNK_SIZE = 1024 * 1024
+
+# The size of each Range request issued when streaming a blob from a registry.
+# Larger ranges mean fewer round trips, at the cost of more buffered data.
+RANGE_SIZE = 16 * CHUNK_SIZE
+
+# The default cap on the data Prefetch buffers, across all of its streams.
+PREFETCH_BUDGET = 256 * CHUNK_SIZE
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# The default zstd compression level, which is zstd's own default.
+ZSTD_LEVEL = 3
+
+# Instructs zlib to expect (and verify) a gzip header and trailer.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+_CONTENT_RANGE = re.compile(r'bytes\s+\d+-\d+/(\d+|\*)')
+
+
+class _Raw(io.RawIOBase):
+  """Adapts a file-like object to io.RawIOBase.
+
+  Args:
+    fileobj: the file-like object from which to read.
+    closeables: additional objects to close along with fileobj, e.g. the
+        tarfile from which fileobj was extracted.
+  """
+
+  def __init__(self, fileobj, closeables=()):
+    super(_Raw, self).__init__()
+    self._fileobj = fileobj
+    self._closeables = closeables
+
+  def readable(self):
+    return True
+
+  def readinto(self, b):
+    data = self._fileobj.read(len(b))
+    b[:len(data)] = data
+    return len(data)
+
+  def close(self):
+    if self.closed:
+      return
+    try:
+      self._fileobj.close()
+      for closeable in self._closeables:
+        closeable.close()
+    finally:
+      super(_Raw, self).close()
+
+
+class _GunzipReader(_Raw):
+  """Incrementally decompresses a gzip stream with zlib.decompressobj.
+
+  At most CHUNK_SIZE bytes of compressed input are held at a time, and no
+  more output is produced than the caller asks for.
+  """
+
+  def __init__(self, fileobj):
+    super(_GunzipReader, self).__init__(fileobj)
+    self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+    self._input = b''
+    self._started = False
+    self._eof = False
+
+  def readinto(self, b):
+    if not len(b):
+      return 0
+    while not self._eof:
+      if not self._input:
+        self._input = self._fileobj.read(CHUNK_SIZE)
+        if not self._input:
+          self._eof = True
+          if self._started and not self._decompressor.eof:
+            raise EOFError('Compressed stream ended before the '
+                           'end-of-stream marker was reached')
+          break
+
+      if self._decompressor.eof:
+        # Like gzip.GzipFile, accept concatenated gzip members, which may be
+        # padded with zeroes.
+        self._input = self._input.lstrip(b'\x00')
+        if not self._input:
+          continue
+        self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+
+      self._started = True
+      data = self._decompressor.decompress(self._input, len(b))
+      self._input = (
+          self._decompressor.unconsumed_tail or self._decompressor.unused_data)
+      if data:
+        b[:len(data)] = data
+        return len(data)
+    return 0
+
+
+class _RangedReader(io.RawIOBase):
+  """Reads a blob from a registry through a series of Range requests.
+
+  Registries that ignore the Range header simply return the entire blob with
+  the first response, which is then served from memory.
+
+  Args:
+    transport: the docker_http.Transport with which to issue requests.
+    url: the url of the blob.
+    range_size: the number of bytes to request at a time.
+  """
+
+  def __init__(self, transport, url, range_size=RANGE_SIZE):
+    super(_RangedReader, self).__init__()
+    self._transport = transport
+    self._url = url
+    self._range_size = range_size
+    self._offset = 0
+    self._buffer = b''
+    self._position = 0
+    self._done = False
+
+  def readable(self):
+    return True
+
+  def _fetch(self):
+    resp, content = self._transport.Request(
+        self._url,
+        accepted_codes=[
+            six.moves.http_client.OK, six.moves.http_client.PARTIAL_CONTENT,
+            six.moves.http_client.REQUESTED_RANGE_NOT_SATISFIABLE
+        ],
+        extra_headers={
+            'Range':
+                'bytes={start}-{end}'.format(
+                    start=self._offset,
+                    end=self._offset + self._range_size - 1)
+        })
+
+    if resp.status == six.moves.http_client.REQUESTED_RANGE_NOT_SATISFIABLE:
+      # We have read past the end of the blob (e.g. it is empty).
+      content = b''
+      self._done = True
+    elif resp.status == six.moves.http_client.OK:
+      # The Range header was ignored, and we received the entire blob.
+      content = content[self._offset:]
+      self._done = True
+    else:
+      m = _CONTENT_RANGE.match(resp.get('content-range', ''))
+      if m and m.group(1) != '*':
+        self._done = self._offset + len(content) >= int(m.group(1))
+      else:
+        self._done = len(content) < self._range_size
+
+    self._offset += len(content)
+    self._buffer = content
+    self._position = 0
+
+  def readinto(self, b):
+    if self._position >= len(self._buffer):
+      if self._done:
+        return 0
+      self._fetch()
+    n = min(len(b), len(self._buffer) - self._position)
+    b[:n] = self._buffer[self._position:self._position + n]
+    self._position += n
+    return n
+
+
+class _VerifyingReader(_Raw):
+  """Computes the sha256 of the data read, and checks it at end-of-stream."""
+
+  def __init__(self, fileobj, digest, on_mismatch):
+    super(_VerifyingReader, self).__init__(fileobj)
+    self._digest = digest
+    self._on_mismatch = on_mismatch
+    self._hasher = hashlib.sha256()
+    self._verified = False
+
+  def readinto(self, b):
+    n = super(_VerifyingReader, self).readinto(b)
+    if n:
+      self._hasher.update(memoryview(b)[:n])
+    elif not self._verified:
+      self._verified = True
+      computed = 'sha256:' + self._hasher.hexdigest()
+      if computed != self._digest:
+        raise self._on_mismatch(computed)
+    return n
+
+
+# Marks the end of a stream read by a Prefetch producer.
+_EOF = object()
+
+# How long a Prefetch producer waits on a full queue before checking whether
+# its stream has been abandoned.
+_PUT_INTERVAL = 0.1
+
+
+class _Failure(object):
+  """Carries an exception from a Prefetch producer to its consumer."""
+
+  def __init__(self, exc_info):
+    self.exc_info = exc_info
+
+
+class _QueueReader(io.RawIOBase):
+  """Reads the chunks a Prefetch producer places on a queue."""
+
+  def __init__(self, chunks, abandoned):
+    super(_QueueReader, self).__init__()
+    self._chunks = chunks
+    self._abandoned = abandoned
+    self._buffer = b''
+    self._position = 0
+    self._eof = False
+
+  def readable(self):
+    return True
+
+  def readinto(self, b):
+    if self._position >= len(self._buffer):
+      if self._eof:
+        return 0
+      item = self._chunks.get()
+      if item is _EOF:
+        self._eof = True
+        return 0
+      if isinstance(item, _Failure):
+        self._eof = True
+        six.reraise(*item.exc_info)
+      self._buffer = item
+      self._position = 0
+    n = min(len(b), len(self._buffer) - self._position)
+    b[:n] = self._buffer[self._position:self._position + n]
+    self._position += n
+    return n
+
+  def close(self):
+    # Readers (e.g. tarfile) may stop short of the end of the stream, so
+    # release the producer rather than leave it blocked on a full queue.
+    self._abandoned.set()
+    super(_QueueReader, self).close()
+
+
+def _put(chunks, item, abandoned):
+  while not abandoned.is_set():
+    try:
+      chunks.put(item, timeout=_PUT_INTERVAL)
+      return True
+    except queue.Full:
+      continue
+  return False
+
+
+def _produce(opener, chunks, abandoned):
+  """Reads the stream returned by opener onto the chunks queue."""
+  try:
+    with opener() as reader:
+      for chunk in iter(lambda: reader.read(CHUNK_SIZE), b''):
+        if not _put(chunks, chunk, abandoned):
+          return
+    _put(chunks, _EOF, abandoned)
+  except Exception:  # pylint: disable=broad-except
+    _put(chunks, _Failure(sys.exc_info()), abandoned)
+
+
+class Prefetch(object):
+  """Reads a sequence of streams in order, reading ahead on worker threads.
+
+  While the caller consumes one stream, the next `depth` streams are opened
+  and read (e.g. downloaded and decompressed) concurrently.  Streams are
+  yielded in their original order, and the data buffered ahead of the caller
+  is capped at roughly `memory_budget` bytes.
+
+  Args:
+    openers: callables returning the streams to read, in order.
+    depth: the number of streams to read ahead of the one being consumed.
+        With 0, streams are simply opened in turn on the calling thread.
+    memory_budget: the cap on the bytes buffered across all streams.
+  """
+
+  def __init__(self, openers, depth, memory_budget=PREFETCH_BUDGET):
+    self._openers = openers
+    self._depth = depth
+    self._chunks_per_stream = max(1,
+                                  memory_budget // ((depth + 1) * CHUNK_SIZE))
+    self._abandoned = []
+    self._executor = None
+
+  def __iter__(self):
+    if not self._depth:
+      for opener in self._openers:
+        yield opener()
+      return
+
+    openers = iter(self._openers)
+    pending = collections.deque()
+
+    def fill():
+      while len(pending) < self._depth + 1:
+        opener = next(openers, None)
+        if opener is None:
+          return
+        chunks = queue.Queue(maxsize=self._chunks_per_stream)
+        abandoned = threading.Event()
+        self._abandoned.append(abandoned)
+        self._executor.submit(_produce, opener, chunks, abandoned)
+        pending.append((chunks, abandoned))
+
+    fill()
+    while pending:
+      chunks, abandoned = pending.popleft()
+      yield io.BufferedReader(_QueueReader(chunks, abandoned), CHUNK_SIZE)
+      fill()
+
+  # __enter__ and __exit__ allow use as a context manager.
+  def __enter__(self):
+    if self._depth:
+      self._executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=self._depth + 1)
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    if self._executor:
+      for abandoned in self._abandoned:
+        abandoned.set()
+      self._executor.shutdown(wait=True)
+
+
+class Pipe(object):
+  """Hands the chunks written to it to a consumer reading on another thread.
+
+  This lets a stream being written somewhere (e.g. a layer to the cache) also
+  be read by a consumer that pulls from a file-like object (e.g. tarfile),
+  without buffering the stream or reading it a second time.  The writer
+  blocks while `depth` chunks wait on the consumer.  Once the consumer stops
+  reading, what is written is dropped.
+
+  Used as a context manager, exiting the block ends the stream, waits on the
+  consumer, and raises what it raised.  Exiting with an exception instead
+  aborts the consumer.  Its return value is then in `result`.
+
+  Args:
+    consumer: a callable taking a buffered stream over the chunks written.
+    depth: the number of chunks held for the consumer.
+  """
+
+  def __init__(self, consumer, depth=2):
+    self._chunks = queue.Queue(maxsize=depth)
+    self._abandoned = threading.Event()
+    self._exc_info = None
+    self.result = None
+    self._thread = threading.Thread(target=self._consume, args=(consumer,))
+    self._thread.daemon = True
+
+  def _consume(self, consumer):
+    try:
+      with io.BufferedReader(_QueueReader(self._chunks, self._abandoned),
+                             CHUNK_SIZE) as reader:
+        self.result = consumer(reader)
+    except Exception:  # pylint: disable=broad-except
+      self._exc_info = sys.exc_info()
+
+  def write(self, chunk):
+    _put(self._chunks, chunk, self._abandoned)
+
+  # __enter__ and __exit__ allow use as a context manager.
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      _put(self._chunks, _EOF, self._abandoned)
+    else:
+      _put(self._chunks, _Failure((exc_type, exc_value, traceback)),
+           self._abandoned)
+    self._thread.join()
+    if exc_type is None and self._exc_info:
+      six.reraise(*self._exc_info)
+
+
+def Reader(fileobj, closeables=()):
+  """Returns a buffered stream over fileobj.
+
+  Args:
+    fileobj: the file-like object from which to read.
+    closeables: additional objects to close when the stream is closed.
+
+  Returns:
+    An io.BufferedReader, which supports peek().
+  """
+  return io.BufferedReader(_Raw(fileobj, closeables), CHUNK_SIZE)
+
+
+def Gunzip(fileobj):
+  """Returns a buffered stream over the decompressed contents of fileobj."""
+  return io.BufferedReader(_GunzipReader(fileobj), CHUNK_SIZE)
+
+
+def IsGzipped(prefix):
+  """Checks the leading bytes of a blob for the gzip magic number."""
+  return prefix[:len(_GZIP_MAGIC)] == _GZIP_MAGIC
+
+
+def IsZstd(prefix):
+  """Checks the leading bytes of a blob for the zstd magic number."""
+  return prefix[:len(_ZSTD_MAGIC)] == _ZSTD_MAGIC
+
+
+def _zstandard():
+  if zstandard is None:
+    raise ImportError('zstd compressed layers require the zstandard module.')
+  return zstandard
+
+
+def Unzstd(fileobj):
+  """Returns a buffered stream over the decompressed contents of fileobj."""
+  reader = _zstandard().ZstdDecompressor().stream_reader(
+      fileobj, read_size=CHUNK_SIZE, read_across_frames=True)
+  return io.BufferedReader(_Raw(reader), CHUNK_SIZE)
+
+
+def Zstd(content, level=ZSTD_LEVEL):
+  """Returns content compressed with zstd."""
+  return _zstandard().ZstdCompressor(level=level).compress(content)
+
+
+class _HashingWriter(object):
+  """Writes to a file-like object, hashing and counting what is written."""
+
+  def __init__(self, fileobj):
+    self._fileobj = fileobj
+    self.hasher = hashlib.sha256()
+    self.size = 0
+
+  def write(self, data):
+    self.hasher.update(data)
+    self.size += len(data)
+    return self._fileobj.write(data)
+
+  def flush(self):
+    self._fileobj.flush()
+
+
+def Compress(fileobj, out, level, zstd=False):
+  """Compresses a stream into a file-like object, a chunk at a time.
+
+  The compressed content is hashed as it is written, so it need not be read
+  back to find its digest.
+
+  Args:
+    fileobj: the stream to compress, which is read once.
+    out: the file-like object to which to write the compressed content.
+    level: the compression level.
+    zstd: whether to compress with zstd rather than gzip.
+
+  Returns:
+    The 'sha256:' digest and the size of the compressed content.
+  """
+  writer = _HashingWriter(out)
+  if zstd:
+    _zstandard().ZstdCompressor(level=level).copy_stream(
+        fileobj, writer, read_size=CHUNK_SIZE)
+  else:
+    with gzip.GzipFile(mode='wb', compresslevel=level, fileobj=writer) as f:
+      for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        f.write(chunk)
+  return 'sha256:' + writer.hasher.hexdigest(), writer.size
+
+
+def Decompress(fileobj):
+  """Returns a stream over fileobj, decompressing it if it is compressed."""
+  reader = Reader(fileobj)
+  prefix = reader.peek(len(_ZSTD_MAGIC))
+  if IsGzipped(prefix):
+    return Gunzip(reader)
+  if IsZstd(prefix):
+    return Unzstd(reader)
+  return reader
+
+
+def Drain(fileobj):
+  """Reads fileobj to its end, discarding what remains of it.
+
+  tarfile's stream mode stops reading at the end-of-archive marker, short
+  of the end of the stream, where Verified checks a blob's digest and
+  Gunzip the CRC32 and size in the gzip trailer.  Readers that stop early
+  must drain the stream for those checks to run.
+
+  Args:
+    fileobj: the file-like object to read.
+  """
+  for unused_chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+    pass
+
+
+def Ranged(transport, url, range_size=RANGE_SIZE):
+  """Returns a buffered stream over a blob fetched with Range requests."""
+  return io.BufferedReader(
+      _RangedReader(transport, url, range_size), CHUNK_SIZE)
+
+
+def Verified(fileobj, digest, on_mismatch):
+  """Returns a stream over fileobj which checks its digest at end-of-stream.
+
+  Args:
+    fileobj: the file-like object from which to read.
+    digest: the expected 'sha256:...' digest of the contents of fileobj.
+    on_mismatch: a callable taking the computed digest, and returning the
+        exception to raise.
+
+  Returns:
+    A buffered stream, whose final read() raises on a digest mismatch.
+  """
+  return io.BufferedReader(
+      _VerifyingReader(fileobj, digest, on_mismatch), CHUNK_SIZE)
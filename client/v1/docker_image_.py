@@ -30,8 +30,10 @@ import tarfile
 import tempfile
 import threading
 
+import concurrent.futures
 from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
+from containerregistry.client import stream
 from containerregistry.client.v1 import docker_creds as v1_creds
 from containerregistry.client.v1 import docker_http
 
@@ -108,6 +110,10 @@ class DockerImage(six.with_metaclass(abc.ABCMeta, object)):
     unzipped = f.read()
     return unzipped
 
+  def uncompressed_layer_stream(self, layer_id):
+    """Same as uncompressed_layer() but returns a file-like object."""
+    return stream.Gunzip(io.BytesIO(self.layer(layer_id)))
+
   def diff_id(self, digest):
     """diff_id only exist in schema v22."""
     return None
@@ -151,19 +157,30 @@ gzip.time = _FakeTime()
 
 
 class FromShardedTarball(DockerImage):
-  """This decodes the sharded image tarballs from docker_build."""
+  """This decodes the sharded image tarballs from docker_build.
+
+  Each layer is gzipped once, a chunk at a time, into a temporary file from
+  which it is then served; these are removed by __exit__.  With threads > 1,
+  asking for a layer starts gzipping its ancestors too, that many at a time,
+  so that they are ready by the time they are asked for.
+  """
 
   def __init__(self,
                layer_to_tarball,
                top,
                name = None,
-               compresslevel = 9):
+               compresslevel = 9,
+               threads = 1):
     self._layer_to_tarball = layer_to_tarball
     self._top = top
     self._compresslevel = compresslevel
     self._memoize = {}
     self._lock = threading.Lock()
     self._name = name
+    self._threads = threads
+    self._executor = None
+    # Maps layer ids to Futures of the temporary files holding them gzipped.
+    self._spooled = {}
 
   def _content(self, layer_id, name, memoize = True):
     """Fetches a particular path's contents from the tarball."""
@@ -206,19 +223,57 @@ class FromShardedTarball(DockerImage):
     """Override."""
     return self._content(layer_id, layer_id + '/layer.tar', memoize=False)
 
-  # Large, do not memoize.
-  def layer(self, layer_id):
+  def uncompressed_layer_stream(self, layer_id):
     """Override."""
-    unzipped = self.uncompressed_layer(layer_id)
-    buf = io.BytesIO()
-    f = gzip.GzipFile(mode='wb', compresslevel=self._compresslevel, fileobj=buf)
+    # As in _content, open the tarfile for each stream we hand out.
+    tar = tarfile.open(name=self._layer_to_tarball(layer_id), mode='r:')
+    try:
+      name = layer_id + '/layer.tar'
+      try:
+        f = tar.extractfile(name)
+      except KeyError:
+        f = tar.extractfile('./' + name)
+    except:
+      tar.close()
+      raise
+    return stream.Reader(f, closeables=[tar])
+
+  def _spool(self, layer_id):
+    """Gzips a layer into a temporary file."""
+    fd, filename = tempfile.mkstemp(suffix='.tar.gz')
     try:
-      f.write(unzipped)
-    finally:
-      f.close()
+      with os.fdopen(fd, 'wb') as f:
+        with self.uncompressed_layer_stream(layer_id) as reader:
+          stream.Compress(reader, f, self._compresslevel)
+    except:
+      os.unlink(filename)
+      raise
+    return filename
+
+  def _spooled_layer(self, layer_id):
+    """Returns the file holding a layer gzipped, gzipping it on first use."""
+    ancestry = self.ancestry(layer_id) if self._executor else []
+    with self._lock:
+      for ancestor in ancestry[1:]:
+        if ancestor not in self._spooled:
+          self._spooled[ancestor] = self._executor.submit(
+              self._spool, ancestor)
+      future = self._spooled.get(layer_id)
+      owner = future is None
+      if owner:
+        future = self._spooled[layer_id] = concurrent.futures.Future()
+    if owner:
+      try:
+        future.set_result(self._spool(layer_id))
+      except Exception as e:  # pylint: disable=broad-except
+        future.set_exception(e)
+    return future.result()
 
-    zipped = buf.getvalue()
-    return zipped
+  # Large, do not memoize.
+  def layer(self, layer_id):
+    """Override."""
+    with io.open(self._spooled_layer(layer_id), u'rb') as f:
+      return f.read()
 
   def ancestry(self, layer_id):
     """Override."""
@@ -229,10 +284,19 @@ class FromShardedTarball(DockerImage):
 
   # __enter__ and __exit__ allow use as a context manager.
   def __enter__(self):
+    if self._threads > 1:
+      self._executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=self._threads)
     return self
 
   def __exit__(self, unused_type, unused_value, unused_traceback):
-    pass
+    if self._executor:
+      self._executor.shutdown(wait=True)
+      self._executor = None
+    for future in six.itervalues(self._spooled):
+      if future.done() and not future.exception():
+        os.unlink(future.result())
+    self._spooled = {}
 
 
 def _get_top(tarball, name = None):
@@ -267,12 +331,14 @@ class FromTarball(FromShardedTarball):
   def __init__(self,
                tarball,
                name = None,
-               compresslevel = 9):
+               compresslevel = 9,
+               threads = 1):
     super(FromTarball, self).__init__(
         lambda unused_id: tarball,
         _get_top(tarball, name),
         name=name,
-        compresslevel=compresslevel)
+        compresslevel=compresslevel,
+        threads=threads)
 
 
 class FromRegistry(DockerImage):
@@ -19,14 +19,15 @@ from __future__ import division
 from __future__ import print_function
 
 import abc
-import gzip
+import functools
 import io
 import json
-import os
 import tarfile
 
 from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
+from containerregistry.client import stream
+from containerregistry.client import whiteout
 from containerregistry.client.v2 import docker_digest
 from containerregistry.client.v2 import docker_http
 
@@ -84,11 +85,28 @@ class DockerImage(six.with_metaclass(abc.ABCMeta, object)):
 
   # pytype: enable=bad-return-type
 
+  def blob_stream(self, digest):
+    """Same as blob() but returns a file-like object over the raw blob."""
+    return stream.Reader(io.BytesIO(self.blob(digest)))
+
   def uncompressed_blob(self, digest):
     """Same as blob() but uncompressed."""
-    buf = io.BytesIO(self.blob(digest))
-    f = gzip.GzipFile(mode='rb', fileobj=buf)
-    return f.read()
+    with self.uncompressed_blob_stream(digest) as reader:
+      return reader.read()
+
+  def uncompressed_blob_stream(self, digest):
+    """Same as uncompressed_blob() but returns a file-like object.
+
+    The blob is decompressed incrementally as it is read, so only a bounded
+    amount of compressed and uncompressed data is held in memory.
+
+    Args:
+      digest: the 'algo:digest' of the layer being addressed.
+
+    Returns:
+      A file-like object over the uncompressed blob, which must be closed.
+    """
+    return stream.Gunzip(self.blob_stream(digest))
 
   def diff_id(self, digest):
     """diff_id only exist in schema v22."""
@@ -109,15 +127,23 @@ class DockerImage(six.with_metaclass(abc.ABCMeta, object)):
 
 
 class FromRegistry(DockerImage):
-  """This accesses a docker image hosted on a registry (non-local)."""
+  """This accesses a docker image hosted on a registry (non-local).
+
+  If the raw manifest was fetched already (e.g. by negotiate.FromRegistry),
+  passing it as manifest saves fetching it again.
+  """
 
   def __init__(self, name,
                basic_creds,
-               transport):
+               transport,
+               manifest = None):
     self._name = name
     self._creds = basic_creds
     self._original_transport = transport
     self._response = {}
+    if manifest is not None:
+      # Serve manifest() from what the caller fetched already.
+      self._response[docker_name.manifest_path(name)] = manifest
 
   def _content(self, suffix, cache = True):
     """Fetches content of the resources from registry by http calls."""
@@ -185,18 +211,21 @@ class FromRegistry(DockerImage):
             '%s vs. %s' % (self._name.digest, computed))
       return c
 
-  def blob_size(self, digest):
-    """The byte size of the raw blob."""
+  def _blob_url(self, digest):
     suffix = 'blobs/' + digest
     if isinstance(self._name, docker_name.Repository):
       suffix = '{repository}/{suffix}'.format(
           repository=self._name.repository, suffix=suffix)
 
+    return '{scheme}://{registry}/v2/{suffix}'.format(
+        scheme=docker_http.Scheme(self._name.registry),
+        registry=self._name.registry,
+        suffix=suffix)
+
+  def blob_size(self, digest):
+    """The byte size of the raw blob."""
     resp, unused_content = self._transport.Request(
-        '{scheme}://{registry}/v2/{suffix}'.format(
-            scheme=docker_http.Scheme(self._name.registry),
-            registry=self._name.registry,
-            suffix=suffix),
+        self._blob_url(digest),
         method='HEAD',
         accepted_codes=[six.moves.http_client.OK])
 
@@ -214,6 +243,18 @@ class FromRegistry(DockerImage):
           '%s vs. %s' % (digest, computed if c else '(content was empty)'))
     return c
 
+  def blob_stream(self, digest):
+    """Override."""
+    # GET server1/v2/<name>/blobs/<digest>, a range at a time.
+    def mismatch(computed):
+      return DigestMismatchedError(
+          'The returned content\'s digest did not match its content-address, '
+          '%s vs. %s' % (digest, computed))
+
+    return stream.Verified(
+        stream.Ranged(self._transport, self._blob_url(digest)), digest,
+        mismatch)
+
   def catalog(self, page_size = 100):
     # TODO(user): Handle docker_name.Repository for /v2/<name>/_catalog
     if isinstance(self._name, docker_name.Repository):
@@ -251,62 +292,49 @@ class FromRegistry(DockerImage):
     return '<docker_image.FromRegistry name: {}>'.format(str(self._name))
 
 
-def _in_whiteout_dir(fs, name):
-  while name:
-    dirname = os.path.dirname(name)
-    if name == dirname:
-      break
-    if fs.get(dirname):
-      return True
-    name = dirname
-  return False
-
-
-_WHITEOUT_PREFIX = '.wh.'
-
-
-def extract(image, tar):
+def extract(image,
+            tar,
+            prefetch = 0,
+            memory_budget = stream.PREFETCH_BUDGET):
   """Extract the final filesystem from the image into tar.
 
   Args:
     image: a docker image whose final filesystem to construct.
     tar: the open tarfile into which we are writing the final filesystem.
+    prefetch: the number of lower layers to fetch and decompress on worker
+        threads while the current layer is written into tar.  The image
+        must then be safe to read from multiple threads.
+    memory_budget: the cap on the layer data buffered by prefetching.
   """
-  # Maps all of the files we have already added (and should never add again)
-  # to whether they are a tombstone or not.
-  fs = {}
+  # Records all of the files we have already added (and should never add
+  # again), along with the tombstones and opaque directories hiding files in
+  # lower layers.
+  fs = whiteout.PathTrie()
 
   # Walk the layers, topmost first and add files.  If we've seen them in a
-  # higher layer then we skip them.
-  for layer in image.fs_layers():
-    buf = io.BytesIO(image.blob(layer))
-    with tarfile.open(mode='r:gz', fileobj=buf) as layer_tar:
-      for member in layer_tar.getmembers():
-        # If we see a whiteout file, then don't add anything to the tarball
-        # but ensure that any lower layers don't add a file with the whited
-        # out name.
-        basename = os.path.basename(member.name)
-        dirname = os.path.dirname(member.name)
-        tombstone = basename.startswith(_WHITEOUT_PREFIX)
-        if tombstone:
-          basename = basename[len(_WHITEOUT_PREFIX):]
-
-        # Before adding a file, check to see whether it (or its whiteout) have
-        # been seen before.
-        name = os.path.normpath(os.path.join('.', dirname, basename))
-        if name in fs:
-          continue
-
-        # Check for a whited out parent directory
-        if _in_whiteout_dir(fs, name):
-          continue
-
-        # Mark this file as handled by adding its name.
-        # A non-directory implicitly tombstones any entries with
-        # a matching (or child) name.
-        fs[name] = tombstone or not member.isdir()
-        if not tombstone:
+  # higher layer then we skip them.  Each layer is decompressed and read as a
+  # forward-only tar stream, so we never hold an entire layer in memory.
+  openers = [
+      functools.partial(image.uncompressed_blob_stream, layer)
+      for layer in image.fs_layers()
+  ]
+  with stream.Prefetch(openers, prefetch, memory_budget) as readers:
+    for reader in readers:
+      with reader, tarfile.open(mode='r|', fileobj=reader) as layer_tar:
+        for member in layer_tar:
+          # If we see a whiteout file, then don't add anything to the tarball
+          # but ensure that any lower layers don't add a file with the whited
+          # out name.  Likewise skip anything seen in (or hidden by) a higher
+          # layer.
+          if not fs.add(member.name, member.isdir()):
+            continue
+
           if member.isfile():
-            tar.addfile(member, fileobj=layer_tar.extractfile(member.name))
+            # In stream mode, this is only valid for the current member, whose
+            # payload addfile() copies through to tar in chunks.
+            tar.addfile(member, fileobj=layer_tar.extractfile(member))
           else:
             tar.addfile(member, fileobj=None)
+        # Verify the layer's digest (and gzip trailer) past the tarball.
+        stream.Drain(reader)
+        fs.next_layer()
@@ -48,7 +48,8 @@ class Push(object):
                creds,
                transport,
                mount = None,
-               threads = 1):
+               threads = 1,
+               known_blobs = None):
     """Constructor.
 
     If multiple threads are used, the caller *must* ensure that the provided
@@ -61,6 +62,8 @@ class Push(object):
       transport: the http transport to use for sending requests
       mount: list of repos from which to mount blobs.
       threads: the number of threads to use for uploads.
+      known_blobs: an optional known_blobs.KnownBlobs, recording the blobs
+          known to exist, whose existence checks may then be skipped.
 
     Raises:
       ValueError: an incorrectly typed argument was supplied.
@@ -70,6 +73,7 @@ class Push(object):
                                             docker_http.PUSH)
     self._mount = mount
     self._threads = threads
+    self._known_blobs = known_blobs
 
   def _scheme_and_host(self):
     return '{scheme}://{registry}'.format(
@@ -87,6 +91,9 @@ class Push(object):
 
   def _blob_exists(self, digest):
     """Check the remote for the given layer."""
+    if self._known_blobs and self._known_blobs.contains(self._name, digest):
+      return True
+
     # HEAD the blob, and check for a 200
     resp, unused_content = self._transport.Request(
         '{base_url}/blobs/{digest}'.format(
@@ -96,7 +103,10 @@ class Push(object):
             six.moves.http_client.OK, six.moves.http_client.NOT_FOUND
         ])
 
-    return resp.status == six.moves.http_client.OK  # pytype: disable=attribute-error
+    exists = resp.status == six.moves.http_client.OK  # pytype: disable=attribute-error
+    if exists and self._known_blobs:
+      self._known_blobs.add(self._name, digest)
+    return exists
 
   def _manifest_exists(self, image):
     """Check the remote for the given manifest by digest."""
@@ -255,14 +265,57 @@ class Push(object):
     return resp.status == six.moves.http_client.CREATED, resp.get('location')
     # pytype: enable=attribute-error,bad-return-type
 
+  def _upload_blob(self, image, digest):
+    """Upload a single layer, which is known not to exist already."""
+    self._put_blob(image, digest)
+    if self._known_blobs:
+      self._known_blobs.add(self._name, digest)
+    logging.info('Layer %s pushed.', digest)
+
   def _upload_one(self, image, digest):
     """Upload a single layer, after checking whether it exists already."""
     if self._blob_exists(digest):
       logging.info('Layer %s exists, skipping', digest)
       return
 
-    self._put_blob(image, digest)
-    logging.info('Layer %s pushed.', digest)
+    self._upload_blob(image, digest)
+
+  def _submit_blob(self, checks, uploads, image, digest):
+    """Check for, then upload, a single layer on separate executors.
+
+    Existence checks are issued ahead of, and concurrently with, uploads, so
+    the threads uploading never wait on them.
+
+    Args:
+      checks: the executor on which to check whether the layer exists.
+      uploads: the executor on which to upload the layer, which must outlive
+          checks.
+      image: the image holding the layer.
+      digest: the digest of the layer.
+
+    Returns:
+      A future, completed once the layer exists remotely.
+    """
+    result = concurrent.futures.Future()
+
+    def uploaded(future):
+      if future.exception() is not None:
+        result.set_exception(future.exception())
+      else:
+        result.set_result(None)
+
+    def checked(future):
+      if future.exception() is not None:
+        result.set_exception(future.exception())
+      elif future.result():
+        logging.info('Layer %s exists, skipping', digest)
+        result.set_result(None)
+      else:
+        uploads.submit(self._upload_blob, image,
+                       digest).add_done_callback(uploaded)
+
+    checks.submit(self._blob_exists, digest).add_done_callback(checked)
+    return result
 
   def upload(self, image):
     """Upload the layers of the given image.
@@ -285,9 +338,11 @@ class Push(object):
         self._upload_one(image, digest)
     else:
       with concurrent.futures.ThreadPoolExecutor(
-          max_workers=self._threads) as executor:
+          max_workers=self._threads) as executor, \
+          concurrent.futures.ThreadPoolExecutor(
+              max_workers=self._threads) as checks:
         future_to_params = {
-            executor.submit(self._upload_one, image, digest): (image, digest)
+            self._submit_blob(checks, executor, image, digest): (image, digest)
             for digest in image.blob_set()
         }
         for future in concurrent.futures.as_completed(future_to_params):
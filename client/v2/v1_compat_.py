@@ -101,6 +101,11 @@ class V1FromV2(v1_image.DockerImage):
     v2_digest = self._v1_to_v2.get(layer_id)
     return self._v2_image.uncompressed_blob(v2_digest)
 
+  def uncompressed_layer_stream(self, layer_id):
+    """Override."""
+    v2_digest = self._v1_to_v2.get(layer_id)
+    return self._v2_image.uncompressed_blob_stream(v2_digest)
+
   # Large, don't memoize
   def layer(self, layer_id):
     """Override."""
@@ -177,6 +182,10 @@ class V2FromV1(v2_image.DockerImage):
     """Override."""
     return self._v1_image.uncompressed_layer(self._layer_map[digest])
 
+  def uncompressed_blob_stream(self, digest):
+    """Override."""
+    return self._v1_image.uncompressed_layer_stream(self._layer_map[digest])
+
   def blob(self, digest):
     """Override."""
     return self._v1_image.layer(self._layer_map[digest])
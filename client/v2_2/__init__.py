@@ -28,6 +28,10 @@ from containerregistry.client.v2_2 import docker_http_
 setattr(x, 'docker_http', docker_http_)
 
 
+from containerregistry.client.v2_2 import estargz_
+setattr(x, 'estargz', estargz_)
+
+
 from containerregistry.client.v2_2 import docker_image_
 setattr(x, 'docker_image', docker_image_)
 
@@ -48,11 +52,31 @@ from containerregistry.client.v2_2 import v2_compat_
 setattr(x, 'v2_compat', v2_compat_)
 
 
+from containerregistry.client.v2_2 import negotiate_
+setattr(x, 'negotiate', negotiate_)
+
+
 from containerregistry.client.v2_2 import docker_session_
 setattr(x, 'docker_session', docker_session_)
 
 
+from containerregistry.client.v2_2 import mirror_
+setattr(x, 'mirror', mirror_)
+
+
+from containerregistry.client.v2_2 import layer_index_
+setattr(x, 'layer_index', layer_index_)
+
+
+from containerregistry.client.v2_2 import pull_cache_
+setattr(x, 'pull_cache', pull_cache_)
+
+
 from containerregistry.client.v2_2 import save_
 setattr(x, 'save', save_)
 
 
+from containerregistry.client.v2_2 import flatten_cache_
+setattr(x, 'flatten_cache', flatten_cache_)
+
+
@@ -18,12 +18,15 @@ from __future__ import division
 
 from __future__ import print_function
 
+import io
 import json
 
 from containerregistry.client import docker_name
+from containerregistry.client import stream
 from containerregistry.client.v2_2 import docker_digest
 from containerregistry.client.v2_2 import docker_http
 from containerregistry.client.v2_2 import docker_image
+from containerregistry.client.v2_2 import estargz
 from containerregistry.transform.v2_2 import metadata
 
 # _EMPTY_LAYER_TAR_ID is the sha256 of an empty tarball.
@@ -33,15 +36,16 @@ _EMPTY_LAYER_TAR_ID = 'sha256:a3ed95caeb02ffe68cdd9fd84406680ae93d633cb16422d00e
 class Layer(docker_image.DockerImage):
   """Appends a new layer on top of a base image.
 
-  This augments a base docker image with new files from a gzipped tarball,
-  adds environment variables and exposes a port.
+  This augments a base docker image with new files from a gzipped (or zstd
+  compressed) tarball, adds environment variables and exposes a port.
   """
 
   def __init__(self,
                base,
                tar_gz,
                diff_id = None,
-               overrides = None):
+               overrides = None,
+               seekable = False):
     """Creates a new layer on top of a base with optional tar.gz.
 
     Args:
@@ -52,6 +56,9 @@ class Layer(docker_image.DockerImage):
           uncompressed tar_gz.
       overrides: an optional metadata.Overrides object of properties to override
           on the base image.
+      seekable: whether to append tar_gz as a seekable (eStargz) layer,
+          converting it unless it already is one.  Conversion rewrites the
+          tarball, and so ignores diff_id.
     """
     self._base = base
     manifest = json.loads(self._base.manifest())
@@ -61,15 +68,34 @@ class Layer(docker_image.DockerImage):
     overrides = overrides.Override(created_by=docker_name.USER_AGENT)
 
     if tar_gz:
+      annotations = None
+      if seekable and not estargz.IsSeekable(tar_gz):
+        buf = io.BytesIO()
+        with stream.Decompress(io.BytesIO(tar_gz)) as reader:
+          (diff_id, toc_digest, uncompressed_size) = estargz.Build(reader, buf)
+        tar_gz = buf.getvalue()
+        annotations = {
+            estargz.TOC_DIGEST_ANNOTATION: toc_digest,
+            estargz.UNCOMPRESSED_SIZE_ANNOTATION: str(uncompressed_size),
+        }
+
       self._blob = tar_gz
       self._blob_sum = docker_digest.SHA256(self._blob)
-      manifest['layers'].append({
+      layer = {
           'digest': self._blob_sum,
           'mediaType': docker_http.LAYER_MIME,
           'size': len(self._blob),
-      })
+      }
+      if annotations:
+        layer['annotations'] = annotations
+      manifest['layers'].append(layer)
+      if stream.IsZstd(self._blob):
+        # Only OCI manifests can describe zstd layers.
+        layer['mediaType'] = docker_http.OCI_ZSTD_LAYER_MIME
+        manifest = docker_image.to_oci_manifest(manifest)
       if not diff_id:
-        diff_id = docker_digest.SHA256(self.uncompressed_blob(self._blob_sum))
+        with self.uncompressed_blob_stream(self._blob_sum) as reader:
+          diff_id = docker_digest.SHA256FromStream(reader)
 
       # Takes naked hex.
       overrides = overrides.Override(layers=[diff_id[len('sha256:'):]])
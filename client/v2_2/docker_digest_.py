@@ -20,8 +20,39 @@ from __future__ import print_function
 
 import hashlib
 
+_CHUNK_SIZE = 1024 * 1024
 
 
 def SHA256(content, prefix='sha256:'):
   """Return 'sha256:' + hex(sha256(content))."""
   return prefix + hashlib.sha256(content).hexdigest()
+
+
+def SHA256FromStream(fileobj, prefix='sha256:'):
+  """Same as SHA256(), but reads the content from fileobj in chunks."""
+  hasher = hashlib.sha256()
+  for chunk in iter(lambda: fileobj.read(_CHUNK_SIZE), b''):
+    hasher.update(chunk)
+  return prefix + hasher.hexdigest()
+
+
+def ChainIDs(diff_ids):
+  """Return the ChainID of each prefix of diff_ids, ordered bottom first.
+
+  A ChainID identifies the filesystem produced by applying a stack of layers,
+  as described by the OCI image specification:
+    ChainID(L0) = DiffID(L0)
+    ChainID(L0|...|Ln) = SHA256(ChainID(L0|...|Ln-1) + ' ' + DiffID(Ln))
+
+  Args:
+    diff_ids: the diff_ids of the layers, ordered bottom first.
+
+  Returns:
+    The list whose ith element is the ChainID of diff_ids[:i + 1].
+  """
+  chain_ids = []
+  for diff_id in diff_ids:
+    if chain_ids:
+      diff_id = SHA256((chain_ids[-1] + ' ' + diff_id).encode('utf8'))
+    chain_ids.append(diff_id)
+  return chain_ids
@@ -18,9 +18,11 @@ from __future__ import division
 
 from __future__ import print_function
 
+import hashlib
 import json
 import re
 import threading
+import time
 
 from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
@@ -49,8 +51,10 @@ OCI_MANIFEST_MIME = 'application/vnd.oci.image.manifest.v1+json'
 OCI_IMAGE_INDEX_MIME = 'application/vnd.oci.image.index.v1+json'
 OCI_LAYER_MIME = 'application/vnd.oci.image.layer.v1.tar'
 OCI_GZIP_LAYER_MIME = 'application/vnd.oci.image.layer.v1.tar+gzip'
+OCI_ZSTD_LAYER_MIME = 'application/vnd.oci.image.layer.v1.tar+zstd'
 OCI_NONDISTRIBUTABLE_LAYER_MIME = 'application/vnd.oci.image.layer.nondistributable.v1.tar'  # pylint disable=line-too-long
 OCI_NONDISTRIBUTABLE_GZIP_LAYER_MIME = 'application/vnd.oci.image.layer.nondistributable.v1.tar+gzip'  # pylint disable=line-too-long
+OCI_NONDISTRIBUTABLE_ZSTD_LAYER_MIME = 'application/vnd.oci.image.layer.nondistributable.v1.tar+zstd'  # pylint disable=line-too-long
 OCI_CONFIG_JSON_MIME = 'application/vnd.oci.image.config.v1+json'
 
 MANIFEST_SCHEMA1_MIMES = [MANIFEST_SCHEMA1_MIME, MANIFEST_SCHEMA1_SIGNED_MIME]
@@ -66,9 +70,24 @@ MANIFEST_LIST_MIMES = [OCI_IMAGE_INDEX_MIME, MANIFEST_LIST_MIME]
 # Docker & OCI layer mime types indicating foreign/non-distributable layers.
 NON_DISTRIBUTABLE_LAYER_MIMES = [
     FOREIGN_LAYER_MIME, OCI_NONDISTRIBUTABLE_LAYER_MIME,
+    OCI_NONDISTRIBUTABLE_GZIP_LAYER_MIME, OCI_NONDISTRIBUTABLE_ZSTD_LAYER_MIME
+]
+
+# gzipped tarball layers.
+GZIP_LAYER_MIMES = [
+    LAYER_MIME, FOREIGN_LAYER_MIME, OCI_GZIP_LAYER_MIME,
     OCI_NONDISTRIBUTABLE_GZIP_LAYER_MIME
 ]
 
+# zstd compressed layers, which only OCI manifests can describe.
+ZSTD_LAYER_MIMES = [OCI_ZSTD_LAYER_MIME, OCI_NONDISTRIBUTABLE_ZSTD_LAYER_MIME]
+
+# The OCI equivalents of Docker's (gzipped) layer mime types.
+OCI_LAYER_MIMES = {
+    LAYER_MIME: OCI_GZIP_LAYER_MIME,
+    FOREIGN_LAYER_MIME: OCI_NONDISTRIBUTABLE_GZIP_LAYER_MIME,
+}
+
 
 class Diagnostic(object):
   """Diagnostic encapsulates a Registry v2 diagnostic message.
@@ -164,6 +183,89 @@ _BEARER = 'Bearer'
 _REALM_PFX = 'realm='
 _SERVICE_PFX = 'service='
 
+# How long Bearer tokens last when the token exchange doesn't say, as the
+# Docker client assumes.
+_DEFAULT_TOKEN_TTL = 60
+
+# Cached Bearer tokens are reused until this many seconds before they expire.
+_TOKEN_EXPIRY_MARGIN = 10
+
+
+class _TokenCache(object):
+  """Shares Bearer tokens between Transports, by the scopes they cover.
+
+  Tokens are keyed by the realm and service that issued them, the basic
+  credentials exchanged for them, and their scopes.  A token covering a
+  superset of the scopes a Transport needs serves that Transport too.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    # Maps each key to a list of (scopes, token, expiry) tuples.
+    self._tokens = {}
+
+  def get(self, key, scopes):
+    """Returns an unexpired token for key covering scopes, or None."""
+    scopes = frozenset(scopes)
+    now = time.time()
+    with self._lock:
+      live = [entry for entry in self._tokens.get(key, []) if entry[2] > now]
+      self._tokens[key] = live
+      for (covered, token, unused_expiry) in live:
+        if scopes <= covered:
+          return token
+    return None
+
+  def put(self, key, scopes, token, ttl):
+    """Caches token, for key and scopes, for ttl seconds."""
+    expiry = time.time() + ttl - _TOKEN_EXPIRY_MARGIN
+    with self._lock:
+      self._tokens.setdefault(key, []).append(
+          (frozenset(scopes), token, expiry))
+
+  def evict(self, key, token):
+    """Forgets token, e.g. once the registry has rejected it."""
+    with self._lock:
+      self._tokens[key] = [
+          entry for entry in self._tokens.get(key, []) if entry[1] != token
+      ]
+
+
+_TOKENS = _TokenCache()
+
+# How long, in seconds, the challenge a registry answered a ping with is
+# reused by later Transports, in place of pinging it again.
+_CHALLENGE_TTL = 5 * 60
+
+
+class _ChallengeCache(object):
+  """Shares the (authentication, realm, service) registries challenge with.
+
+  Together with _TOKENS, this lets a Transport for another repository (or
+  child manifest) of a registry be made without any round trips.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    # Maps each registry's url to a (challenge, expiry) tuple.
+    self._challenges = {}
+
+  def get(self, url):
+    """Returns the unexpired challenge of the registry at url, or None."""
+    with self._lock:
+      challenge, expiry = self._challenges.get(url, (None, 0))
+    if expiry <= time.time():
+      return None
+    return challenge
+
+  def put(self, url, challenge):
+    """Caches the challenge of the registry at url."""
+    with self._lock:
+      self._challenges[url] = (challenge, time.time() + _CHALLENGE_TTL)
+
+
+_CHALLENGES = _ChallengeCache()
+
 
 class Transport(object):
   """HTTP Transport abstraction to handle automatic v2 reauthentication.
@@ -181,21 +283,35 @@ class Transport(object):
   transport should automatically refresh the Bearer token and reissue the
   request.
 
+  A single token may cover several scopes, e.g. push on the repository being
+  pushed plus pull on the repositories blobs are mounted from, all of which
+  are requested (and refreshed) together.  Tokens are shared between
+  transports needing the same (or fewer) scopes until they expire, so each
+  needn't exchange credentials of its own.
+
   Args:
      name: the structured name of the docker resource being referenced.
      creds: the basic authentication credentials to use for authentication
             challenge exchanges.
      transport: the HTTP transport to use under the hood.
      action: One of docker_http.ACTIONS, for which we plan to use this transport
+     scopes: optional resource scopes to request in addition to action on
+             name, e.g. 'repository:foo/bar:pull'.
   """
 
   def __init__(self, name,
                creds,
-               transport, action):
+               transport, action,
+               scopes = None):
     self._name = name
     self._basic_creds = creds
     self._transport = transport
     self._action = action
+    # Scopes requested in addition to the action on name.
+    self._extra_scopes = []
+    for scope in scopes or []:
+      if scope != self._Scope() and scope not in self._extra_scopes:
+        self._extra_scopes.append(scope)
     self._lock = threading.Lock()
 
     _CheckState(action in ACTIONS,
@@ -216,8 +332,21 @@ class Transport(object):
 
     Only called during transport construction, this pings the listed
     v2 registry.  The point of this ping is to establish the "realm"
-    and "service" to use for Basic for Bearer-Token exchanges.
+    and "service" to use for Basic for Bearer-Token exchanges, which are
+    then shared with other transports (see _CHALLENGES).
     """
+    url = '{scheme}://{registry}/v2/'.format(
+        scheme=Scheme(self._name.registry), registry=self._name.registry)
+    challenge = _CHALLENGES.get(url)
+    if challenge:
+      (self._authentication, self._realm, self._service) = challenge
+      return
+
+    self._PingRegistry(url)
+    _CHALLENGES.put(url, (self._authentication, self._realm, self._service))
+
+  def _PingRegistry(self, url):
+    """Issues the ping of _Ping, for the challenge at url."""
     # This initiates the pull by issuing a v2 ping:
     #   GET H:P/v2/
     headers = {
@@ -225,8 +354,7 @@ class Transport(object):
         'user-agent': docker_name.USER_AGENT,
     }
     resp, content = self._transport.request(
-        '{scheme}://{registry}/v2/'.format(
-            scheme=Scheme(self._name.registry), registry=self._name.registry),
+        url,
         'GET',
         body=None,
         headers=headers)
@@ -278,29 +406,77 @@ class Transport(object):
     """Construct the resource scope to pass to a v2 auth endpoint."""
     return self._name.scope(self._action)
 
-  def _Refresh(self):
+  def AddScopes(self, scopes):
+    """Extends the transport's credential to cover additional scopes.
+
+    For example, a push that mounts blobs from other repositories needs pull
+    access to them.  The Bearer token is refreshed (once) if any of scopes
+    is new.  If that fails, the transport is left with the scopes (and
+    credential) it had.
+
+    Args:
+      scopes: the resource scopes to add, e.g. 'repository:foo/bar:pull'.
+
+    Raises:
+      TokenRefreshException: Error during token exchange.
+    """
+    added = []
+    with self._lock:
+      for scope in scopes:
+        if scope != self._Scope() and scope not in self._extra_scopes:
+          self._extra_scopes.append(scope)
+          added.append(scope)
+    if not added or self._authentication != _BEARER:
+      return
+    try:
+      self._Refresh()
+    except TokenRefreshException:
+      with self._lock:
+        for scope in added:
+          self._extra_scopes.remove(scope)
+      raise
+
+  def _Refresh(self, rejected = None):
     """Refreshes the Bearer token credentials underlying this transport.
 
     This utilizes the "realm" and "service" established during _Ping to
     set up _creds with up-to-date credentials, by passing the
-    client-provided _basic_creds to the authorization realm.
+    client-provided _basic_creds to the authorization realm, unless another
+    transport has already done so for the same scopes.
 
-    This is generally called under two circumstances:
+    This is generally called under three circumstances:
       1) When the transport is created (eagerly)
-      2) When a request fails on a 401 Unauthorized
+      2) When scopes are added to the transport
+      3) When a request fails on a 401 Unauthorized
+
+    Args:
+      rejected: the token the registry rejected, in the last case, which is
+          then not reused.
 
     Raises:
       TokenRefreshException: Error during token exchange.
     """
+    authorization = self._basic_creds.Get()
+    with self._lock:
+      scopes = [self._Scope()] + self._extra_scopes
+    key = (self._realm, self._service,
+           hashlib.sha256((authorization or '').encode('utf8')).hexdigest())
+    if rejected:
+      _TOKENS.evict(key, rejected)
+    token = _TOKENS.get(key, scopes)
+    if token:
+      with self._lock:
+        self._creds = v2_2_creds.Bearer(token)
+      return
+
     headers = {
         'content-type': 'application/json',
         'user-agent': docker_name.USER_AGENT,
-        'Authorization': self._basic_creds.Get()
-    }
-    parameters = {
-        'scope': self._Scope(),
-        'service': self._service,
+        'Authorization': authorization
     }
+    # The auth endpoint accepts a repeated scope parameter.
+    parameters = [('scope', scope) for scope in scopes]
+    parameters.append(('service', self._service))
     resp, content = self._transport.request(
         # 'realm' includes scheme and path
         '{realm}?{query}'.format(
@@ -323,6 +499,8 @@ class Transport(object):
     wrapper_object = json.loads(content)
     token = wrapper_object.get('token') or wrapper_object.get('access_token')
     _CheckState(token is not None, 'Malformed JSON response: %s' % content)
+    _TOKENS.put(key, scopes, token,
+                int(wrapper_object.get('expires_in') or _DEFAULT_TOKEN_TTL))
 
     with self._lock:
       # We have successfully reauthenticated.
@@ -335,7 +513,8 @@ class Transport(object):
               method = None,
               body = None,
               content_type = None,
-              accepted_mimes = None
+              accepted_mimes = None,
+              extra_headers = None
              ):
     """Wrapper containing much of the boilerplate REST logic for Registry calls.
 
@@ -348,6 +527,7 @@ class Transport(object):
       content_type: the mime-type of the request (or None for JSON).
               content_type is ignored when body is None.
       accepted_mimes: the list of acceptable mime-types
+      extra_headers: additional headers to send (e.g. Range)
 
     Raises:
       BadStateException: an unexpected internal state has been encountered.
@@ -382,13 +562,16 @@ class Transport(object):
       if method in ('POST', 'PUT') and not body:
         headers['content-length'] = '0'
 
+      if extra_headers:
+        headers.update(extra_headers)
+
       resp, content = self._transport.request(
           url, method, body=body, headers=headers)
 
       if (retry_unauthorized and
           resp.status == six.moves.http_client.UNAUTHORIZED):
         # On Unauthorized, refresh the credential and retry.
-        self._Refresh()
+        self._Refresh(rejected=self._creds.suffix)
         continue
       break
 
@@ -19,17 +19,26 @@ from __future__ import division
 from __future__ import print_function
 
 import abc
+import copy
+import functools
 import gzip
 import io
 import json
 import os
+import shutil
 import tarfile
+import tempfile
 import threading
 
+import concurrent.futures
 from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
+from containerregistry.client import filesystem
+from containerregistry.client import stream
+from containerregistry.client import whiteout
 from containerregistry.client.v2_2 import docker_digest
 from containerregistry.client.v2_2 import docker_http
+from containerregistry.client.v2_2 import estargz
 import httplib2
 import six
 from six.moves import zip  # pylint: disable=redefined-builtin
@@ -115,13 +124,36 @@ class DockerImage(six.with_metaclass(abc.ABCMeta, object)):
     """
   # pytype: enable=bad-return-type
 
+  def blob_stream(self, digest):
+    """Same as blob() but returns a file-like object over the raw blob."""
+    return stream.Reader(io.BytesIO(self.blob(digest)))
+
+  def blob_range(self, digest, offset, length):
+    """Same as blob() but returns only length bytes starting at offset.
+
+    The bytes returned are not (and cannot be) verified against digest.
+    """
+    return self.blob(digest)[offset:offset + length]
+
   def uncompressed_blob(self, digest):
     """Same as blob() but uncompressed."""
-    zipped = self.blob(digest)
-    buf = io.BytesIO(zipped)
-    f = gzip.GzipFile(mode='rb', fileobj=buf)
-    unzipped = f.read()
-    return unzipped
+    with self.uncompressed_blob_stream(digest) as reader:
+      return reader.read()
+
+  def uncompressed_blob_stream(self, digest):
+    """Same as uncompressed_blob() but returns a file-like object.
+
+    The blob is decompressed incrementally as it is read, so only a bounded
+    amount of compressed and uncompressed data is held in memory.  Whether
+    the blob is gzip or zstd compressed is detected from its magic number.
+
+    Args:
+      digest: the 'algo:digest' of the layer being addressed.
+
+    Returns:
+      A file-like object over the uncompressed blob, which must be closed.
+    """
+    return stream.Decompress(self.blob_stream(digest))
 
   def _diff_id_to_digest(self, diff_id):
     for (this_digest, this_diff_id) in six.moves.zip(self.fs_layers(),
@@ -154,6 +186,10 @@ class DockerImage(six.with_metaclass(abc.ABCMeta, object)):
     """Same as layer() but uncompressed."""
     return self.uncompressed_blob(self._diff_id_to_digest(diff_id))
 
+  def uncompressed_layer_stream(self, diff_id):
+    """Same as uncompressed_layer() but returns a file-like object."""
+    return self.uncompressed_blob_stream(self._diff_id_to_digest(diff_id))
+
   # __enter__ and __exit__ allow use as a context manager.
   @abc.abstractmethod
   def __enter__(self):
@@ -215,10 +251,22 @@ class Delegate(DockerImage):
     """Override."""
     return self._image.blob(digest)
 
+  def blob_stream(self, digest):
+    """Override."""
+    return self._image.blob_stream(digest)
+
+  def blob_range(self, digest, offset, length):
+    """Override."""
+    return self._image.blob_range(digest, offset, length)
+
   def uncompressed_blob(self, digest):
     """Override."""
     return self._image.uncompressed_blob(digest)
 
+  def uncompressed_blob_stream(self, digest):
+    """Override."""
+    return self._image.uncompressed_blob_stream(digest)
+
   def layer(self, diff_id):
     """Override."""
     return self._image.layer(diff_id)
@@ -227,24 +275,43 @@ class Delegate(DockerImage):
     """Override."""
     return self._image.uncompressed_layer(diff_id)
 
+  def uncompressed_layer_stream(self, diff_id):
+    """Override."""
+    return self._image.uncompressed_layer_stream(diff_id)
+
   def __str__(self):
     """Override."""
     return str(self._image)
 
 
 class FromRegistry(DockerImage):
-  """This accesses a docker image hosted on a registry (non-local)."""
+  """This accesses a docker image hosted on a registry (non-local).
+
+  If known_blobs (a known_blobs.KnownBlobs) is given, the blobs of the image
+  are recorded in it as existing in the image's repository, from which later
+  pushes may then mount them.
+
+  If the raw manifest was fetched already (e.g. by negotiate.FromRegistry),
+  passing it as manifest saves fetching it again.
+  """
 
   def __init__(self,
                name,
                basic_creds,
                transport,
-               accepted_mimes = docker_http.MANIFEST_SCHEMA2_MIMES):
+               accepted_mimes = docker_http.MANIFEST_SCHEMA2_MIMES,
+               known_blobs = None,
+               manifest = None):
     self._name = name
     self._creds = basic_creds
     self._original_transport = transport
     self._accepted_mimes = accepted_mimes
+    self._known_blobs = known_blobs
+    self._remembered = False
     self._response = {}
+    if manifest is not None:
+      # Serve manifest() from what the caller fetched already.
+      self._response[docker_name.manifest_path(name)] = manifest
 
   def _content(self,
                suffix,
@@ -307,7 +374,7 @@ class FromRegistry(DockerImage):
 
     if isinstance(self._name, docker_name.Tag):
       path = 'manifests/' + self._name.tag
-      return self._content(path, self._accepted_mimes).decode('utf8')
+      c = self._content(path, self._accepted_mimes)
     else:
       assert isinstance(self._name, docker_name.Digest)
       c = self._content('manifests/' + self._name.digest, self._accepted_mimes)
@@ -316,24 +383,41 @@ class FromRegistry(DockerImage):
         raise DigestMismatchedError(
             'The returned manifest\'s digest did not match requested digest, '
             '%s vs. %s' % (self._name.digest, computed))
-      return c.decode('utf8')
+    if self._known_blobs and not self._remembered:
+      self._remember_blobs(json.loads(c.decode('utf8')))
+    return c.decode('utf8')
+
+  def _remember_blobs(self, manifest):
+    """Records the blobs of manifest in known_blobs."""
+    self._remembered = True
+    if 'layers' not in manifest:
+      # e.g. a manifest list, whose children are not blobs.
+      return
+    non_distributable = docker_http.NON_DISTRIBUTABLE_LAYER_MIMES
+    for layer in manifest['layers']:
+      if layer.get('mediaType') not in non_distributable:
+        self._known_blobs.add(self._name, layer['digest'])
+    self._known_blobs.add(self._name, manifest['config']['digest'])
 
   def config_file(self):
     """Override."""
     return self.blob(self.config_blob()).decode('utf8')
 
-  def blob_size(self, digest):
-    """The byte size of the raw blob."""
+  def _blob_url(self, digest):
     suffix = 'blobs/' + digest
     if isinstance(self._name, docker_name.Repository):
       suffix = '{repository}/{suffix}'.format(
           repository=self._name.repository, suffix=suffix)
 
+    return '{scheme}://{registry}/v2/{suffix}'.format(
+        scheme=docker_http.Scheme(self._name.registry),
+        registry=self._name.registry,
+        suffix=suffix)
+
+  def blob_size(self, digest):
+    """The byte size of the raw blob."""
     resp, unused_content = self._transport.Request(
-        '{scheme}://{registry}/v2/{suffix}'.format(
-            scheme=docker_http.Scheme(self._name.registry),
-            registry=self._name.registry,
-            suffix=suffix),
+        self._blob_url(digest),
         method='HEAD',
         accepted_codes=[six.moves.http_client.OK])
 
@@ -351,6 +435,36 @@ class FromRegistry(DockerImage):
           '%s vs. %s' % (digest, computed if c else '(content was empty)'))
     return c
 
+  def blob_stream(self, digest):
+    """Override."""
+    # GET server1/v2/<name>/blobs/<digest>, a range at a time.
+    def mismatch(computed):
+      return DigestMismatchedError(
+          'The returned content\'s digest did not match its content-address, '
+          '%s vs. %s' % (digest, computed))
+
+    return stream.Verified(
+        stream.Ranged(self._transport, self._blob_url(digest)), digest,
+        mismatch)
+
+  def blob_range(self, digest, offset, length):
+    """Override."""
+    # GET server1/v2/<name>/blobs/<digest> with a single Range.
+    resp, content = self._transport.Request(
+        self._blob_url(digest),
+        accepted_codes=[
+            six.moves.http_client.OK, six.moves.http_client.PARTIAL_CONTENT
+        ],
+        extra_headers={
+            'Range':
+                'bytes={start}-{end}'.format(
+                    start=offset, end=offset + length - 1)
+        })
+    if resp.status == six.moves.http_client.OK:
+      # The Range header was ignored, and we received the entire blob.
+      content = content[offset:offset + length]
+    return content
+
   def catalog(self, page_size = 100):
     # TODO(user): Handle docker_name.Repository for /v2/<name>/_catalog
     if isinstance(self._name, docker_name.Repository):
@@ -402,27 +516,79 @@ gzip.time = _FakeTime()
 
 
 # Checks the contents of a file for magic bytes that indicate that it's gzipped
+# (or zstd compressed).
 def is_compressed(name):
-  return name[0:2] == b'\x1f\x8b'
+  return stream.IsGzipped(name) or stream.IsZstd(name)
+
+
+# The compression FromTarball applies to layers.
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+
+def to_oci_manifest(manifest):
+  """Converts a parsed schema 2 manifest to OCI, e.g. for zstd layers."""
+  manifest['mediaType'] = docker_http.OCI_MANIFEST_MIME
+  manifest['config']['mediaType'] = docker_http.OCI_CONFIG_JSON_MIME
+  for layer in manifest['layers']:
+    layer['mediaType'] = docker_http.OCI_LAYER_MIMES.get(
+        layer['mediaType'], layer['mediaType'])
+  return manifest
+
+
+def _layer_mime(prefix):
+  """The mime type of a layer, given its leading bytes."""
+  if stream.IsZstd(prefix):
+    return docker_http.OCI_ZSTD_LAYER_MIME
+  return docker_http.LAYER_MIME
 
 
 class FromTarball(DockerImage):
-  """This decodes the image tarball output of docker_build for upload."""
+  """This decodes the image tarball output of docker_build for upload.
+
+  Uncompressed layers are compressed with gzip, or with compression=ZSTD
+  with zstd, in which case the image is served with an OCI manifest (which,
+  unlike schema 2, can describe zstd layers).  Each is compressed once, a
+  chunk at a time and hashed as it is written, into a temporary file from
+  which it is then served; these are removed by __exit__.
+
+  With threads > 1, the layers are compressed that many at a time, all
+  starting as soon as the manifest is first needed, instead of one after
+  another.
+
+  With seekable=True, the image's layers are (re)compressed as seekable
+  eStargz layers instead of plain gzipped tarballs.  This rewrites each
+  layer's tarball, so the image's config is rewritten with their new
+  diff_ids.
+  """
 
   def __init__(
       self,
       tarball,
       name = None,
       compresslevel = 9,
+      seekable = False,
+      compression = GZIP,
+      threads = 1,
   ):
+    if seekable and compression != GZIP:
+      raise ValueError('Seekable (eStargz) layers are gzip compressed.')
     self._tarball = tarball
     self._compresslevel = compresslevel
+    self._seekable = seekable
+    self._compression = compression
     self._memoize = {}
     self._lock = threading.Lock()
     self._name = name
     self._manifest = None
     self._blob_names = None
     self._config_blob = None
+    self._threads = threads
+    self._executor = None
+    # Maps the names of the layers being compressed (or converted to eStargz)
+    # to Futures of their _SpooledLayer, or of None for layers the tarball
+    # holds compressed already.
+    self._spooled = {}
 
   # Layers can come in two forms, as an uncompressed tar in a directory
   # or as a gzipped tar. We need to account for both options, and be able
@@ -452,34 +618,137 @@ class FromTarball(DockerImage):
       except KeyError:
         content = tar.extractfile(
             str('./' + name)).read()  # pytype: disable=attribute-error
-      # We need to compress before returning. Use gzip.
+      # We need to compress before returning. Use gzip (or zstd).
       if should_be_compressed and not is_compressed(content):
-        buf = io.BytesIO()
-        zipped = gzip.GzipFile(
-            mode='wb', compresslevel=self._compresslevel, fileobj=buf)
-        try:
-          zipped.write(content)
-        finally:
-          zipped.close()
-        content = buf.getvalue()
-      # The layer is gzipped but we need to return the uncompressed content
-      # Open up the gzip and read the contents after.
+        if self._compression == ZSTD:
+          content = stream.Zstd(content, level=self._compresslevel)
+        else:
+          buf = io.BytesIO()
+          zipped = gzip.GzipFile(
+              mode='wb', compresslevel=self._compresslevel, fileobj=buf)
+          try:
+            zipped.write(content)
+          finally:
+            zipped.close()
+          content = buf.getvalue()
+      # The layer is compressed but we need to return the uncompressed content
+      # Open up the gzip (or zstd) and read the contents after.
       elif not should_be_compressed and is_compressed(content):
-        buf = io.BytesIO(content)
-        raw = gzip.GzipFile(mode='rb', fileobj=buf)
-        content = raw.read()
+        with stream.Decompress(io.BytesIO(content)) as raw:
+          content = raw.read()
       # Populate our cache.
       if memoize:
         with self._lock:
           self._memoize[(name, should_be_compressed)] = content
       return content
 
-  def _gzipped_content(self, name):
-    """Returns the result of _content with gzip applied."""
+  def _compressed_content(self, name):
+    """Returns the result of _content with gzip (or zstd) applied."""
+    layer = self._spooled_layer(name)
+    if layer:
+      with io.open(layer.filename, u'rb') as f:
+        return f.read()
     return self._content(name, memoize=False, should_be_compressed=True)
 
+  def _spooled_layer(self, name):
+    """Returns the _SpooledLayer for a layer, compressing it on first use."""
+    with self._lock:
+      future = self._spooled.get(name)
+      owner = future is None
+      if owner:
+        future = self._spooled[name] = concurrent.futures.Future()
+    if owner:
+      try:
+        future.set_result(self._spool(name))
+      except Exception as e:  # pylint: disable=broad-except
+        future.set_exception(e)
+    return future.result()
+
+  def _compress_ahead(self, names):
+    """Starts compressing the named layers on our threads, if we have any."""
+    if not self._executor:
+      return
+    with self._lock:
+      for name in names:
+        if name not in self._spooled:
+          self._spooled[name] = self._executor.submit(self._spool, name)
+
+  def _spool(self, name):
+    """Compresses (or converts) a layer into a temporary file."""
+    if self._seekable:
+      fd, filename = tempfile.mkstemp(suffix='.tar.gz')
+      try:
+        with os.fdopen(fd, 'wb') as f:
+          with self._tarball_stream(name) as reader:
+            (diff_id, toc_digest, uncompressed_size) = estargz.Build(
+                reader, f, compresslevel=self._compresslevel)
+        with io.open(filename, u'rb') as f:
+          digest = docker_digest.SHA256FromStream(f)
+      except:
+        os.unlink(filename)
+        raise
+      return _SeekableLayer(filename, digest, os.path.getsize(filename),
+                            diff_id, toc_digest, uncompressed_size)
+
+    with self._tarball_member(name) as reader:
+      if is_compressed(reader.peek(4)):
+        return None
+      zstd = self._compression == ZSTD
+      fd, filename = tempfile.mkstemp(suffix='.tar.zst' if zstd else '.tar.gz')
+      try:
+        with os.fdopen(fd, 'wb') as f:
+          (digest, size) = stream.Compress(
+              reader, f, self._compresslevel, zstd=zstd)
+      except:
+        os.unlink(filename)
+        raise
+    return _SpooledLayer(
+        filename, digest, size,
+        docker_http.OCI_ZSTD_LAYER_MIME if zstd else docker_http.LAYER_MIME)
+
+  def _uncompressed_content(self, name):
+    """Returns a particular layer's uncompressed contents."""
+    if self._seekable:
+      with self._uncompressed_stream(name) as reader:
+        return reader.read()
+    return self._content(name, memoize=False, should_be_compressed=False)
+
+  def _uncompressed_stream(self, name):
+    """Returns a stream over a particular path's uncompressed contents."""
+    if self._seekable:
+      return stream.Gunzip(
+          stream.Reader(io.open(self._spooled_layer(name).filename, u'rb')))
+    return self._tarball_stream(name)
+
+  def _tarball_member(self, name):
+    """Returns a stream over a path's contents in the tarball, as is."""
+    # As in _content, open the tarfile for each stream we hand out.
+    tar = tarfile.open(name=self._tarball, mode='r')
+    try:
+      try:
+        f = tar.extractfile(str(name))
+      except KeyError:
+        f = tar.extractfile(str('./' + name))
+    except:
+      tar.close()
+      raise
+    return stream.Reader(f, closeables=[tar])
+
+  def _tarball_stream(self, name):
+    """Returns a stream over a path's contents in the tarball, decompressed."""
+    return stream.Decompress(self._tarball_member(name))
+
   def _populate_manifest_and_blobs(self):
     """Populates self._manifest and self._blob_names."""
+    # _layer_sources is keyed by the diff_ids of the original layers.
+    config = json.loads(self._content(self._config_file).decode('utf8'))
+    diff_ids = config['rootfs']['diff_ids']
+
+    self._compress_ahead([
+        layer for (layer, diff_id) in zip(self._layers, diff_ids)
+        if diff_id not in self._layer_sources
+    ])
+
     config_blob = docker_digest.SHA256(self.config_file().encode('utf8'))
     manifest = {
         'mediaType': docker_http.MANIFEST_SCHEMA2_MIME,
@@ -496,15 +765,13 @@ class FromTarball(DockerImage):
 
     blob_names = {}
 
-    config = json.loads(self.config_file())
-    diff_ids = config['rootfs']['diff_ids']
-
     for i, layer in enumerate(self._layers):
       name = None
       diff_id = diff_ids[i]
       media_type = docker_http.LAYER_MIME
       size = 0
       urls = []
+      annotations = None
 
       if diff_id in self._layer_sources:
         # _layer_sources contains foreign layers from the base image
@@ -513,10 +780,18 @@ class FromTarball(DockerImage):
         size = self._layer_sources[diff_id]['size']
         if 'urls' in self._layer_sources[diff_id]:
           urls = self._layer_sources[diff_id]['urls']
+      elif self._spooled_layer(layer):
+        spooled_layer = self._spooled_layer(layer)
+        name = spooled_layer.digest
+        size = spooled_layer.size
+        media_type = spooled_layer.media_type
+        annotations = spooled_layer.annotations()
       else:
-        content = self._gzipped_content(layer)
+        # The tarball holds the layer compressed already.
+        content = self._compressed_content(layer)
         name = docker_digest.SHA256(content)
         size = len(content)
+        media_type = _layer_mime(content)
 
       blob_names[name] = layer
 
@@ -529,8 +804,15 @@ class FromTarball(DockerImage):
       if urls:
         layer_manifest['urls'] = urls
 
+      if annotations:
+        layer_manifest['annotations'] = annotations
+
       manifest['layers'].append(layer_manifest)
 
+    if any(layer['mediaType'] in docker_http.ZSTD_LAYER_MIMES
+           for layer in manifest['layers']):
+      manifest = to_oci_manifest(manifest)
+
     with self._lock:
       self._manifest = manifest
       self._blob_names = blob_names
@@ -544,17 +826,30 @@ class FromTarball(DockerImage):
 
   def config_file(self):
     """Override."""
-    return self._content(self._config_file).decode('utf8')
+    config_file = self._content(self._config_file).decode('utf8')
+    if not self._seekable:
+      return config_file
+    # Swap in the diff_ids of the layers as converted to eStargz.
+    config = json.loads(config_file)
+    config['rootfs']['diff_ids'] = [
+        diff_id if diff_id in self._layer_sources else
+        self._spooled_layer(layer).diff_id
+        for (layer, diff_id) in zip(self._layers, config['rootfs']['diff_ids'])
+    ]
+    return json.dumps(config, sort_keys=True)
 
   # Could be large, do not memoize
   def uncompressed_blob(self, digest):
     """Override."""
     if not self._blob_names:
       self._populate_manifest_and_blobs()
-    return self._content(
-        self._blob_names[digest],
-        memoize=False,
-        should_be_compressed=False)
+    return self._uncompressed_content(self._blob_names[digest])
+
+  def uncompressed_blob_stream(self, digest):
+    """Override."""
+    if not self._blob_names:
+      self._populate_manifest_and_blobs()
+    return self._uncompressed_stream(self._blob_names[digest])
 
   # Could be large, do not memoize
   def blob(self, digest):
@@ -563,17 +858,34 @@ class FromTarball(DockerImage):
       self._populate_manifest_and_blobs()
     if digest == self._config_blob:
       return self.config_file().encode('utf8')
-    return self._gzipped_content(
+    return self._compressed_content(
         self._blob_names[digest])
 
-  # Could be large, do not memoize
-  def uncompressed_layer(self, diff_id):
+  def blob_stream(self, digest):
     """Override."""
+    if not self._blob_names:
+      self._populate_manifest_and_blobs()
+    if digest != self._config_blob:
+      layer = self._spooled_layer(self._blob_names[digest])
+      if layer:
+        return stream.Reader(io.open(layer.filename, u'rb'))
+    return super(FromTarball, self).blob_stream(digest)
+
+  def _diff_id_to_layer(self, diff_id):
     for (layer, this_diff_id) in zip(reversed(self._layers), self.diff_ids()):
       if diff_id == this_diff_id:
-        return self._content(layer, memoize=False, should_be_compressed=False)
+        return layer
     raise ValueError('Unmatched "diff_id": "%s"' % diff_id)
 
+  # Could be large, do not memoize
+  def uncompressed_layer(self, diff_id):
+    """Override."""
+    return self._uncompressed_content(self._diff_id_to_layer(diff_id))
+
+  def uncompressed_layer_stream(self, diff_id):
+    """Override."""
+    return self._uncompressed_stream(self._diff_id_to_layer(diff_id))
+
   def _resolve_tag(self):
     """Resolve the singleton tag this tarball contains using legacy methods."""
     repo_bytes = self._content('repositories', memoize=False)
@@ -631,10 +943,53 @@ class FromTarball(DockerImage):
     #   layer shards Bazel produces.
     # 2) Performance of the case where all we read is the config_file().
 
+    if self._threads > 1:
+      self._executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=self._threads)
+
     return self
 
   def __exit__(self, unused_type, unused_value, unused_traceback):
-    pass
+    if self._executor:
+      self._executor.shutdown(wait=True)
+      self._executor = None
+    for future in six.itervalues(self._spooled):
+      if future.done() and not future.exception() and future.result():
+        os.unlink(future.result().filename)
+    self._spooled = {}
+
+
+class _SpooledLayer(object):
+  """A layer of a FromTarball, as compressed into a temporary file."""
+
+  def __init__(self, filename, digest, size, media_type):
+    self.filename = filename
+    self.digest = digest
+    self.size = size
+    self.media_type = media_type
+
+  def annotations(self):
+    """The manifest annotations describing the layer, if any."""
+    return None
+
+
+class _SeekableLayer(_SpooledLayer):
+  """A layer of a FromTarball, as converted to eStargz."""
+
+  def __init__(self, filename, digest, size, diff_id, toc_digest,
+               uncompressed_size):
+    super(_SeekableLayer, self).__init__(filename, digest, size,
+                                         docker_http.LAYER_MIME)
+    self.diff_id = diff_id
+    self.toc_digest = toc_digest
+    self.uncompressed_size = uncompressed_size
+
+  def annotations(self):
+    """The manifest annotations describing the layer."""
+    return {
+        estargz.TOC_DIGEST_ANNOTATION: self.toc_digest,
+        estargz.UNCOMPRESSED_SIZE_ANNOTATION: str(self.uncompressed_size),
+    }
 
 
 class FromDisk(DockerImage):
@@ -722,28 +1077,35 @@ class FromDisk(DockerImage):
       base_layers += self._get_foreign_layers()
 
     # TODO(user): Update mimes here for oci_compat.
-    self._manifest = json.dumps(
-        {
-            'schemaVersion':
-                2,
+    manifest = {
+        'schemaVersion':
+            2,
+        'mediaType':
+            docker_http.MANIFEST_SCHEMA2_MIME,
+        'config': {
             'mediaType':
-                docker_http.MANIFEST_SCHEMA2_MIME,
-            'config': {
-                'mediaType':
-                    docker_http.CONFIG_JSON_MIME,
-                'size':
-                    len(self.config_file()),
-                'digest':
-                    docker_digest.SHA256(self.config_file().encode('utf8'))
-            },
-            'layers':
-                base_layers + [{
-                    'mediaType': docker_http.LAYER_MIME,
-                    'size': self.blob_size(digest),
-                    'digest': digest
-                } for digest in self._layers]
+                docker_http.CONFIG_JSON_MIME,
+            'size':
+                len(self.config_file()),
+            'digest':
+                docker_digest.SHA256(self.config_file().encode('utf8'))
         },
-        sort_keys=True)
+        'layers':
+            base_layers + [{
+                'mediaType': self._layer_mime(digest),
+                'size': self.blob_size(digest),
+                'digest': digest
+            } for digest in self._layers]
+    }
+    # Only OCI manifests can describe zstd layers.
+    if any(layer['mediaType'] in docker_http.ZSTD_LAYER_MIMES
+           for layer in manifest['layers']):
+      manifest = to_oci_manifest(manifest)
+    self._manifest = json.dumps(manifest, sort_keys=True)
+
+  def _layer_mime(self, digest):
+    with io.open(self._layer_to_filename[digest], u'rb') as reader:
+      return _layer_mime(reader.read(4))
 
   def manifest(self):
     """Override."""
@@ -766,6 +1128,15 @@ class FromDisk(DockerImage):
         return self._legacy_base.uncompressed_blob(digest)
     return super(FromDisk, self).uncompressed_blob(digest)
 
+  def uncompressed_blob_stream(self, digest):
+    """Override."""
+    if digest not in self._layer_to_filename:
+      if self._get_foreign_layer_by_digest(digest):
+        return stream.Reader(io.BytesIO(b''))
+      else:
+        return self._legacy_base.uncompressed_blob_stream(digest)
+    return super(FromDisk, self).uncompressed_blob_stream(digest)
+
   def uncompressed_layer(self, diff_id):
     if diff_id in self._uncompressed_layer_to_filename:
       with io.open(self._uncompressed_layer_to_filename[diff_id],
@@ -776,6 +1147,15 @@ class FromDisk(DockerImage):
       return self._legacy_base.uncompressed_layer(diff_id)
     return super(FromDisk, self).uncompressed_layer(diff_id)
 
+  def uncompressed_layer_stream(self, diff_id):
+    """Override."""
+    if diff_id in self._uncompressed_layer_to_filename:
+      return stream.Reader(
+          io.open(self._uncompressed_layer_to_filename[diff_id], u'rb'))
+    if self._legacy_base and diff_id in self._legacy_base.diff_ids():
+      return self._legacy_base.uncompressed_layer_stream(diff_id)
+    return super(FromDisk, self).uncompressed_layer_stream(diff_id)
+
   # Could be large, do not memoize
   def blob(self, digest):
     """Override."""
@@ -784,6 +1164,20 @@ class FromDisk(DockerImage):
     with open(self._layer_to_filename[digest], 'rb') as reader:
       return reader.read()
 
+  def blob_stream(self, digest):
+    """Override."""
+    if digest not in self._layer_to_filename:
+      return self._legacy_base.blob_stream(digest)
+    return stream.Reader(io.open(self._layer_to_filename[digest], u'rb'))
+
+  def blob_range(self, digest, offset, length):
+    """Override."""
+    if digest not in self._layer_to_filename:
+      return self._legacy_base.blob_range(digest, offset, length)
+    with io.open(self._layer_to_filename[digest], u'rb') as reader:
+      reader.seek(offset)
+      return reader.read(length)
+
   def blob_size(self, digest):
     """Override."""
     if digest not in self._layer_to_filename:
@@ -799,62 +1193,301 @@ class FromDisk(DockerImage):
     pass
 
 
-def _in_whiteout_dir(fs, name):
-  while name:
-    dirname = os.path.dirname(name)
-    if name == dirname:
-      break
-    if fs.get(dirname):
-      return True
-    name = dirname
-  return False
+def _flatten_layers(openers, prefetch, memory_budget):
+  """Yields the entries of the filesystem produced by a stack of layers.
 
+  Args:
+    openers: callables returning streams over the uncompressed layers,
+        topmost first.
+    prefetch: the number of lower layers to fetch and decompress ahead.
+    memory_budget: the cap on the layer data buffered by prefetching.
+
+  Yields:
+    (tarinfo, fileobj) for each entry, where fileobj holds the payload of
+    regular files (and is None otherwise).  As layers are read as streams, a
+    fileobj is only valid until the next entry is requested.
+  """
+  # Records all of the files we have already added (and should never add
+  # again), along with the tombstones and opaque directories hiding files in
+  # lower layers.
+  fs = whiteout.PathTrie()
+
+  # Walk the layers, topmost first and add files.  If we've seen them in a
+  # higher layer then we skip them.  Each layer is decompressed and read as a
+  # forward-only tar stream, so we never hold an entire layer in memory.
+  with stream.Prefetch(openers, prefetch, memory_budget) as readers:
+    for reader in readers:
+      with reader, tarfile.open(mode='r|', fileobj=reader) as layer_tar:
+        for tarinfo in layer_tar:
+          # If we see a whiteout file, then don't add anything to the tarball
+          # but ensure that any lower layers don't add a file with the whited
+          # out name.  Likewise skip anything seen in (or hidden by) a higher
+          # layer.
+          if not fs.add(tarinfo.name, tarinfo.isdir()):
+            continue
+
+          if tarinfo.isfile():
+            # In stream mode, this is only valid for the current member.
+            yield tarinfo, layer_tar.extractfile(tarinfo)
+          else:
+            yield tarinfo, None
+        # Verify the layer's digest (and gzip trailer) past the tarball.
+        stream.Drain(reader)
+        fs.next_layer()
 
-_WHITEOUT_PREFIX = '.wh.'
 
+def _flatten(image, prefetch, memory_budget, cache, cache_layers):
+  """Yields the entries of the image's final filesystem.
 
-def extract(image, tar):
+  Args:
+    image: a docker image whose final filesystem to construct.
+    prefetch: the number of lower layers to fetch and decompress ahead.
+    memory_budget: the cap on the layer data buffered by prefetching.
+    cache: an optional flatten_cache.FlattenCache.
+    cache_layers: the number of bottom layers whose flattened filesystem
+        should be cached, or if negative the number of top layers which
+        should not.
+
+  Yields:
+    The entries, as with _flatten_layers.
+  """
+  diff_ids = image.diff_ids()
+  openers = [
+      functools.partial(image.uncompressed_layer_stream, layer)
+      for layer in diff_ids
+  ]
+  if cache is None:
+    for entry in _flatten_layers(openers, prefetch, memory_budget):
+      yield entry
+    return
+
+  # A flattened filesystem contains no whiteouts, so the cached one for the
+  # image's bottom layers stands in for them as if it were a single layer.
+  chain_ids = docker_digest.ChainIDs(list(reversed(diff_ids)))
+  base, depth = None, 0
+  for i in reversed(range(len(chain_ids))):
+    base = cache.open(chain_ids[i])
+    if base is not None:
+      depth = i + 1
+      break
+
+  if cache_layers < 0:
+    cache_layers += len(diff_ids)
+  cache_layers = min(cache_layers, len(diff_ids))
+  try:
+    if cache_layers > depth:
+      # Extend the cached filesystem up to cache_layers, for the benefit of
+      # other images sharing them.
+      lower = openers[len(openers) - cache_layers:len(openers) - depth]
+      if base is not None:
+        lower.append(lambda reader=base: reader)
+
+      def write(tar):
+        for tarinfo, fileobj in _flatten_layers(lower, prefetch,
+                                                memory_budget):
+          tar.addfile(tarinfo, fileobj=fileobj)
+
+      extended = cache.put(chain_ids[cache_layers - 1], write)
+      if base is not None:
+        base.close()
+      base, depth = extended, cache_layers
+
+    upper = openers[:len(openers) - depth]
+    if base is not None:
+      upper.append(lambda reader=base: reader)
+    for entry in _flatten_layers(upper, prefetch, memory_budget):
+      yield entry
+  finally:
+    if base is not None:
+      base.close()
+
+
+def extract(image,
+            tar,
+            prefetch = 0,
+            memory_budget = stream.PREFETCH_BUDGET,
+            cache = None,
+            cache_layers = -1):
   """Extract the final filesystem from the image into tar.
 
   Args:
     image: a docker image whose final filesystem to construct.
     tar: the tarfile into which we are writing the final filesystem.
+    prefetch: the number of lower layers to fetch and decompress on worker
+        threads while the current layer is written into tar.  The image
+        must then be safe to read from multiple threads.
+    memory_budget: the cap on the layer data buffered by prefetching.
+    cache: an optional flatten_cache.FlattenCache, from which the flattened
+        filesystem of the image's bottom layers is read when present.
+    cache_layers: the number of bottom layers whose flattened filesystem to
+        add to the cache, or if negative the number of top layers to leave
+        out of it.  By default, all but the topmost layer are cached.
   """
-  # Maps all of the files we have already added (and should never add again)
-  # to whether they are a tombstone or not.
-  fs = {}
+  for tarinfo, fileobj in _flatten(image, prefetch, memory_budget, cache,
+                                   cache_layers):
+    # addfile() copies file payloads through to tar in chunks.
+    tar.addfile(tarinfo, fileobj=fileobj)
 
-  # Walk the layers, topmost first and add files.  If we've seen them in a
-  # higher layer then we skip them
+
+def extract_to_directory(image,
+                         directory,
+                         prefetch = 0,
+                         memory_budget = stream.PREFETCH_BUDGET,
+                         threads = 8,
+                         content_store = None,
+                         cache = None,
+                         cache_layers = -1):
+  """Extract the final filesystem from the image into a directory.
+
+  This is equivalent to untarring the output of extract(), without writing
+  and reading the intermediate tarball.
+
+  Args:
+    image: a docker image whose final filesystem to construct.
+    directory: the directory under which to write the final filesystem.
+    prefetch: the number of lower layers to fetch and decompress on worker
+        threads while the current layer is written.  The image must then be
+        safe to read from multiple threads.
+    memory_budget: the cap on the layer data buffered by prefetching.
+    threads: the number of threads with which to write files.
+    content_store: an optional filesystem.ContentStore, from which files
+        with identical contents are reflinked or hardlinked.
+    cache: an optional flatten_cache.FlattenCache, as with extract().
+    cache_layers: which layers to add to the cache, as with extract().
+  """
+  with filesystem.Writer(directory, threads, content_store) as writer:
+    for tarinfo, fileobj in _flatten(image, prefetch, memory_budget, cache,
+                                     cache_layers):
+      writer.add(tarinfo, fileobj)
+
+
+def _spool(fileobj):
+  """Copies fileobj into a temporary file, held in memory while it's small."""
+  spool = tempfile.SpooledTemporaryFile(max_size=stream.CHUNK_SIZE)
+  shutil.copyfileobj(fileobj, spool, stream.CHUNK_SIZE)
+  spool.seek(0)
+  return spool
+
+
+def extract_paths(image, paths):
+  """Extract the given paths from the image's final filesystem.
+
+  Layers are read topmost first, and only until each of the paths has been
+  found or is known to be absent (e.g. it was whited out), so the layers
+  beneath them are never fetched.  Symlinks are returned as such, rather
+  than followed.  Hardlinks are returned as the regular files they link to,
+  whose contents are read from their layer a second time, as they precede
+  the link.
+
+  Args:
+    image: a docker image from whose final filesystem to extract paths.
+    paths: the paths to extract, e.g. '/etc/os-release'.
+
+  Returns:
+    A dict mapping each of the paths present in the image to a tuple of
+    its tarfile.TarInfo and, for regular files, a stream over its contents
+    (and None otherwise).  Absent paths are omitted.
+  """
+
+  def normalize(name):
+    return os.path.normpath(os.path.join('.', name.lstrip('/')))
+
+  def add(aliases, tarinfo, fileobj):
+    # Paths naming the same file each get a stream of their own.
+    for path in aliases[1:]:
+      spool = None
+      if fileobj is not None:
+        spool = _spool(fileobj)
+        fileobj.seek(0)
+      found[path] = (tarinfo, spool)
+    found[aliases[0]] = (tarinfo, fileobj)
+
+  def resolve(layer, hardlinks):
+    """Adds the files of layer that hardlinks link to, in their place."""
+    # Maps the normalized names of the targets to the links to them.
+    targets = {}
+    for (aliases, tarinfo) in hardlinks:
+      targets.setdefault(normalize(tarinfo.linkname), []).append(
+          (aliases, tarinfo))
+    with image.uncompressed_layer_stream(layer) as reader:
+      with tarfile.open(mode='r|', fileobj=reader) as layer_tar:
+        for target in layer_tar:
+          links = targets.pop(normalize(target.name), None)
+          if links is None:
+            continue
+          for (aliases, tarinfo) in links:
+            if not target.isfile():
+              # e.g. a link to a link, which we leave as it is.
+              add(aliases, tarinfo, None)
+              continue
+            resolved = copy.copy(tarinfo)
+            resolved.type = tarfile.REGTYPE
+            resolved.size = target.size
+            resolved.linkname = ''
+            add(aliases, resolved, _spool(layer_tar.extractfile(target)))
+          if not targets:
+            break
+      stream.Drain(reader)
+    # Links to files missing from the layer are left as they are.
+    for links in six.itervalues(targets):
+      for (aliases, tarinfo) in links:
+        add(aliases, tarinfo, None)
+
+  # Maps the normalized paths not yet found (nor known to be absent) to
+  # the paths as given.
+  pending = {}
+  for path in paths:
+    pending.setdefault(normalize(path), []).append(path)
+
+  fs = whiteout.PathTrie()
+  found = {}
   for layer in image.diff_ids():
-    buf = io.BytesIO(image.uncompressed_layer(layer))
-    with tarfile.open(mode='r:', fileobj=buf) as layer_tar:
-      for tarinfo in layer_tar:
-        # If we see a whiteout file, then don't add anything to the tarball
-        # but ensure that any lower layers don't add a file with the whited
-        # out name.
-        basename = os.path.basename(tarinfo.name)
-        dirname = os.path.dirname(tarinfo.name)
-        tombstone = basename.startswith(_WHITEOUT_PREFIX)
-        if tombstone:
-          basename = basename[len(_WHITEOUT_PREFIX):]
-
-        # Before adding a file, check to see whether it (or its whiteout) have
-        # been seen before.
-        name = os.path.normpath(os.path.join('.', dirname, basename))
-        if name in fs:
-          continue
-
-        # Check for a whited out parent directory
-        if _in_whiteout_dir(fs, name):
-          continue
-
-        # Mark this file as handled by adding its name.
-        # A non-directory implicitly tombstones any entries with
-        # a matching (or child) name.
-        fs[name] = tombstone or not tarinfo.isdir()
-        if not tombstone:
-          if tarinfo.isfile():
-            tar.addfile(tarinfo, fileobj=layer_tar.extractfile(tarinfo))
+    if not pending:
+      break
+    hardlinks = []
+    with image.uncompressed_layer_stream(layer) as reader:
+      with tarfile.open(mode='r|', fileobj=reader) as layer_tar:
+        for tarinfo in layer_tar:
+          if not fs.add(tarinfo.name, tarinfo.isdir()):
+            continue
+          name = normalize(tarinfo.name)
+          if name not in pending:
+            continue
+
+          aliases = pending.pop(name)
+          if tarinfo.islnk():
+            hardlinks.append((aliases, tarinfo))
+          elif tarinfo.isfile():
+            # In stream mode, the payload is only readable now.
+            add(aliases, tarinfo, _spool(layer_tar.extractfile(tarinfo)))
           else:
-            tar.addfile(tarinfo, fileobj=None)
+            add(aliases, tarinfo, None)
+          if not pending:
+            break
+      # Verify the layer's digest (and gzip trailer) past what we read of it,
+      # before returning any of its files.
+      stream.Drain(reader)
+    if hardlinks:
+      resolve(layer, hardlinks)
+    fs.next_layer()
+
+    # Stop looking for paths hidden by whiteouts in the layers so far.
+    for name in [name for name in pending if fs.hides(name)]:
+      del pending[name]
+  return found
+
+
+def extract_file(image, path):
+  """Extract a single file from the image's final filesystem.
+
+  Args:
+    image: a docker image from whose final filesystem to extract the file.
+    path: the path of the file, e.g. '/etc/os-release'.
+
+  Returns:
+    A stream over the contents of the file (or, for a hardlink, of the file
+    it links to), or None if path is not a regular file in the image (e.g.
+    it is absent, or a symlink).
+  """
+  unused_tarinfo, fileobj = extract_paths(image, [path]).get(path, (None, None))
+  return fileobj
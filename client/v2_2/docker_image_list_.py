@@ -21,6 +21,8 @@ from __future__ import print_function
 import abc
 import json
 
+import concurrent.futures
+
 from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
 from containerregistry.client.v2_2 import docker_digest
@@ -222,19 +224,37 @@ class Delegate(DockerImageList):
 
 
 class FromRegistry(DockerImageList):
-  """This accesses a docker image list hosted on a registry (non-local)."""
+  """This accesses a docker image list hosted on a registry (non-local).
+
+  known_blobs (a known_blobs.KnownBlobs) is passed on to the list's children,
+  as with docker_image.FromRegistry.
+
+  Nested lists are resolved with up to threads concurrent requests, in which
+  case the caller *must* ensure that the provided transport is thread safe.
+
+  If the raw manifest was fetched already (e.g. by negotiate.FromRegistry),
+  passing it as manifest saves fetching it again.
+  """
 
   def __init__(
       self,
       name,
       basic_creds,
       transport,
-      accepted_mimes = docker_http.MANIFEST_LIST_MIMES):
+      accepted_mimes = docker_http.MANIFEST_LIST_MIMES,
+      known_blobs = None,
+      threads = 1,
+      manifest = None):
     self._name = name
     self._creds = basic_creds
     self._original_transport = transport
     self._accepted_mimes = accepted_mimes
+    self._known_blobs = known_blobs
+    self._threads = threads
     self._response = {}
+    if manifest is not None:
+      # Serve manifest() from what the caller fetched already.
+      self._response[docker_name.manifest_path(name)] = manifest
 
   def _content(self,
                suffix,
@@ -275,10 +295,13 @@ class FromRegistry(DockerImageList):
       media_type = entry['mediaType']
 
       if media_type in docker_http.MANIFEST_LIST_MIMES:
-        image = FromRegistry(name, self._creds, self._original_transport)
+        image = FromRegistry(name, self._creds, self._original_transport,
+                             known_blobs=self._known_blobs,
+                             threads=self._threads)
       elif media_type in docker_http.SUPPORTED_MANIFEST_MIMES:
         image = v2_2_image.FromRegistry(name, self._creds,
-                                        self._original_transport, [media_type])
+                                        self._original_transport, [media_type],
+                                        known_blobs=self._known_blobs)
       else:
         raise InvalidMediaTypeError('Invalid media type: ' + media_type)
 
@@ -311,15 +334,69 @@ class FromRegistry(DockerImageList):
       A list of (digest, image) tuples that can be run on the target platform.
     """
     target = target or Platform()
+    return {
+        name: image
+        for (name, (unused_platform, image)) in six.iteritems(
+            self._resolve(target.can_run))
+    }
+
+  def resolve_all_platforms(self):
+    """Resolves a manifest list to every image within it, for any platform.
+
+    Returns:
+      A list of (platform, image) tuples, sorted by digest, where platform is
+      None for images that don't specify one.
+    """
+    results = sorted(
+        six.iteritems(self._resolve(lambda unused_platform: True)),
+        key=lambda item: str(item[0]))
+    return [(platform, image) for (unused_name, (platform, image)) in results]
+
+  def _resolve(self, compatible):
+    """Resolves the images of the manifest list for which compatible is True.
+
+    Nested manifest lists are fetched concurrently, each only once however
+    often it is referenced, as are the manifests of the compatible images,
+    which are then served from memory.
+
+    Args:
+      compatible: a callable taking the Platform (or None) of an image, and
+          returning whether to resolve it.
+
+    Returns:
+      A dict mapping the names of the images to (platform, image) tuples.
+    """
     results = {}
-    images = self.images()
-    for name, platform, image in images:
-      # Recurse on manifest lists.
-      if isinstance(image, FromRegistry):
-        with image:
-          results.update(image.resolve_all_unordered(target))
-      elif target.can_run(platform):
-        results[name] = image
+    seen = set()
+
+    def children(image_list):
+      with image_list:
+        return image_list.images()
+
+    def prefetch(image):
+      with image:
+        image.manifest()
+      return []
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self._threads) as executor:
+      pending = {executor.submit(self.images)}
+      # Each task returns the children it found, which are queued in turn,
+      # so no task waits on another.
+      while pending:
+        done, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          for name, platform, image in future.result():
+            if name in seen:
+              continue
+            seen.add(name)
+            # Recurse on manifest lists.
+            if isinstance(image, FromRegistry):
+              pending.add(executor.submit(children, image))
+            elif compatible(platform):
+              results[name] = (platform, image)
+              pending.add(executor.submit(prefetch, image))
     return results
 
   def exists(self):
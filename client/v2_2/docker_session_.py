@@ -18,20 +18,81 @@ from __future__ import division
 
 from __future__ import print_function
 
+import collections
+import itertools
 import logging
+import re
+import socket
+import threading
 import concurrent.futures
 
 from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
+from containerregistry.client import registry_capabilities as capabilities
 from containerregistry.client.v2_2 import docker_http
 from containerregistry.client.v2_2 import docker_image
 from containerregistry.client.v2_2 import docker_image_list as image_list
 import httplib2
 
+import six
 import six.moves.http_client
+import six.moves.queue
 import six.moves.urllib.parse
 
 
+# The most repositories discovered through known_blobs from which a push will
+# mount blobs, each of which needs pull access added to the push's token.
+_MAX_DISCOVERED_MOUNTS = 5
+
+# The size of each PATCH when uploading a blob from a stream.
+_PATCH_SIZE = 16 * 1024 * 1024
+
+# The number of chunks queued for each session a blob is uploaded to at once,
+# beyond which reading the blob waits on the slowest of them.
+_FAN_OUT_DEPTH = 2
+
+# How long the reader of such a blob waits on a full queue before checking
+# whether its session has failed.
+_PUT_INTERVAL = 0.1
+
+# Marks the end of such a blob on the queue of each session.
+_EOF = object()
+
+# The errors with which an upload may be interrupted, and perhaps resumed.
+_INTERRUPTED = (socket.error, six.moves.http_client.HTTPException,
+                httplib2.HttpLib2Error)
+
+
+class _Aborted(Exception):
+  """Stops the uploads of a blob whose stream failed to be read."""
+
+
+def _rejected(e):
+  """Whether a V2DiagnosticException says a request is unsupported.
+
+  Only then do we fall back on another strategy, and remember not to try
+  this one again; other errors (e.g. transient ones) are raised.
+
+  Args:
+    e: the V2DiagnosticException.
+
+  Returns:
+    Whether the registry rejected the request as unsupported.
+  """
+  if e.status in (six.moves.http_client.METHOD_NOT_ALLOWED,
+                  six.moves.http_client.NOT_IMPLEMENTED):
+    return True
+  return any(d.code == 'UNSUPPORTED' for d in e.diagnostics)
+
+
+def _received(resp):
+  """The number of bytes of an upload the registry reports holding."""
+  # The Range is inclusive, and (as with Docker's registry) may or may not
+  # be prefixed with its unit.  Without one, we start over.
+  m = re.match(r'^(?:bytes=)?0-(\d+)$', resp.get('range') or '')
+  return int(m.group(1)) + 1 if m else 0
+
+
 def _tag_or_digest(name):
   if isinstance(name, docker_name.Tag):
     return name.tag
@@ -48,7 +109,10 @@ class Push(object):
                creds,
                transport,
                mount = None,
-               threads = 1):
+               threads = 1,
+               known_blobs = None,
+               registry_capabilities = None,
+               stream_blobs = False):
     """Constructor.
 
     If multiple threads are used, the caller *must* ensure that the provided
@@ -61,15 +125,54 @@ class Push(object):
       transport: the http transport to use for sending requests
       mount: list of repos from which to mount blobs.
       threads: the number of threads to use for uploads.
+      known_blobs: an optional known_blobs.KnownBlobs, recording the blobs
+          known to exist, whose existence checks may then be skipped, and
+          the other repositories on the registry from which to mount them.
+      registry_capabilities: an optional registry_capabilities.Capabilities,
+          recording which upload strategies the registry supports, to be
+          consulted and updated by the push.
+      stream_blobs: whether to upload layers from the image's blob_stream(),
+          a PATCH at a time, rather than reading each into memory whole
+          (e.g. when copying them from another registry).
 
     Raises:
       ValueError: an incorrectly typed argument was supplied.
     """
     self._name = name
-    self._transport = docker_http.Transport(name, creds, transport,
-                                            docker_http.PUSH)
+    # Mounting blobs requires pull access to the repositories they're mounted
+    # from, which is requested along with push access to name.
+    scopes = [
+        repo.scope(docker_http.PULL)
+        for repo in mount or []
+        if repo.registry == name.registry
+    ]
+    try:
+      self._transport = docker_http.Transport(
+          name, creds, transport, docker_http.PUSH, scopes=scopes)
+    except docker_http.TokenRefreshException as e:
+      if not scopes:
+        raise
+      # We may not pull from them; the registry then declines the mounts,
+      # and the blobs are uploaded instead.
+      logging.info('Unable to pull from %s: %s', ', '.join(
+          str(repo) for repo in mount
+          if repo.registry == name.registry), e)
+      self._transport = docker_http.Transport(name, creds, transport,
+                                              docker_http.PUSH)
     self._mount = mount
     self._threads = threads
+    self._known_blobs = known_blobs
+    # Maps digests to the repository discovered to mount each from.
+    self._discovered_mounts = {}
+    self._registry_capabilities = registry_capabilities
+    self._stream_blobs = stream_blobs
+    # What is known of the registry's capabilities, updated as we learn more.
+    self._capabilities = (
+        registry_capabilities.get(name.registry)
+        if registry_capabilities else {})
+    # The number of bytes of blobs and manifests the registry has accepted.
+    self._uploaded = 0
+    self._uploaded_lock = threading.Lock()
 
   def _scheme_and_host(self):
     return '{scheme}://{registry}'.format(
@@ -87,6 +190,9 @@ class Push(object):
 
   def _blob_exists(self, digest):
     """Check the remote for the given layer."""
+    if self._known_blobs and self._known_blobs.contains(self._name, digest):
+      return True
+
     # HEAD the blob, and check for a 200
     resp, unused_content = self._transport.Request(
         '{base_url}/blobs/{digest}'.format(
@@ -96,7 +202,10 @@ class Push(object):
             six.moves.http_client.OK, six.moves.http_client.NOT_FOUND
         ])
 
-    return resp.status == six.moves.http_client.OK  # pytype: disable=attribute-error
+    exists = resp.status == six.moves.http_client.OK  # pytype: disable=attribute-error
+    if exists and self._known_blobs:
+      self._known_blobs.add(self._name, digest)
+    return exists
 
   def _manifest_exists(
       self, image
@@ -114,19 +223,69 @@ class Push(object):
 
     return resp.status == six.moves.http_client.OK  # pytype: disable=attribute-error
 
+  def _sent(self, size):
+    """Counts size bytes as accepted by the registry."""
+    with self._uploaded_lock:
+      self._uploaded += size
+
+  def bytes_uploaded(self):
+    """The number of bytes this push has uploaded (so far).
+
+    Blobs that were mounted or found to exist already are not counted.
+
+    Returns:
+      The total size of the blobs and manifests the registry accepted.
+    """
+    return self._uploaded
+
+  def _supports(self, capability):
+    """Whether the registry supports capability, or None if not yet known."""
+    return self._capabilities.get(capability)
+
+  def _learned(self, capability, value):
+    """Records what was learned of one of the registry's capabilities."""
+    if self._capabilities.get(capability) == value:
+      return
+    logging.info('Learned %s of %s: %s', capability, self._name.registry,
+                 value)
+    self._capabilities[capability] = value
+    if self._registry_capabilities:
+      self._registry_capabilities.set(self._name.registry, capability, value)
+
   def _get_blob(self, image, digest):
     if digest == image.config_blob():
       return image.config_file().encode('utf8')
     return image.blob(digest)
 
-  def _monolithic_upload(self, image,
-                         digest):
-    self._transport.Request(
-        '{base_url}/blobs/uploads/?digest={digest}'.format(
-            base_url=self._base_url(), digest=digest),
-        method='POST',
-        body=self._get_blob(image, digest),
-        accepted_codes=[six.moves.http_client.CREATED])
+  def _monolithic_upload(self, digest, body):
+    """Uploads body in a single POST, returning whether it was accepted."""
+    try:
+      resp, unused_content = self._transport.Request(
+          '{base_url}/blobs/uploads/?digest={digest}'.format(
+              base_url=self._base_url(), digest=digest),
+          method='POST',
+          body=body,
+          content_type='application/octet-stream',
+          accepted_codes=[
+              six.moves.http_client.CREATED, six.moves.http_client.ACCEPTED
+          ])
+    except docker_http.V2DiagnosticException as e:
+      if not _rejected(e):
+        raise
+      logging.info('Monolithic upload of %s failed with %d.', digest, e.status)
+      self._learned(capabilities.MONOLITHIC, False)
+      return False
+
+    # pytype: disable=attribute-error
+    if resp.status == six.moves.http_client.ACCEPTED:
+      # pytype: enable=attribute-error
+      # The registry ignored the digest and started an upload, which may or
+      # may not hold the body, so we abandon it and start afresh.
+      self._learned(capabilities.MONOLITHIC, False)
+      return False
+    self._learned(capabilities.MONOLITHIC, True)
+    self._sent(len(body))
+    return True
 
   def _add_digest(self, url, digest):
     scheme, netloc, path, query_string, fragment = (
@@ -137,55 +296,223 @@ class Push(object):
     return six.moves.urllib.parse.urlunsplit((scheme, netloc, path,
                                               query_string, fragment))
 
-  def _put_upload(self, image, digest):
-    mounted, location = self._start_upload(digest, self._mount)
+  def _mount_sources(self, digest):
+    """The repositories from which to try to mount digest."""
+    mount = list(self._mount or [])
+    discovered = self._discovered_mounts.get(digest)
+    if discovered and discovered not in mount:
+      mount.append(discovered)
+    return mount
 
-    if mounted:
-      logging.info('Layer %s mounted.', digest)
-      return
+  def _discover_mounts(self, digests):
+    """Finds other repositories on the registry holding digests to mount.
 
-    location = self._add_digest(location, digest)
-    self._transport.Request(
-        location,
-        method='PUT',
-        body=self._get_blob(image, digest),
-        accepted_codes=[six.moves.http_client.CREATED])
+    The repositories are drawn from known_blobs, preferring those holding
+    the most of digests, and the push's token is extended to pull from them.
 
-  # pylint: disable=missing-docstring
-  def _patch_upload(self, image,
-                    digest):
-    mounted, location = self._start_upload(digest, self._mount)
+    Args:
+      digests: the digests of the blobs about to be uploaded.
+    """
+    if not self._known_blobs or self._supports(capabilities.MOUNT) is False:
+      return
 
-    if mounted:
-      logging.info('Layer %s mounted.', digest)
+    candidates = {}
+    counts = collections.defaultdict(int)
+    for digest in digests:
+      if self._known_blobs.contains(self._name, digest):
+        continue
+      repositories = [
+          repo for repo in self._known_blobs.repositories(
+              self._name.registry, digest)
+          if repo.repository != self._name.repository
+      ]
+      if repositories:
+        candidates[digest] = repositories
+        for repo in repositories:
+          counts[repo] += 1
+
+    sources = set(
+        sorted(counts, key=lambda repo: counts[repo],
+               reverse=True)[:_MAX_DISCOVERED_MOUNTS])
+    discovered = {}
+    for (digest, repositories) in six.iteritems(candidates):
+      for repo in repositories:
+        if repo in sources:
+          discovered[digest] = repo
+          break
+    if not sources:
       return
+    try:
+      self._transport.AddScopes(
+          sorted(repo.scope(docker_http.PULL) for repo in sources))
+    except docker_http.TokenRefreshException as e:
+      # e.g. we may not pull from them; upload those blobs instead.
+      logging.info('Not mounting blobs from %s: %s',
+                   ', '.join(sorted(str(repo) for repo in sources)), e)
+      return
+    logging.info('Mounting blobs from %s.',
+                 ', '.join(sorted(str(repo) for repo in sources)))
+    self._discovered_mounts.update(discovered)
 
-    location = self._get_absolute_url(location)
+  def _put_upload(self, digest, location, body):
+    """PUTs body to complete an upload, returning whether it was accepted."""
+    location = self._get_absolute_url(self._add_digest(location, digest))
+    try:
+      self._transport.Request(
+          location,
+          method='PUT',
+          body=body,
+          content_type='application/octet-stream',
+          accepted_codes=[six.moves.http_client.CREATED])
+    except docker_http.V2DiagnosticException as e:
+      if not _rejected(e):
+        raise
+      logging.info('Uploading %s with a PUT failed with %d.', digest, e.status)
+      self._learned(capabilities.PUT, False)
+      return False
+    self._learned(capabilities.PUT, True)
+    self._sent(len(body))
+    return True
 
+  def _patch(self, location, body, offset):
+    """PATCHes body, the bytes of an upload from offset, returning the resp."""
     resp, unused_content = self._transport.Request(
-        location,
+        self._get_absolute_url(location),
         method='PATCH',
-        body=self._get_blob(image, digest),
+        body=body,
         content_type='application/octet-stream',
+        extra_headers={
+            'Content-Range': '{start}-{end}'.format(
+                start=offset, end=offset + len(body) - 1)
+        },
         accepted_codes=[
             six.moves.http_client.NO_CONTENT, six.moves.http_client.ACCEPTED,
             six.moves.http_client.CREATED
         ])
+    return resp
 
-    location = self._add_digest(resp['location'], digest)
-    location = self._get_absolute_url(location)
+  def _resume_upload(self, location, body, offset = 0):
+    """Sends the rest of body to an interrupted upload.
+
+    Args:
+      location: the location of the upload.
+      body: the bytes the interrupted PATCH was sending.
+      offset: the offset of body within the blob.
+
+    Returns:
+      The resp of the last request, or None if the registry holds less than
+      offset bytes, so the upload can't be resumed from body.
+    """
+    resp, unused_content = self._transport.Request(
+        self._get_absolute_url(location),
+        method='GET',
+        accepted_codes=[six.moves.http_client.NO_CONTENT])
+    received = _received(resp) - offset
+    if received < 0:
+      return None
+    if received >= len(body):
+      return resp
+    return self._patch(
+        resp.get('location', location),  # pytype: disable=attribute-error
+        body[received:], offset + received)
+
+  def _finish_upload(self, digest, location):
+    """PUTs the digest of an upload, whose content has been PATCHed."""
+    location = self._get_absolute_url(self._add_digest(location, digest))
     self._transport.Request(
         location,
         method='PUT',
         body=None,
         accepted_codes=[six.moves.http_client.CREATED])
 
+  # pylint: disable=missing-docstring
+  def _patch_upload(self, digest, location, body):
+    location = self._get_absolute_url(location)
+
+    try:
+      resp, unused_content = self._transport.Request(
+          location,
+          method='PATCH',
+          body=body,
+          content_type='application/octet-stream',
+          accepted_codes=[
+              six.moves.http_client.NO_CONTENT, six.moves.http_client.ACCEPTED,
+              six.moves.http_client.CREATED
+          ])
+    except _INTERRUPTED as e:
+      if not self._supports(capabilities.RANGE):
+        raise
+      logging.info('Uploading %s was interrupted (%s), resuming.', digest, e)
+      resp = self._resume_upload(location, body)
+
+    self._finish_upload(digest, resp['location'])
+    self._sent(len(body))
+
+  def _patch_chunk(self, digest, location, chunk, offset):
+    """PATCHes the chunk of a blob at offset, returning the next location."""
+    try:
+      resp = self._patch(location, chunk, offset)
+    except _INTERRUPTED as e:
+      if not self._supports(capabilities.RANGE):
+        raise
+      logging.info('Uploading %s was interrupted (%s), resuming.', digest, e)
+      resp = self._resume_upload(location, chunk, offset)
+      if resp is None:
+        raise e
+    self._sent(len(chunk))
+    return resp['location']
+
+  def _chunk_size(self):
+    """The size of each PATCH when uploading a blob from a stream."""
+    return max(_PATCH_SIZE, self._supports(capabilities.CHUNK_MIN_LENGTH) or 0)
+
+  def _try_mount(self, digest):
+    """Mounts a blob from our mount sources, if we have any for it.
+
+    Args:
+      digest: the digest of the blob.
+
+    Returns:
+      Whether the blob was mounted, and otherwise the location of the upload
+      the failed mount started, or None if none was attempted.
+    """
+    mount = None
+    if self._supports(capabilities.MOUNT) is not False:
+      mount = self._mount_sources(digest)
+    if not mount:
+      return False, None
+    mounted, location = self._start_upload(digest, mount)
+    if mounted:
+      logging.info('Layer %s mounted.', digest)
+    return mounted, location
+
+  def _upload_body(self, digest, body, location = None):
+    """Uploads body by the first strategy the registry doesn't reject.
+
+    Args:
+      digest: the digest of the blob.
+      body: the content of the blob.
+      location: the location of an upload started already (e.g. by a failed
+          mount), which precludes a monolithic upload.
+    """
+    if location is None:
+      if (self._supports(capabilities.MONOLITHIC) is not False and
+          self._monolithic_upload(digest, body)):
+        return
+      unused_mounted, location = self._start_upload(digest)
+
+    if self._supports(capabilities.PUT) is not False:
+      if self._put_upload(digest, location, body):
+        return
+      # The failed PUT may have ended the upload, so start another.
+      unused_mounted, location = self._start_upload(digest)
+    self._patch_upload(digest, location, body)
+
   def _put_blob(self, image, digest):
     """Upload the aufs .tgz for a single layer."""
     # We have a few choices for unchunked uploading:
     #   POST to /v2/<name>/blobs/uploads/?digest=<digest>
     #   Fastest, but not supported by many registries.
-    # self._monolithic_upload(image, digest)
     #
     # or:
     #   POST /v2/<name>/blobs/uploads/        (no body*)
@@ -194,16 +521,23 @@ class Push(object):
     #   with Bintray.  This pattern also hasn't been used in
     #   clients since 1.8, when they switched to the 3-stage
     #   method below.
-    # self._put_upload(image, digest)
     # or:
     #   POST   /v2/<name>/blobs/uploads/        (no body*)
     #   PATCH  /v2/<name>/blobs/uploads/<uuid>  (full body)
     #   PUT    /v2/<name>/blobs/uploads/<uuid>  (no body)
     #
+    # We try each in turn, until the registry rejects one, which is
+    # remembered (see registry_capabilities) so that later uploads skip it.
+    # Should the PATCH be interrupted, it is resumed if the registry reported
+    # the Range of what it received when the upload was started.
+    #
     # * We attempt to perform a cross-repo mount if any repositories are
     # specified in the "mount" parameter. This does a fast copy from a
     # repository that is known to contain this blob and skips the upload.
-    self._patch_upload(image, digest)
+    # Mounting starts an upload if it fails, so precludes the first choice.
+    mounted, location = self._try_mount(digest)
+    if not mounted:
+      self._upload_body(digest, self._get_blob(image, digest), location)
 
   def _remote_tag_digest(
       self, image
@@ -229,23 +563,26 @@ class Push(object):
   def _put_manifest(
       self,
       image,
-      use_digest = False):
-    """Upload the manifest for this image."""
+      use_digest = False,
+      name = None):
+    """Upload the manifest for this image, to name in our repository."""
     if use_digest:
       tag_or_digest = image.digest()
     else:
-      tag_or_digest = _tag_or_digest(self._name)
+      tag_or_digest = _tag_or_digest(name or self._name)
 
+    manifest = image.manifest()
     self._transport.Request(
         '{base_url}/manifests/{tag_or_digest}'.format(
             base_url=self._base_url(), tag_or_digest=tag_or_digest),
         method='PUT',
-        body=image.manifest(),
+        body=manifest,
         content_type=image.media_type(),
         accepted_codes=[
             six.moves.http_client.OK, six.moves.http_client.CREATED,
             six.moves.http_client.ACCEPTED  # pytype: disable=wrong-arg-types
         ])
+    self._sent(len(manifest))
 
   def _start_upload(self,
                     digest,
@@ -260,7 +597,7 @@ class Push(object):
       # If we have a mount parameter, try to mount the blob from another repo.
       mount_from = '&'.join([
           'from=' + six.moves.urllib.parse.quote(repo.repository, '')
-          for repo in self._mount
+          for repo in mount
       ])
       url = '{base_url}/blobs/uploads/?mount={digest}&{mount_from}'.format(
           base_url=self._base_url(), digest=digest, mount_from=mount_from)
@@ -268,20 +605,188 @@ class Push(object):
           six.moves.http_client.CREATED, six.moves.http_client.ACCEPTED
       ]
 
-    resp, unused_content = self._transport.Request(
-        url, method='POST', body=None, accepted_codes=accepted_codes)
+    try:
+      resp, unused_content = self._transport.Request(
+          url, method='POST', body=None, accepted_codes=accepted_codes)
+    except docker_http.V2DiagnosticException as e:
+      if not mount:
+        raise
+      # e.g. we lack access to the repositories, fall back on an upload.
+      logging.info('Mounting %s failed with %d, uploading it instead.',
+                   digest, e.status)
+      if _rejected(e):
+        self._learned(capabilities.MOUNT, False)
+      return self._start_upload(digest)
+
     # pytype: disable=attribute-error,bad-return-type
-    return resp.status == six.moves.http_client.CREATED, resp.get('location')
+    if resp.status == six.moves.http_client.CREATED:
+      self._learned(capabilities.MOUNT, True)
+      return True, resp.get('location')
+
+    # Whether the upload's progress may be queried should it be interrupted.
+    self._learned(capabilities.RANGE, 'range' in resp)
+    if 'oci-chunk-min-length' in resp:
+      self._learned(capabilities.CHUNK_MIN_LENGTH,
+                    int(resp['oci-chunk-min-length']))
+    return False, resp.get('location')
     # pytype: enable=attribute-error,bad-return-type
 
+  def _upload_blob(self, image, digest):
+    """Upload a single layer, which is known not to exist already."""
+    if self._stream_blobs and digest != image.config_blob():
+      self._upload_blob_stream(digest, lambda: image.blob_stream(digest))
+      return
+    self._put_blob(image, digest)
+    self._pushed(digest)
+
+  def _upload_blob_stream(self, digest, opener):
+    """Upload a single layer from a stream.
+
+    As with _upload_blob, the layer is known not to exist already.
+
+    Args:
+      digest: the digest of the layer.
+      opener: a callable returning a stream over the layer's content, which
+          is only called (and the stream closed) if the layer isn't mounted.
+    """
+    failures = _upload_stream([self], digest, opener)
+    if failures:
+      raise failures[self]
+
+  def _pushed(self, digest):
+    """Records that a layer was pushed (or mounted)."""
+    if self._known_blobs:
+      self._known_blobs.add(self._name, digest)
+    logging.info('Layer %s pushed.', digest)
+
   def _upload_one(self, image, digest):
     """Upload a single layer, after checking whether it exists already."""
     if self._blob_exists(digest):
       logging.info('Layer %s exists, skipping', digest)
       return
 
-    self._put_blob(image, digest)
-    logging.info('Layer %s pushed.', digest)
+    self._upload_blob(image, digest)
+
+  def _submit_blob(self, checks, uploads, image, digest):
+    """Check for, then upload, a single layer on separate executors.
+
+    Existence checks are issued ahead of, and concurrently with, uploads, so
+    the threads uploading never wait on them.
+
+    Args:
+      checks: the executor on which to check whether the layer exists.
+      uploads: the executor on which to upload the layer, which must outlive
+          checks.
+      image: the image holding the layer.
+      digest: the digest of the layer.
+
+    Returns:
+      A future, completed once the layer exists remotely.
+    """
+    result = concurrent.futures.Future()
+
+    def uploaded(future):
+      if future.exception() is not None:
+        result.set_exception(future.exception())
+      else:
+        result.set_result(None)
+
+    def checked(future):
+      if future.exception() is not None:
+        result.set_exception(future.exception())
+      elif future.result():
+        logging.info('Layer %s exists, skipping', digest)
+        result.set_result(None)
+      else:
+        uploads.submit(self._upload_blob, image,
+                       digest).add_done_callback(uploaded)
+
+    checks.submit(self._blob_exists, digest).add_done_callback(checked)
+    return result
+
+  def _upload_children(self, image):
+    """Upload the children of a manifest list, with a single thread pool.
+
+    The blobs of all the children (and of the children of nested lists) are
+    uploaded together, each one only once, however many children share it.
+    Each child's manifest is pushed by digest as soon as its blobs (or its
+    own children) are, rather than waiting on its siblings.  The manifest of
+    image itself is left to the caller, to push once this returns.
+
+    Args:
+      image: the DockerImageList whose children to upload.
+    """
+    # The child manifests to push, and the number of blobs and children each
+    # is waiting on.
+    children = []
+    waiting = []
+    # Maps each blob digest or child index to the (indices of the) child
+    # manifests waiting on it.
+    dependents = collections.defaultdict(list)
+    blobs = {}
+    opened = []
+    try:
+      with concurrent.futures.ThreadPoolExecutor(
+          max_workers=self._threads) as executor, \
+          concurrent.futures.ThreadPoolExecutor(
+              max_workers=self._threads) as checks:
+
+        def add_children(parent_list, parent):
+          for _, child in parent_list:
+            child.__enter__()
+            opened.append(child)
+            # If the manifest (by digest) exists, then so must its blobs and
+            # children, and its parent needn't wait on it.
+            if self._manifest_exists(child):
+              logging.info('Manifest %s exists, skipping upload.',
+                           child.digest())
+              continue
+
+            index = len(children)
+            children.append(child)
+            waiting.append(0)
+            if parent is not None:
+              dependents[index].append(parent)
+              waiting[parent] += 1
+
+            if isinstance(child, image_list.DockerImageList):
+              add_children(child, index)
+            else:
+              for digest in child.distributable_blob_set():
+                if digest not in blobs:
+                  blobs[digest] = child
+                dependents[digest].append(index)
+                waiting[index] += 1
+
+        add_children(image, None)
+
+        self._discover_mounts(blobs)
+        blobs = {
+            digest: self._submit_blob(checks, executor, child, digest)
+            for (digest, child) in six.iteritems(blobs)
+        }
+
+        # Maps each pending future to the blob digest or child index it is
+        # uploading.
+        pending = {future: digest for (digest, future) in six.iteritems(blobs)}
+        for (index, count) in enumerate(waiting):
+          if not count:
+            pending[executor.submit(self._put_manifest, children[index],
+                                    use_digest=True)] = index
+
+        while pending:
+          done, _ = concurrent.futures.wait(
+              pending, return_when=concurrent.futures.FIRST_COMPLETED)
+          for future in done:
+            future.result()
+            for index in dependents[pending.pop(future)]:
+              waiting[index] -= 1
+              if not waiting[index]:
+                pending[executor.submit(self._put_manifest, children[index],
+                                        use_digest=True)] = index
+    finally:
+      for child in reversed(opened):
+        child.__exit__(None, None, None)
 
   def upload(self,
              image,
@@ -303,18 +808,19 @@ class Push(object):
       else:
         logging.info('Manifest exists, skipping upload.')
     elif isinstance(image, image_list.DockerImageList):
-      for _, child in image:
-        # TODO(user): Refactor so that the threadpool is shared.
-        with child:
-          self.upload(child, use_digest=True)
+      self._upload_children(image)
     elif self._threads == 1:
+      self._discover_mounts(image.distributable_blob_set())
       for digest in image.distributable_blob_set():
         self._upload_one(image, digest)
     else:
+      self._discover_mounts(image.distributable_blob_set())
       with concurrent.futures.ThreadPoolExecutor(
-          max_workers=self._threads) as executor:
+          max_workers=self._threads) as executor, \
+          concurrent.futures.ThreadPoolExecutor(
+              max_workers=self._threads) as checks:
         future_to_params = {
-            executor.submit(self._upload_one, image, digest): (image, digest)
+            self._submit_blob(checks, executor, image, digest): (image, digest)
             for digest in image.distributable_blob_set()
         }
         for future in concurrent.futures.as_completed(future_to_params):
@@ -322,6 +828,9 @@ class Push(object):
 
     # This should complete the upload by uploading the manifest.
     self._put_manifest(image, use_digest=use_digest)
+    if self._known_blobs and isinstance(image, docker_image.DockerImage):
+      for digest in image.distributable_blob_set():
+        self._known_blobs.add(self._name, digest)
 
   # __enter__ and __exit__ allow use as a context manager.
   def __enter__(self):
@@ -334,6 +843,418 @@ class Push(object):
     logging.info('Finished upload of: %s', self._name)
 
 
+# _upload_stream and MultiPush drive the blob uploads of Push sessions
+# themselves.
+# pylint: disable=protected-access
+def _send(session, digest, location, chunks):
+  """Upload a blob to a session a PATCH at a time.
+
+  Args:
+    session: the Push session to upload the blob to.
+    digest: the digest of the blob.
+    location: the location of the upload its failed mount started, if any.
+    chunks: an iterable of the blob's chunks.
+  """
+  if location is None:
+    unused_mounted, location = session._start_upload(digest)
+  offset = 0
+  for chunk in chunks:
+    location = session._patch_chunk(digest, location, chunk, offset)
+    offset += len(chunk)
+  session._finish_upload(digest, location)
+
+
+def _dequeue(chunks):
+  """Yields the chunks the reader of a fanned-out blob queues, up to _EOF."""
+  while True:
+    item = chunks.get()
+    if item is _EOF:
+      return
+    if isinstance(item, _Aborted):
+      raise item
+    yield item
+
+
+def _enqueue(chunks, item, failed):
+  """Queues item for a destination, unless (or until) it has failed."""
+  while not failed.is_set():
+    try:
+      chunks.put(item, timeout=_PUT_INTERVAL)
+      return
+    except six.moves.queue.Full:
+      continue
+
+
+def _upload_stream(sessions, digest, opener):
+  """Upload a blob from a stream to several sessions, reading it only once.
+
+  Each session first mounts the blob if it can.  A blob that fits in a
+  single chunk is then uploaded to the rest as by _put_blob, by the first
+  strategy each registry doesn't reject.  A larger one is sent to them a
+  PATCH at a time, in chunks as large as the largest minimum any of them
+  reports, and each resumed where it was interrupted if its registry
+  reports what it received.
+
+  Each of several sessions uploads on a worker of its own, fed the chunks
+  through a queue of _FAN_OUT_DEPTH, so the blob is uploaded to all of them
+  at once, and read at the pace of the slowest.  A session that fails drops
+  out, without holding up the others.
+
+  Args:
+    sessions: the Push sessions to upload the blob to, in whose repositories
+        it is known not to exist already.
+    digest: the digest of the blob.
+    opener: a callable returning a stream over the blob, which is only
+        called (and the stream closed) if some session doesn't mount it.
+
+  Returns:
+    A dict mapping the sessions that failed to their exceptions.
+  """
+  failures = {}
+  # Maps each session yet to upload the blob to the location of the upload
+  # its failed mount started, if any.
+  pending = collections.OrderedDict()
+  for session in sessions:
+    try:
+      mounted, location = session._try_mount(digest)
+    except Exception as e:  # pylint: disable=broad-except
+      failures[session] = e
+      continue
+    if mounted:
+      session._pushed(digest)
+    else:
+      pending[session] = location
+  if not pending:
+    return failures
+
+  def upload(session, location, body, chunks, failed = None):
+    try:
+      if chunks is None:
+        session._upload_body(digest, body, location)
+      else:
+        _send(session, digest, location, chunks)
+    except Exception as e:  # pylint: disable=broad-except
+      failures[session] = e
+      if failed is not None:
+        failed.set()
+      return
+    session._pushed(digest)
+
+  size = max(session._chunk_size() for session in pending)
+  with opener() as reader:
+    chunk = reader.read(size)
+    following = reader.read(size)
+    chunks = None
+    if following:
+      chunks = itertools.chain([chunk, following],
+                               iter(lambda: reader.read(size), b''))
+
+    if len(pending) == 1:
+      for (session, location) in six.iteritems(pending):
+        upload(session, location, chunk, chunks)
+      return failures
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(pending)) as workers:
+      if chunks is None:
+        for (session, location) in six.iteritems(pending):
+          workers.submit(upload, session, location, chunk, None)
+      else:
+        queues = []
+        for (session, location) in six.iteritems(pending):
+          queue = six.moves.queue.Queue(maxsize=_FAN_OUT_DEPTH)
+          failed = threading.Event()
+          workers.submit(upload, session, location, None, _dequeue(queue),
+                         failed)
+          queues.append((queue, failed))
+
+        end = _EOF
+        try:
+          for chunk in chunks:
+            live = [(queue, failed)
+                    for (queue, failed) in queues
+                    if not failed.is_set()]
+            if not live:
+              break
+            for (queue, failed) in live:
+              _enqueue(queue, chunk, failed)
+        except Exception as e:
+          end = _Aborted('Reading {digest} failed: {error}'.format(
+              digest=digest, error=e))
+          raise
+        finally:
+          # Release the workers, however reading ended.
+          for (queue, failed) in queues:
+            _enqueue(queue, end, failed)
+  return failures
+
+
+class MultiPush(object):
+  """MultiPush pushes one image to many tags, repositories and registries.
+
+  Each repository gets a single Push session.  Each distinct blob is
+  uploaded once per registry, into the first repository named there, from
+  which the registry's other repositories then mount it.  A blob missing
+  from several registries is read from the image once, on one of the
+  uploading threads, and uploaded to all of them at once, at the pace of
+  the slowest.  Finally, the manifest is pushed to every name concurrently.
+
+  A failure in one repository (or, while uploading blobs, one registry)
+  does not abort the others; upload() reports what failed where.
+  """
+
+  def __init__(self,
+               names,
+               keychain,
+               transport,
+               threads = 1,
+               known_blobs = None,
+               registry_capabilities = None):
+    """Constructor.
+
+    As with Push, if multiple threads are used, the caller *must* ensure that
+    the provided transport is thread-safe, as well as the image that is being
+    uploaded.  So too if names span several registries, whatever threads is,
+    as blobs are uploaded to each of them at once.
+
+    Args:
+      names: the fully-qualified names of the tags (or digests) to push to.
+      keychain: the docker_creds.Keychain from which to resolve the
+          credentials for each repository.
+      transport: the http transport to use for sending requests
+      threads: the number of threads to use for uploads.
+      known_blobs: an optional known_blobs.KnownBlobs, shared by the sessions.
+      registry_capabilities: an optional registry_capabilities.Capabilities,
+          shared by the sessions.
+    """
+    self._names = names
+    self._threads = threads
+    # Maps each repository to the names within it, and to its session.
+    self._repositories = collections.OrderedDict()
+    self._sessions = {}
+    # Maps each registry to the repository receiving its uploads, from which
+    # the others mount.
+    self._sources = collections.OrderedDict()
+    # Maps each repository that failed to the exception it failed with.
+    self._failures = {}
+    for name in names:
+      repository = name.as_repository()
+      if repository in self._repositories:
+        self._repositories[repository].append(name)
+        continue
+      self._repositories[repository] = [name]
+      source = self._sources.setdefault(name.registry, repository)
+      try:
+        self._sessions[repository] = Push(
+            name,
+            keychain.Resolve(name),
+            transport,
+            mount=[source] if source != repository else None,
+            threads=threads,
+            known_blobs=known_blobs,
+            registry_capabilities=registry_capabilities)
+      except Exception as e:  # pylint: disable=broad-except
+        self._fail(repository, e)
+
+  def _fail(self, repository, exception):
+    if repository not in self._failures:
+      logging.error('Error during upload to %s: %s', repository, exception)
+      self._failures[repository] = exception
+
+  def _fail_with_sources(self, repositories):
+    """Fails those of repositories whose registry's source failed."""
+    for repository in repositories:
+      source = self._sources[repository.registry]
+      if source in self._failures:
+        self._fail(repository, self._failures[source])
+
+  def _live(self, repositories):
+    """The sessions of those of repositories that have not failed."""
+    return [
+        self._sessions[repository]
+        for repository in repositories
+        if repository not in self._failures
+    ]
+
+  def _run(self, executor, calls):
+    """Makes calls concurrently, without one failing aborting the others.
+
+    Args:
+      executor: the executor on which to make the calls.
+      calls: (key, fn, args) tuples.
+
+    Returns:
+      A dict mapping the keys of the calls that returned to their results,
+      and another mapping the keys of those that raised to their exceptions.
+    """
+    futures = {executor.submit(fn, *args): key for (key, fn, args) in calls}
+    results = {}
+    errors = {}
+    for future in concurrent.futures.as_completed(futures):
+      if future.exception() is not None:
+        errors[futures[future]] = future.exception()
+      else:
+        results[futures[future]] = future.result()
+    return results, errors
+
+  def _fan_out(self, image, digest, sessions):
+    """Upload a blob to several sessions at once, reading it only once.
+
+    Args:
+      image: the image holding the blob.
+      digest: the digest of the blob.
+      sessions: the sessions to upload the blob to.
+
+    Returns:
+      A dict mapping the sessions that failed to their exceptions.
+    """
+    return _upload_stream(sessions, digest, lambda: image.blob_stream(digest))
+
+  def _upload_blobs(self, executor, image, sessions):
+    """Upload the blobs missing from each session's repository.
+
+    Args:
+      executor: the executor on which to check for and upload blobs.
+      image: the image holding the blobs.
+      sessions: the sessions of the repositories receiving uploads.
+
+    Returns:
+      A dict mapping the sessions that failed to their exceptions.
+    """
+    digests = image.distributable_blob_set()
+    exists, errors = self._run(
+        executor, [((session, digest), session._blob_exists, (digest,))
+                   for session in sessions
+                   for digest in digests])
+    failures = {session: e for ((session, _), e) in six.iteritems(errors)}
+    missing = {
+        session: [digest for digest in digests if not exists[(session, digest)]]
+        for session in sessions
+        if session not in failures
+    }
+
+    calls = []
+    for (session, blobs) in six.iteritems(missing):
+      session._discover_mounts(blobs)
+    for digest in digests:
+      targets = tuple(
+          session for (session, blobs) in six.iteritems(missing)
+          if digest in blobs)
+      if len(targets) > 1 and digest != image.config_blob():
+        calls.append((targets, self._fan_out, (image, digest, targets)))
+      else:
+        calls.extend(((session,), session._upload_blob, (image, digest))
+                     for session in targets)
+
+    results, errors = self._run(executor, calls)
+    for (targets, e) in six.iteritems(errors):
+      for session in targets:
+        failures.setdefault(session, e)
+    for result in six.itervalues(results):
+      for (session, e) in six.iteritems(result or {}):
+        failures.setdefault(session, e)
+    return failures
+
+  def _mount_one(self, session, image, digest):
+    """Mount a single blob into a session's repository from its source."""
+    if session._known_blobs and session._known_blobs.contains(
+        session._name, digest):
+      logging.info('Layer %s exists, skipping', digest)
+      return
+    # This falls back on an upload should the mount fail.
+    session._upload_blob(image, digest)
+
+  def upload(self, image):
+    """Upload the given image (or manifest list) to each of our names.
+
+    Args:
+      image: the image to upload.
+
+    Returns:
+      An OrderedDict mapping each name to None if it was pushed, or else to
+      the exception with which it failed.
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self._threads) as executor:
+      # If the manifest (by digest) exists in a repository, then so must its
+      # blobs and children.
+      exists, errors = self._run(
+          executor, [(session._name.as_repository(), session._manifest_exists,
+                      (image,)) for session in self._live(self._repositories)])
+      for (repository, e) in six.iteritems(errors):
+        self._fail(repository, e)
+      pending = [
+          repository for repository in self._repositories
+          if not exists.get(repository, True)
+      ]
+      sources = [
+          repository for repository in six.itervalues(self._sources)
+          if repository in pending
+      ]
+      others = [
+          repository for repository in pending if repository not in sources
+      ]
+
+      if isinstance(image, image_list.DockerImageList):
+        # Each session walks the list's children itself, so their blobs are
+        # read once per registry rather than once overall.
+        for group in (sources, others):
+          self._fail_with_sources(group)
+          unused_results, errors = self._run(
+              executor, [(session._name.as_repository(),
+                          session._upload_children, (image,))
+                         for session in self._live(group)])
+          for (repository, e) in six.iteritems(errors):
+            self._fail(repository, e)
+      else:
+        failures = self._upload_blobs(executor, image, self._live(sources))
+        for (session, e) in six.iteritems(failures):
+          self._fail(session._name.as_repository(), e)
+        self._fail_with_sources(others)
+        unused_results, errors = self._run(
+            executor, [(session._name.as_repository(), self._mount_one,
+                        (session, image, digest))
+                       for session in self._live(others)
+                       for digest in image.distributable_blob_set()])
+        for (repository, e) in six.iteritems(errors):
+          self._fail(repository, e)
+
+      unused_results, errors = self._run(
+          executor, [(name, session._put_manifest, (image, False, name))
+                     for session in self._live(self._repositories)
+                     for name in self._repositories[
+                         session._name.as_repository()]])
+      for (name, e) in six.iteritems(errors):
+        logging.error('Error during upload to %s: %s', name, e)
+
+    if isinstance(image, docker_image.DockerImage):
+      for session in self._live(self._repositories):
+        if session._known_blobs:
+          for digest in image.distributable_blob_set():
+            session._known_blobs.add(session._name, digest)
+
+    report = collections.OrderedDict()
+    for (repository, names) in six.iteritems(self._repositories):
+      for name in names:
+        report[name] = self._failures.get(repository, errors.get(name))
+    return report
+
+  # __enter__ and __exit__ allow use as a context manager.
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exception_type, unused_value, unused_traceback):
+    if exception_type:
+      logging.error('Error during upload to: %s',
+                    ', '.join(str(name) for name in self._names))
+      return
+    logging.info('Finished upload to: %s',
+                 ', '.join(str(name) for name in self._names))
+
+
+# pylint: enable=protected-access
+
+
 # pylint: disable=invalid-name
 def Delete(
     name,
@@ -358,3 +1279,96 @@ def Delete(
           entity=_tag_or_digest(name)),
       method='DELETE',
       accepted_codes=[six.moves.http_client.OK, six.moves.http_client.ACCEPTED])
+
+
+def CopyInto(
+    session,
+    src,
+    src_creds,
+    transport,
+    known_blobs = None
+):
+  """Copy an image (or manifest list) from the registry into a Push session.
+
+  Args:
+    session: the Push to upload src with, ideally made with stream_blobs.
+    src: the tag or digest to copy.
+    src_creds: the creds to use to pull src.
+    transport: the transport to use to contact the source registry.
+    known_blobs: an optional known_blobs.KnownBlobs, to record src's blobs in.
+
+  Returns:
+    The digest of the manifest copied.
+
+  Raises:
+    ValueError: src has no v2.2 (or OCI) manifest or manifest list.
+  """
+  with image_list.FromRegistry(
+      src, src_creds, transport, known_blobs=known_blobs) as src_list:
+    if src_list.exists():
+      session.upload(src_list)
+      return src_list.digest()
+
+  with docker_image.FromRegistry(
+      src,
+      src_creds,
+      transport,
+      docker_http.SUPPORTED_MANIFEST_MIMES,
+      known_blobs=known_blobs) as src_image:
+    if src_image.exists():
+      session.upload(src_image)
+      return src_image.digest()
+
+  raise ValueError('Unable to find a v2.2 image or manifest list at %s.' % src)
+
+
+def Copy(
+    src,
+    src_creds,
+    dst,
+    dst_creds,
+    transport,
+    threads = 1,
+    known_blobs = None,
+    registry_capabilities = None
+):
+  """Copy an image (or manifest list) from one registry name to another.
+
+  Blobs are streamed from the source registry into the destination in
+  bounded chunks, without touching disk.  Those the destination has already
+  are skipped, and when both names are on the same registry the rest are
+  mounted rather than copied.  The children of manifest lists are copied
+  concurrently.
+
+  Args:
+    src: the tag or digest to copy.
+    src_creds: the creds to use to pull src.
+    dst: the tag or digest to copy it to.
+    dst_creds: the creds to use to push dst.
+    transport: the transport to use to contact the registries, which must be
+        thread-safe if multiple threads are used.
+    threads: the number of threads to use for copying blobs.
+    known_blobs: an optional known_blobs.KnownBlobs, as with Push.
+    registry_capabilities: an optional registry_capabilities.Capabilities, as
+        with Push.
+
+  Returns:
+    The digest of the manifest copied.
+
+  Raises:
+    ValueError: src has no v2.2 (or OCI) manifest or manifest list.
+  """
+  mount = None
+  if src.registry == dst.registry:
+    mount = [src.as_repository()]
+
+  with Push(
+      dst,
+      dst_creds,
+      transport,
+      mount=mount,
+      threads=threads,
+      known_blobs=known_blobs,
+      registry_capabilities=registry_capabilities,
+      stream_blobs=True) as session:
+    return CopyInto(session, src, src_creds, transport, known_blobs=known_blobs)
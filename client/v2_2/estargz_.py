@@ -0,0 +1,413 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package reads and writes seekable (eStargz) layers.
+
+An eStargz layer is an ordinary gzipped tarball, in which each file's
+payload begins a new gzip member, followed by a table of contents (TOC)
+recording where each file's payload lives within the compressed blob, and a
+footer locating the TOC.  Individual files can then be fetched with Range
+requests, without reading the rest of the layer.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import base64
+import bisect
+import hashlib
+import io
+import json
+import os
+import struct
+import tarfile
+import time
+import zlib
+
+from containerregistry.client import stream
+
+# The name of the tarball entry holding the TOC.
+TOC_TAR_NAME = 'stargz.index.json'
+
+# The manifest layer annotation holding the digest of the TOC, with which
+# snapshotters verify the TOC.
+TOC_DIGEST_ANNOTATION = 'containerd.io/snapshot/stargz/toc.digest'
+
+# The manifest layer annotation holding the size of the uncompressed layer.
+UNCOMPRESSED_SIZE_ANNOTATION = 'io.containers.estargz.uncompressed-size'
+
+# The size of the chunks into which large files are split.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# The footers of eStargz layers, and of the legacy stargz layers it extends.
+FOOTER_SIZE = 51
+_LEGACY_FOOTER_SIZE = 47
+
+# Instructs zlib to write (or expect) a gzip header and trailer.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+_TOC_TYPES = {
+    tarfile.REGTYPE: 'reg',
+    tarfile.AREGTYPE: 'reg',
+    tarfile.CONTTYPE: 'reg',
+    tarfile.DIRTYPE: 'dir',
+    tarfile.SYMTYPE: 'symlink',
+    tarfile.LNKTYPE: 'hardlink',
+    tarfile.CHRTYPE: 'char',
+    tarfile.BLKTYPE: 'block',
+    tarfile.FIFOTYPE: 'fifo',
+}
+
+_XATTR_PREFIX = 'SCHILY.xattr.'
+
+
+class NotSeekableError(Exception):
+  """Raised when a layer has no eStargz footer."""
+
+
+class DigestMismatchedError(Exception):
+  """Raised when a file read from a layer doesn't match its TOC digest."""
+
+
+def _clean(name):
+  """Normalizes a tarball entry name, as eStargz TOCs do."""
+  return os.path.normpath('/' + name).lstrip('/')
+
+
+def _footer(toc_offset):
+  """Returns an empty gzip member whose extra field locates the TOC."""
+  payload = ('%016xSTARGZ' % toc_offset).encode('ascii')
+  extra = b'SG' + struct.pack('<H', len(payload)) + payload
+  return (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff' +
+          struct.pack('<H', len(extra)) + extra +
+          # An empty final stored block, followed by the crc32 and size.
+          b'\x01\x00\x00\xff\xff' + b'\x00' * 8)
+
+
+def _parse_footer(footer):
+  """Returns the TOC offset recorded in a layer's trailing bytes, or None."""
+  # eStargz stores the offset in an 'SG' subfield of the extra field.
+  tail = footer[-FOOTER_SIZE:]
+  if (len(tail) == FOOTER_SIZE and tail[:4] == b'\x1f\x8b\x08\x04' and
+      tail[12:14] == b'SG' and tail[32:38] == b'STARGZ'):
+    return int(tail[16:32], 16)
+  # Legacy stargz stores it as the entire extra field.
+  tail = footer[-_LEGACY_FOOTER_SIZE:]
+  if (len(tail) == _LEGACY_FOOTER_SIZE and tail[:4] == b'\x1f\x8b\x08\x04' and
+      tail[28:34] == b'STARGZ'):
+    return int(tail[12:28], 16)
+  return None
+
+
+def IsSeekable(blob):
+  """Checks whether the (trailing bytes of a) blob has an eStargz footer."""
+  return _parse_footer(blob) is not None
+
+
+class _Members(object):
+  """Writes data as a series of gzip members, tracking their offsets."""
+
+  def __init__(self, fileobj, compresslevel):
+    self._fileobj = fileobj
+    self._compresslevel = compresslevel
+    self._compressor = None
+    self._hasher = hashlib.sha256()
+    # The number of compressed bytes written, i.e. the offset of the next
+    # member.
+    self.offset = 0
+    # The number of uncompressed bytes written.
+    self.size = 0
+
+  def write(self, data):
+    if self._compressor is None:
+      self._compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED,
+                                          _GZIP_WBITS)
+    self._hasher.update(data)
+    self.size += len(data)
+    self._emit(self._compressor.compress(data))
+
+  def finish_member(self):
+    if self._compressor is not None:
+      self._emit(self._compressor.flush())
+      self._compressor = None
+
+  def emit(self, data):
+    """Writes data verbatim, between members."""
+    self.finish_member()
+    self._emit(data)
+
+  def _emit(self, data):
+    self._fileobj.write(data)
+    self.offset += len(data)
+
+  def diff_id(self):
+    return 'sha256:' + self._hasher.hexdigest()
+
+
+def _padding(size):
+  remainder = size % tarfile.BLOCKSIZE
+  return tarfile.NUL * (tarfile.BLOCKSIZE - remainder) if remainder else b''
+
+
+def _header(tarinfo):
+  return tarinfo.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def _toc_entry(tarinfo):
+  entry = {
+      'name': _clean(tarinfo.name),
+      'type': _TOC_TYPES[tarinfo.type],
+      'modtime': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                               time.gmtime(tarinfo.mtime)),
+      'mode': tarinfo.mode,
+      'uid': tarinfo.uid,
+      'gid': tarinfo.gid,
+  }
+  if tarinfo.uname:
+    entry['userName'] = tarinfo.uname
+  if tarinfo.gname:
+    entry['groupName'] = tarinfo.gname
+  if tarinfo.issym() or tarinfo.islnk():
+    entry['linkName'] = tarinfo.linkname
+  if tarinfo.isdev():
+    entry['devMajor'] = tarinfo.devmajor
+    entry['devMinor'] = tarinfo.devminor
+  if tarinfo.isfile():
+    entry['size'] = tarinfo.size
+  xattrs = {
+      key[len(_XATTR_PREFIX):]: base64.b64encode(
+          value.encode('utf-8', 'surrogateescape')).decode('ascii')
+      for key, value in tarinfo.pax_headers.items()
+      if key.startswith(_XATTR_PREFIX)
+  }
+  if xattrs:
+    entry['xattrs'] = xattrs
+  return entry
+
+
+def Build(fileobj, out, chunk_size = CHUNK_SIZE, compresslevel = 9):
+  """Writes an uncompressed layer as a seekable (eStargz) layer.
+
+  The entries of the layer are preserved, but its tarball is rewritten (and
+  gains a TOC entry), so the result has a diff_id of its own.
+
+  Args:
+    fileobj: a stream over the uncompressed layer.
+    out: the file-like object to which to write the eStargz blob.
+    chunk_size: the size of the chunks into which large files are split.
+    compresslevel: the gzip compression level.
+
+  Returns:
+    A tuple of the diff_id of the new layer, the digest of its TOC, and its
+    uncompressed size.
+  """
+  members = _Members(out, compresslevel)
+  entries = []
+  with tarfile.open(mode='r|', fileobj=fileobj) as layer_tar:
+    for tarinfo in layer_tar:
+      members.write(_header(tarinfo))
+      if tarinfo.type not in _TOC_TYPES or not _clean(tarinfo.name):
+        # e.g. the root directory, which has no entry of its own.
+        if tarinfo.isfile():
+          payload = layer_tar.extractfile(tarinfo)
+          for chunk in iter(lambda: payload.read(stream.CHUNK_SIZE), b''):
+            members.write(chunk)
+          members.write(_padding(tarinfo.size))
+        continue
+
+      entry = _toc_entry(tarinfo)
+      entries.append(entry)
+      if not (tarinfo.isfile() and tarinfo.size):
+        continue
+
+      # Each chunk of the payload begins a new gzip member, so that it can be
+      # decompressed on its own.
+      first = entry
+      payload = layer_tar.extractfile(tarinfo)
+      file_hasher = hashlib.sha256()
+      written = 0
+      while written < tarinfo.size:
+        chunk = payload.read(min(chunk_size, tarinfo.size - written))
+        if not chunk:
+          raise EOFError('Unexpected end of %s' % tarinfo.name)
+        members.finish_member()
+        if written:
+          entry = {'name': entry['name'], 'type': 'chunk'}
+          entries.append(entry)
+        entry['offset'] = members.offset
+        entry['chunkOffset'] = written
+        entry['chunkSize'] = len(chunk)
+        entry['chunkDigest'] = 'sha256:' + hashlib.sha256(chunk).hexdigest()
+        members.write(chunk)
+        file_hasher.update(chunk)
+        written += len(chunk)
+      first['digest'] = 'sha256:' + file_hasher.hexdigest()
+      members.write(_padding(tarinfo.size))
+    # Verify the layer's digest (and gzip trailer) past the tarball.
+    stream.Drain(fileobj)
+
+  toc = json.dumps({
+      'version': 1,
+      'entries': entries
+  }, sort_keys=True).encode('utf8')
+
+  members.finish_member()
+  toc_offset = members.offset
+  toc_info = tarfile.TarInfo(TOC_TAR_NAME)
+  toc_info.size = len(toc)
+  toc_info.mode = 0o644
+  members.write(_header(toc_info))
+  members.write(toc)
+  members.write(_padding(len(toc)))
+  # The end-of-archive marker.
+  members.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+  members.emit(_footer(toc_offset))
+  return (members.diff_id(), 'sha256:' + hashlib.sha256(toc).hexdigest(),
+          members.size)
+
+
+class Reader(object):
+  """Random access to the files of a seekable (eStargz) layer.
+
+  Args:
+    fetch: a callable taking an offset and a length, and returning those
+        bytes of the compressed layer, e.g. through a Range request.
+    size: the size of the compressed layer.
+    toc_digest: the expected digest of the TOC, if known (e.g. from the
+        layer's manifest annotations).
+
+  Raises:
+    NotSeekableError: the layer has no eStargz footer.
+    DigestMismatchedError: the TOC does not match toc_digest.
+  """
+
+  def __init__(self, fetch, size, toc_digest = None):
+    self._fetch = fetch
+    footer_size = min(FOOTER_SIZE, size)
+    footer = fetch(size - footer_size, footer_size)
+    toc_offset = _parse_footer(footer)
+    if toc_offset is None:
+      raise NotSeekableError('Layer has no eStargz footer.')
+    footer_size = (
+        FOOTER_SIZE if footer[-FOOTER_SIZE + 12:-FOOTER_SIZE + 14] == b'SG'
+        else _LEGACY_FOOTER_SIZE)
+
+    data = fetch(toc_offset, size - footer_size - toc_offset)
+    toc_tar = zlib.decompressobj(_GZIP_WBITS).decompress(data)
+    with tarfile.open(mode='r', fileobj=io.BytesIO(toc_tar)) as tar:
+      toc = tar.extractfile(TOC_TAR_NAME).read()  # pytype: disable=attribute-error
+    computed = 'sha256:' + hashlib.sha256(toc).hexdigest()
+    if toc_digest and computed != toc_digest:
+      raise DigestMismatchedError(
+          'The TOC digest %s does not match the expected %s' %
+          (computed, toc_digest))
+    self._toc_digest = computed
+
+    # Maps each name to its TOC entry, and for regular files to its chunks.
+    self._entries = {}
+    self._chunks = {}
+    for entry in json.loads(toc.decode('utf8'))['entries']:
+      if entry['type'] != 'chunk':
+        self._entries[entry['name']] = entry
+      if 'offset' in entry:
+        self._chunks.setdefault(entry['name'], []).append(entry)
+    # Each chunk's member ends where the next member (or the TOC) begins.
+    self._boundaries = sorted(
+        set(chunk['offset'] for chunks in self._chunks.values()
+            for chunk in chunks) | set([toc_offset]))
+
+  def toc_digest(self):
+    """The digest of the layer's TOC."""
+    return self._toc_digest
+
+  def entries(self):
+    """The TOC entries of the layer's files, excluding their chunks."""
+    return list(self._entries.values())
+
+  def entry(self, name):
+    """The TOC entry of the named file, or None if the layer lacks it."""
+    return self._entries.get(_clean(name))
+
+  def _read_chunk(self, chunk, size):
+    start = chunk['offset']
+    end = self._boundaries[bisect.bisect_right(self._boundaries, start)]
+    data = zlib.decompressobj(_GZIP_WBITS).decompress(
+        self._fetch(start, end - start))
+    data = data[:chunk.get('chunkSize') or size]
+    if 'chunkDigest' in chunk:
+      computed = 'sha256:' + hashlib.sha256(data).hexdigest()
+      if computed != chunk['chunkDigest']:
+        raise DigestMismatchedError(
+            'The chunk of %s at %d has digest %s, expected %s' %
+            (chunk['name'], chunk['chunkOffset'], computed,
+             chunk['chunkDigest']))
+    return data
+
+  def read(self, name):
+    """Fetches the contents of the named regular file.
+
+    Args:
+      name: the name of the file within the layer, e.g. 'etc/os-release'.
+
+    Returns:
+      The contents of the file.
+
+    Raises:
+      KeyError: the layer has no such regular file.
+      DigestMismatchedError: the contents do not match the TOC.
+    """
+    entry = self.entry(name)
+    if entry and entry['type'] == 'hardlink':
+      entry = self.entry(entry['linkName'])
+    if not entry or entry['type'] != 'reg':
+      raise KeyError('%s is not a regular file in the layer' % name)
+
+    data = b''.join(
+        self._read_chunk(chunk, entry['size'])
+        for chunk in self._chunks.get(entry['name'], []))
+    if 'digest' in entry:
+      computed = 'sha256:' + hashlib.sha256(data).hexdigest()
+      if computed != entry['digest']:
+        raise DigestMismatchedError(
+            'The contents of %s have digest %s, expected %s' %
+            (entry['name'], computed, entry['digest']))
+    return data
+
+  def open(self, name):
+    """Same as read(), but returns a stream over the contents."""
+    return stream.Reader(io.BytesIO(self.read(name)))
+
+
+def FromImage(image, digest):
+  """Opens one of an image's layers for random access.
+
+  Args:
+    image: a v2.2 DockerImage, e.g. a FromRegistry, whose blob_range() then
+        issues Range requests for just the bytes needed.
+    digest: the digest of a seekable layer of image.
+
+  Returns:
+    A Reader over the layer, verifying its TOC against the manifest's
+    annotation when there is one.
+
+  Raises:
+    NotSeekableError: the layer is not seekable.
+  """
+  toc_digest = None
+  for layer in json.loads(image.manifest()).get('layers', []):
+    if layer.get('digest') == digest:
+      toc_digest = layer.get('annotations', {}).get(TOC_DIGEST_ANNOTATION)
+  return Reader(lambda offset, length: image.blob_range(digest, offset, length),
+                image.blob_size(digest), toc_digest)
@@ -0,0 +1,140 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package caches the flattened filesystems of stacks of layers."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import errno
+import io
+import logging
+import os
+import tarfile
+import tempfile
+
+from containerregistry.client import stream
+
+_SUFFIX = '.tar'
+
+
+class FlattenCache(object):
+  """A size-capped LRU cache of flattened filesystems, keyed by ChainID.
+
+  Each entry is the uncompressed tarball that docker_image.extract() would
+  produce for the stack of layers the ChainID identifies, and which contains
+  no whiteouts.  Its headers serve as the entry's file index, and their
+  offsets as references to the payloads.  The flattened filesystem of an
+  image whose bottom layers match an entry is then the result of applying
+  the image's remaining layers on top of the entry, as if it were a layer.
+
+  Entries are written atomically, so a cache may be shared between
+  processes.  Hits refresh an entry's mtime, by which entries are evicted,
+  least recently used first, whenever the cache grows beyond max_bytes.
+
+  Args:
+    directory: the directory holding the cache; created if missing.
+    max_bytes: the cap on the total size of the cache's entries.
+  """
+
+  def __init__(self, directory, max_bytes):
+    try:
+      os.makedirs(directory)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise e
+    self._directory = directory
+    self._max_bytes = max_bytes
+
+  def _path(self, chain_id):
+    # Strip the sha256: prefix
+    return os.path.join(self._directory, chain_id[len('sha256:'):] + _SUFFIX)
+
+  def open(self, chain_id):
+    """Opens the flattened filesystem for chain_id.
+
+    Args:
+      chain_id: the ChainID of a stack of layers.
+
+    Returns:
+      A stream over the entry's tarball, which remains readable even if the
+      entry is later evicted, or None if the entry is not cached.
+    """
+    path = self._path(chain_id)
+    try:
+      f = io.open(path, u'rb')
+    except IOError as e:
+      if e.errno != errno.ENOENT:
+        raise e
+      return None
+    try:
+      os.utime(path, None)
+    except OSError as e:
+      # The entry was evicted since we opened it.
+      if e.errno != errno.ENOENT:
+        raise e
+    return stream.Reader(f)
+
+  def put(self, chain_id, write):
+    """Stores the flattened filesystem for chain_id.
+
+    Args:
+      chain_id: the ChainID of a stack of layers.
+      write: a callable given an open tarfile, into which it writes the
+          flattened filesystem of the stack of layers.
+
+    Returns:
+      A stream over the new entry's tarball, as with open().
+    """
+    fd, temp = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        with tarfile.open(fileobj=f, mode='w:', encoding='utf-8') as tar:
+          write(tar)
+      path = self._path(chain_id)
+      os.rename(temp, path)
+    except:
+      os.unlink(temp)
+      raise
+    reader = stream.Reader(io.open(path, u'rb'))
+    self.evict()
+    return reader
+
+  def evict(self):
+    """Evicts the least recently used entries beyond the cache's size cap."""
+    entries = []
+    for name in os.listdir(self._directory):
+      if not name.endswith(_SUFFIX):
+        continue
+      path = os.path.join(self._directory, name)
+      try:
+        info = os.stat(path)
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise e
+        continue
+      entries.append((info.st_mtime, info.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total <= self._max_bytes:
+        break
+      logging.info('Evicting %s from the flatten cache', path)
+      try:
+        os.unlink(path)
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise e
+      total -= size
@@ -0,0 +1,178 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package indexes the files within layers."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import collections
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import os
+import tarfile
+
+from containerregistry.client import stream
+from containerregistry.client import whiteout
+
+# The extension of index sidecar files.
+SUFFIX = '.index'
+
+# An entry in a layer, where:
+#   path: the name of the entry within the layer's tarball.
+#   type: the tarfile type of the entry, e.g. tarfile.REGTYPE.
+#   size: the size of the entry's payload.
+#   mode: the permission bits of the entry.
+#   mtime: the modification time of the entry.
+#   offset: the offset of the entry's payload within the uncompressed layer.
+#   sha256: the 'sha256:...' digest of the payload of regular files, else None.
+Entry = collections.namedtuple(
+    'Entry', ['path', 'type', 'size', 'mode', 'mtime', 'offset', 'sha256'])
+
+_DIRTYPE = tarfile.DIRTYPE.decode('ascii')
+
+
+def Build(fileobj):
+  """Indexes the entries of an uncompressed layer.
+
+  Args:
+    fileobj: a stream over the uncompressed layer, which is read once, to
+        its end.
+
+  Returns:
+    The list of the layer's entries, in the order they appear.
+  """
+  entries = []
+  with tarfile.open(mode='r|', fileobj=fileobj) as layer_tar:
+    for tarinfo in layer_tar:
+      digest = None
+      if tarinfo.isfile():
+        hasher = hashlib.sha256()
+        payload = layer_tar.extractfile(tarinfo)
+        for chunk in iter(lambda: payload.read(stream.CHUNK_SIZE), b''):
+          hasher.update(chunk)
+        digest = 'sha256:' + hasher.hexdigest()
+      entries.append(
+          Entry(
+              path=tarinfo.name,
+              type=tarinfo.type.decode('ascii'),
+              size=tarinfo.size,
+              mode=tarinfo.mode,
+              mtime=int(tarinfo.mtime),
+              offset=tarinfo.offset_data,
+              sha256=digest))
+    # Verify the layer's digest (and gzip trailer) past the tarball.
+    stream.Drain(fileobj)
+  return entries
+
+
+def Write(diff_id, entries, fileobj):
+  """Writes the index of a layer as a compact (gzipped) sidecar.
+
+  Args:
+    diff_id: the diff_id of the indexed layer.
+    entries: the layer's entries, as returned by Build().
+    fileobj: the file-like object to which to write the sidecar.
+  """
+  with gzip.GzipFile(fileobj=fileobj, mode='wb') as f:
+    f.write(
+        json.dumps({
+            'diff_id': diff_id,
+            'entries': [list(entry) for entry in entries],
+        }, separators=(',', ':')).encode('utf8'))
+
+
+def Read(fileobj):
+  """Reads a sidecar written by Write().
+
+  Args:
+    fileobj: the file-like object from which to read the sidecar.
+
+  Returns:
+    A tuple of the diff_id of the indexed layer and its entries.
+  """
+  with gzip.GzipFile(fileobj=fileobj, mode='rb') as f:
+    index = json.loads(f.read().decode('utf8'))
+  return index['diff_id'], [Entry(*entry) for entry in index['entries']]
+
+
+def FromDirectory(directory):
+  """Reads the sidecars of a save.fast layout, ordered like diff_ids().
+
+  Args:
+    directory: a directory populated by save.fast(..., index=True).
+
+  Returns:
+    A list of (diff_id, entries) tuples, topmost layer first.
+  """
+  indices = []
+  for name in sorted(os.listdir(directory), reverse=True):
+    if name.endswith(SUFFIX):
+      with io.open(os.path.join(directory, name), u'rb') as f:
+        indices.append(Read(f))
+  return indices
+
+
+def Flatten(indices):
+  """Yields the entries of the final filesystem described by indices.
+
+  Args:
+    indices: (diff_id, entries) tuples, topmost layer first.
+
+  Yields:
+    (diff_id, entry) for each entry in the final filesystem, where diff_id
+    identifies the layer providing it.
+  """
+  fs = whiteout.PathTrie()
+  for diff_id, entries in indices:
+    for entry in entries:
+      if fs.add(entry.path, entry.type == _DIRTYPE):
+        yield diff_id, entry
+    fs.next_layer()
+
+
+def Find(indices, path):
+  """Finds the layer providing path to the final filesystem.
+
+  Args:
+    indices: (diff_id, entries) tuples, topmost layer first.
+    path: the path of a file, e.g. '/etc/os-release'.
+
+  Returns:
+    The (diff_id, entry) for path, or None if it is absent.
+  """
+  path = os.path.normpath(os.path.join('.', path.lstrip('/')))
+  for diff_id, entry in Flatten(indices):
+    if os.path.normpath(os.path.join('.', entry.path)) == path:
+      return diff_id, entry
+  return None
+
+
+def Largest(indices, count):
+  """Returns the largest regular files of the final filesystem.
+
+  Args:
+    indices: (diff_id, entries) tuples, topmost layer first.
+    count: the number of files to return.
+
+  Returns:
+    Up to count (diff_id, entry) tuples, largest first.
+  """
+  return heapq.nlargest(
+      count, (item for item in Flatten(indices) if item[1].sha256),
+      key=lambda item: item[1].size)
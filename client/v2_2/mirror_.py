@@ -0,0 +1,331 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package incrementally mirrors repositories between registries."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import collections
+import errno
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import concurrent.futures
+
+from containerregistry.client import docker_name
+from containerregistry.client.v2_2 import docker_digest
+from containerregistry.client.v2_2 import docker_http
+from containerregistry.client.v2_2 import docker_image
+from containerregistry.client.v2_2 import docker_session
+
+import six
+import six.moves.http_client
+import six.moves.urllib.parse
+
+# What syncing one repository did, where:
+#   copied: the tags copied (or re-pointed), as they were found changed.
+#   unchanged: the number of tags already mirrored at the same digest.
+#   failed: a dict mapping each tag that failed to the exception, or None to
+#       the exception listing the repository failed with.
+#   bytes_uploaded: the bytes of blobs and manifests uploaded to the mirror.
+Result = collections.namedtuple(
+    'Result', ['copied', 'unchanged', 'failed', 'bytes_uploaded'])
+
+
+class State(object):
+  """A persistent record of which digest each mirrored tag was copied at.
+
+  Each destination repository's record is a JSON file mapping its tags to
+  digests, which is rewritten (atomically) as each tag is copied, so that an
+  interrupted sync resumes with only the tags it had yet to copy.
+
+  Args:
+    directory: the directory holding the record; created if missing.
+  """
+
+  def __init__(self, directory):
+    self._directory = directory
+    self._lock = threading.Lock()
+
+  def _path(self, name):
+    return os.path.join(
+        self._directory,
+        six.moves.urllib.parse.quote(
+            '{registry}/{repository}'.format(
+                registry=name.registry, repository=name.repository), '') +
+        '.json')
+
+  def get(self, name):
+    """The tags of name's repository mirrored so far.
+
+    Args:
+      name: the docker_name.Repository of the mirror.
+
+    Returns:
+      A dict mapping tags to the digests they were copied at.
+    """
+    try:
+      with io.open(self._path(name), u'rb') as f:
+        return json.loads(f.read().decode('utf8'))
+    except (IOError, OSError) as e:
+      if e.errno != errno.ENOENT:
+        raise e
+      return {}
+
+  def set(self, name, tag, digest):
+    """Records that tag was copied to name's repository at digest.
+
+    Args:
+      name: the docker_name.Repository of the mirror.
+      tag: the tag copied.
+      digest: the digest of the manifest it was copied at.
+    """
+    try:
+      os.makedirs(self._directory)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise e
+    with self._lock:
+      record = self.get(name)
+      record[tag] = digest
+      # Write and rename, so that an interrupted sync never leaves a partial
+      # record behind.
+      fd, temp = tempfile.mkstemp(dir=self._directory)
+      try:
+        with io.open(fd, u'wb') as f:
+          f.write(json.dumps(record, sort_keys=True).encode('utf8'))
+        os.rename(temp, self._path(name))
+      finally:
+        if os.path.exists(temp):
+          os.unlink(temp)
+
+
+class _Progress(object):
+  """What syncing one repository has done so far, to report as a Result."""
+
+  def __init__(self):
+    self.copied = []
+    self.unchanged = 0
+    self.failed = {}
+    self.bytes_uploaded = 0
+
+  def result(self):
+    return Result(
+        copied=sorted(self.copied),
+        unchanged=self.unchanged,
+        failed=self.failed,
+        bytes_uploaded=self.bytes_uploaded)
+
+
+class Mirror(object):
+  """Mirror incrementally syncs repositories to (other) registries.
+
+  The tags of each source repository are listed, with their digests (from
+  the GCR manifests map when the registry provides it, else a HEAD of each
+  tag), and compared with the State of what was mirrored, so that only new
+  or moved tags are copied, and of those only the blobs the mirror lacks.
+  Blobs are streamed through without touching disk, as with
+  docker_session.Copy.
+
+  Listing, resolving and copying for every repository share one pool of
+  threads, which bounds the requests in flight however many repositories
+  are synced at once.
+
+  Args:
+    keychain: the docker_creds.Keychain with which to resolve the creds of
+        each repository.
+    transport: the transport to use to contact the registries, which must be
+        thread-safe if multiple threads are used.
+    state: the State recording what was mirrored.
+    threads: the number of threads to use, overall.
+    known_blobs: an optional known_blobs.KnownBlobs, as with Push.
+    registry_capabilities: an optional registry_capabilities.Capabilities, as
+        with Push.
+  """
+
+  def __init__(self,
+               keychain,
+               transport,
+               state,
+               threads = 1,
+               known_blobs = None,
+               registry_capabilities = None):
+    self._keychain = keychain
+    self._transport = transport
+    self._state = state
+    self._threads = threads
+    self._known_blobs = known_blobs
+    self._registry_capabilities = registry_capabilities
+    self._lock = threading.Lock()
+
+  def _tags(self, src, src_creds):
+    """Lists src's tags, returning those with known digests and the rest."""
+    with docker_image.FromRegistry(src, src_creds, self._transport) as repo:
+      # Only GCR supports this, giving every tag's digest in one request.
+      manifests = repo.manifests()
+      if manifests:
+        digests = {}
+        for digest, info in six.iteritems(manifests):
+          for tag in info.get('tag', []):
+            digests[tag] = digest
+        return digests, []
+      return {}, repo.tags()
+
+  def _tag_digest(self, tag, src_creds):
+    """Resolves the digest tag currently points to."""
+    transport = docker_http.Transport(tag, src_creds, self._transport,
+                                      docker_http.PULL)
+    url = '{scheme}://{registry}/v2/{repository}/manifests/{tag}'.format(
+        scheme=docker_http.Scheme(tag.registry),
+        registry=tag.registry,
+        repository=tag.repository,
+        tag=tag.tag)
+    accepted_mimes = (
+        docker_http.MANIFEST_LIST_MIMES + docker_http.SUPPORTED_MANIFEST_MIMES)
+    resp, unused_content = transport.Request(
+        url,
+        method='HEAD',
+        accepted_codes=[six.moves.http_client.OK],
+        accepted_mimes=accepted_mimes)
+    if 'docker-content-digest' in resp:
+      return resp['docker-content-digest']
+    # Not every registry reports the digest, so compute it.
+    unused_resp, content = transport.Request(
+        url,
+        accepted_codes=[six.moves.http_client.OK],
+        accepted_mimes=accepted_mimes)
+    return docker_digest.SHA256(content)
+
+  def _list(self, src, dst, progress):
+    """Lists src, returning the follow-ups to resolve or diff its tags.
+
+    Each task returns its follow-ups as a list of (tag, fn, args) tuples.
+
+    Args:
+      src: the docker_name.Repository to mirror.
+      dst: the docker_name.Repository to mirror it to.
+      progress: the _Progress of syncing dst.
+
+    Returns:
+      The follow-ups, for each of src's tags.
+    """
+    src_creds = self._keychain.Resolve(src)
+    dst_creds = self._keychain.Resolve(dst)
+    mirrored = self._state.get(dst)
+    digests, unresolved = self._tags(src, src_creds)
+    tasks = [(tag, self._diff, (src, src_creds, dst, dst_creds, mirrored,
+                                tag, digest, progress))
+             for (tag, digest) in sorted(six.iteritems(digests))]
+    tasks += [(tag, self._resolve, (src, src_creds, dst, dst_creds, mirrored,
+                                    tag, progress))
+              for tag in sorted(unresolved)]
+    return tasks
+
+  def _resolve(self, src, src_creds, dst, dst_creds, mirrored, tag, progress):
+    """Resolves tag's digest, returning the follow-up to diff it."""
+    digest = self._tag_digest(
+        docker_name.Tag('{repo}:{tag}'.format(repo=src, tag=tag)), src_creds)
+    return self._diff(src, src_creds, dst, dst_creds, mirrored, tag, digest,
+                      progress)
+
+  def _diff(self, src, src_creds, dst, dst_creds, mirrored, tag, digest,
+            progress):
+    """Returns the follow-up to copy tag, unless it is mirrored already."""
+    if mirrored.get(tag) == digest:
+      with self._lock:
+        progress.unchanged += 1
+      return []
+    return [(tag, self._copy, (src, src_creds, dst, dst_creds, tag, digest,
+                               progress))]
+
+  def _copy(self, src, src_creds, dst, dst_creds, tag, digest, progress):
+    """Copies tag, as of digest, to dst, checkpointing it in the State."""
+    src_name = docker_name.Digest('{repo}@{digest}'.format(
+        repo=src, digest=digest))
+    dst_name = docker_name.Tag('{repo}:{tag}'.format(repo=dst, tag=tag))
+    mount = None
+    if src.registry == dst.registry:
+      mount = [src]
+
+    # Each copy runs on a single one of the mirror's threads, which is what
+    # bounds the concurrency overall.
+    session = docker_session.Push(
+        dst_name,
+        dst_creds,
+        self._transport,
+        mount=mount,
+        known_blobs=self._known_blobs,
+        registry_capabilities=self._registry_capabilities,
+        stream_blobs=True)
+    try:
+      with session:
+        docker_session.CopyInto(
+            session, src_name, src_creds, self._transport,
+            known_blobs=self._known_blobs)
+    finally:
+      with self._lock:
+        progress.bytes_uploaded += session.bytes_uploaded()
+    self._state.set(dst, tag, digest)
+    logging.info('Mirrored %s to %s (%s).', tag, dst, digest)
+    with self._lock:
+      progress.copied.append(tag)
+    return []
+
+  def _run(self, fn, args, dst, tag, progress):
+    """Runs a task, recording (rather than raising) what it failed with."""
+    try:
+      return fn(*args)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.error('Error mirroring %s to %s: %s', tag or 'tags', dst, e)
+      with self._lock:
+        progress.failed[tag] = e
+      return []
+
+  def sync(self, repositories):
+    """Syncs each source repository to its mirror.
+
+    Args:
+      repositories: a list of (src, dst) docker_name.Repository pairs.
+
+    Returns:
+      An OrderedDict mapping each dst to the Result of syncing it.
+    """
+    progress = collections.OrderedDict(
+        (dst, _Progress()) for (_, dst) in repositories)
+
+    def submit(executor, fn, args, dst, tag):
+      future = executor.submit(self._run, fn, args, dst, tag, progress[dst])
+      pending[future] = dst
+
+    pending = {}
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self._threads) as executor:
+      for (src, dst) in repositories:
+        submit(executor, self._list, (src, dst, progress[dst]), dst, None)
+      # Tasks return their follow-ups, which are queued as they come.
+      while pending:
+        done, unused_not_done = concurrent.futures.wait(
+            list(pending), return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          dst = pending.pop(future)
+          for tag, fn, args in future.result():
+            submit(executor, fn, args, dst, tag)
+    return collections.OrderedDict(
+        (dst, p.result()) for (dst, p) in six.iteritems(progress))
@@ -0,0 +1,116 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package opens whichever kind of image a registry holds at a name."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import json
+
+from containerregistry.client import docker_name
+from containerregistry.client.v2 import docker_image as v2_image
+from containerregistry.client.v2_2 import docker_http
+from containerregistry.client.v2_2 import docker_image as v2_2_image
+from containerregistry.client.v2_2 import docker_image_list as image_list
+
+import six.moves.http_client
+
+# Every media type we can open, in the order of our preference.
+ACCEPTED_MIMES = (
+    docker_http.MANIFEST_LIST_MIMES + docker_http.SUPPORTED_MANIFEST_MIMES +
+    docker_http.MANIFEST_SCHEMA1_MIMES)
+
+
+def _media_type(resp, content):
+  """The media type of the manifest in content, as served in resp."""
+  media_type = resp.get('content-type', '').split(';')[0].strip()
+  if media_type in ACCEPTED_MIMES:
+    return media_type
+  # Some registries serve manifests as e.g. application/json, so sniff.
+  manifest = json.loads(content.decode('utf8'))
+  if manifest.get('schemaVersion') == 1:
+    return docker_http.MANIFEST_SCHEMA1_MIME
+  if 'mediaType' in manifest:
+    return manifest['mediaType']
+  # 'mediaType' is optional for OCI manifests and indices.
+  if 'manifests' in manifest:
+    return docker_http.OCI_IMAGE_INDEX_MIME
+  return docker_http.OCI_MANIFEST_MIME
+
+
+def FromRegistry(name,
+                 basic_creds,
+                 transport,
+                 known_blobs = None,
+                 threads = 1):
+  """Opens the manifest list or image at name, with one manifest request.
+
+  Rather than trying each kind of image in turn, each with its own Accept
+  header, the manifest is requested once accepting every media type we
+  support, and handed to the class for the media type the registry chose.
+
+  Args:
+    name: the tag or digest of the image.
+    basic_creds: the creds to use to pull it.
+    transport: the transport to use to contact the registry.
+    known_blobs: an optional known_blobs.KnownBlobs, as with
+        docker_image.FromRegistry.
+    threads: the number of threads with which to resolve manifest lists, as
+        with docker_image_list.FromRegistry.
+
+  Returns:
+    A docker_image_list.FromRegistry, a (v2.2) docker_image.FromRegistry or,
+    for schema 1 manifests, a v2 docker_image.FromRegistry (which
+    v2_compat.V22FromV2 converts), not yet entered.
+
+  Raises:
+    docker_http.V2DiagnosticException: the manifest couldn't be fetched.
+    image_list.InvalidMediaTypeError: the manifest is of a media type we
+        don't support.
+  """
+  # The Transports the images make once entered share the ping's challenge
+  # and this Bearer token, so opening them costs no further round trips.
+  resp, content = docker_http.Transport(
+      name, basic_creds, transport, docker_http.PULL).Request(
+          '{scheme}://{registry}/v2/{path}'.format(
+              scheme=docker_http.Scheme(name.registry),
+              registry=name.registry,
+              path=docker_name.manifest_path(name)),
+          accepted_codes=[six.moves.http_client.OK],
+          accepted_mimes=ACCEPTED_MIMES)
+
+  media_type = _media_type(resp, content)
+  if media_type in docker_http.MANIFEST_LIST_MIMES:
+    return image_list.FromRegistry(
+        name,
+        basic_creds,
+        transport,
+        accepted_mimes=[media_type],
+        known_blobs=known_blobs,
+        threads=threads,
+        manifest=content)
+  if media_type in docker_http.SUPPORTED_MANIFEST_MIMES:
+    return v2_2_image.FromRegistry(
+        name,
+        basic_creds,
+        transport,
+        accepted_mimes=[media_type],
+        known_blobs=known_blobs,
+        manifest=content)
+  if media_type in docker_http.MANIFEST_SCHEMA1_MIMES:
+    return v2_image.FromRegistry(
+        name, basic_creds, transport, manifest=content)
+  raise image_list.InvalidMediaTypeError('Invalid media type: ' + media_type)
@@ -36,7 +36,8 @@ class OCIFromV22(docker_image.Delegate):
     manifest['mediaType'] = docker_http.OCI_MANIFEST_MIME
     manifest['config']['mediaType'] = docker_http.OCI_CONFIG_JSON_MIME
     for layer in manifest['layers']:
-      layer['mediaType'] = docker_http.OCI_LAYER_MIME
+      if layer['mediaType'] not in docker_http.ZSTD_LAYER_MIMES:
+        layer['mediaType'] = docker_http.OCI_LAYER_MIME
 
     return json.dumps(manifest, sort_keys=True)
 
@@ -62,6 +63,9 @@ class V22FromOCI(docker_image.Delegate):
     manifest['mediaType'] = docker_http.MANIFEST_SCHEMA2_MIME
     manifest['config']['mediaType'] = docker_http.CONFIG_JSON_MIME
     for layer in manifest['layers']:
+      if layer['mediaType'] in docker_http.ZSTD_LAYER_MIMES:
+        raise ValueError('Schema 2 manifests cannot describe zstd layer %s' %
+                         layer['digest'])
       layer['mediaType'] = docker_http.LAYER_MIME
 
     return json.dumps(manifest, sort_keys=True)
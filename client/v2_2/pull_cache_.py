@@ -0,0 +1,296 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package manages the layer cache shared by fast pulls."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import collections
+import contextlib
+import errno
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import time
+
+try:
+  # Without fcntl (e.g. on Windows), processes sharing a cache don't lock it.
+  import fcntl  # pylint: disable=g-import-not-at-top
+except ImportError:
+  fcntl = None
+
+# The extension of the sidecars recording that a cached layer was verified.
+VERIFIED_SUFFIX = '.verified'
+
+# The file locked by pulls (shared) and by garbage collection (exclusive).
+_LOCK = '.lock'
+
+# The directory in which the image directories linking into the cache are
+# registered.
+_ROOTS = 'roots'
+
+# The prefix of the temporary files written into the cache.
+_TEMP_PREFIX = 'tmp'
+
+# How long, in seconds, before a temporary file is presumed abandoned by a
+# process that died writing it.
+_TEMP_TTL = 60 * 60
+
+# What a garbage collection did, where:
+#   evicted: the number of entries removed.
+#   reclaimed: the number of bytes they held.
+#   remaining: the number of bytes held by the entries that remain.
+#   live: how many of those bytes are referenced from image directories.
+#   roots: the number of image directories referencing the cache.
+Result = collections.namedtuple(
+    'Result', ['evicted', 'reclaimed', 'remaining', 'live', 'roots'])
+
+
+class LockedError(Exception):
+  """Raised when the cache is locked by another process."""
+
+
+class PullCache(object):
+  """A size-capped LRU cache of the layers (and indices) of fast pulls.
+
+  Layers are cached by save.fast() under their digest, alongside their
+  .verified sidecars, and layer indices under their diff_id.  Image
+  directories link to the cached files rather than copy them, so evicting
+  a file one still links to would break the image.  Saving an image into a
+  directory therefore registers the directory as a root of the cache, and
+  whatever a root links to (or hardlinks) is live, and never evicted.
+  Roots whose directories have since been deleted are forgotten.
+
+  Hits refresh the mtime of the layer's sidecar (or of the index), which is
+  cheaper than rewriting anything, and leaves the layer's own metadata, by
+  which it was verified, untouched.  Entries are evicted by that time,
+  least recently used first.
+
+  Pulls hold a shared lock on the cache, and eviction an exclusive one, so
+  that no entry is evicted between a pull finding it and linking to it.
+
+  Args:
+    directory: the directory holding the cache; created if missing.
+    max_bytes: the cap on the total size of the cache's entries.
+  """
+
+  def __init__(self, directory, max_bytes = 0):
+    try:
+      os.makedirs(os.path.join(directory, _ROOTS))
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise e
+    self._directory = directory
+    self._max_bytes = max_bytes
+
+  @contextlib.contextmanager
+  def lock(self, shared = True, blocking = True):
+    """Locks the cache for the duration of the context.
+
+    Args:
+      shared: whether to take the shared lock of a pull, rather than the
+          exclusive lock of eviction.
+      blocking: whether to wait for the lock, rather than raise LockedError.
+
+    Yields:
+      Nothing, once the lock is held.
+
+    Raises:
+      LockedError: the cache was locked, and blocking is False.
+    """
+    if fcntl is None:
+      yield
+      return
+    operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    if not blocking:
+      operation |= fcntl.LOCK_NB
+    with io.open(os.path.join(self._directory, _LOCK), u'ab') as f:
+      try:
+        fcntl.flock(f.fileno(), operation)
+      except IOError as e:
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+          raise e
+        raise LockedError('The cache %s is locked by another process.' %
+                          self._directory)
+      try:
+        yield
+      finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+  def register(self, directory):
+    """Registers directory as a root, whose links keep entries live.
+
+    The caller must hold the shared lock(), so that the registration isn't
+    missed by an eviction already under way.
+
+    Args:
+      directory: an image directory linking into the cache.
+    """
+    directory = os.path.realpath(directory)
+    roots = os.path.join(self._directory, _ROOTS)
+    # Write and rename, so that eviction never reads a partial root.
+    fd, temp = tempfile.mkstemp(dir=roots, prefix=_TEMP_PREFIX)
+    try:
+      with io.open(fd, u'wb') as f:
+        f.write(directory.encode('utf8'))
+      os.rename(temp, os.path.join(
+          roots, hashlib.sha256(directory.encode('utf8')).hexdigest()))
+    finally:
+      if os.path.exists(temp):
+        os.unlink(temp)
+
+  def _roots(self, forget):
+    """The registered image directories, forgetting the deleted ones."""
+    roots = []
+    directory = os.path.join(self._directory, _ROOTS)
+    for name in os.listdir(directory):
+      path = os.path.join(directory, name)
+      if name.startswith(_TEMP_PREFIX):
+        # Under the exclusive lock, no pull is registering, so it was
+        # abandoned by one that died doing so.
+        if forget:
+          _unlink(path)
+        continue
+      try:
+        with io.open(path, u'rb') as f:
+          root = f.read().decode('utf8')
+      except IOError as e:
+        if e.errno != errno.ENOENT:
+          raise e
+        continue
+      if os.path.isdir(root):
+        roots.append(root)
+        continue
+      if forget:
+        logging.info('Forgetting deleted image directory %s', root)
+        _unlink(path)
+    return roots
+
+  def _live(self, roots):
+    """The names and inodes of the entries that roots link to."""
+    cache = os.path.realpath(self._directory)
+    names = set()
+    inodes = set()
+    for root in roots:
+      for parent, unused_dirs, files in os.walk(root):
+        for name in files:
+          path = os.path.join(parent, name)
+          try:
+            info = os.lstat(path)
+          except OSError as e:
+            if e.errno != errno.ENOENT:
+              raise e
+            continue
+          if os.path.islink(path):
+            target = os.path.realpath(path)
+            if os.path.dirname(target) == cache:
+              names.add(os.path.basename(target))
+          else:
+            # e.g. save.fast_all hardlinks the layers its images share.
+            inodes.add((info.st_dev, info.st_ino))
+    return names, inodes
+
+  def gc(self, directories = None, dry_run = False):
+    """Evicts the least recently used entries beyond the cache's size cap.
+
+    The caller must hold the exclusive lock().
+
+    Args:
+      directories: image directories to treat as roots, besides those
+          registered, e.g. ones saved before the cache was managed.
+      dry_run: whether to only report what would be evicted.
+
+    Returns:
+      A Result describing what was (or would be) reclaimed.
+    """
+    # A directory may be both registered and passed explicitly.
+    roots = sorted(set(self._roots(not dry_run) + [
+        os.path.realpath(directory) for directory in directories or []
+    ]))
+    live_names, live_inodes = self._live(roots)
+
+    # Group each layer with its sidecar, as one entry.
+    entries = {}
+    now = time.time()
+    for name in os.listdir(self._directory):
+      path = os.path.join(self._directory, name)
+      try:
+        info = os.lstat(path)
+      except OSError as e:
+        if e.errno != errno.ENOENT:
+          raise e
+        continue
+      if name == _LOCK or not os.path.isfile(path):
+        continue
+      if name.startswith(_TEMP_PREFIX):
+        if now - info.st_mtime >= _TEMP_TTL and not dry_run:
+          logging.info('Removing abandoned %s from the cache', path)
+          _unlink(path)
+        continue
+      key = name
+      if name.endswith(VERIFIED_SUFFIX):
+        key = name[:-len(VERIFIED_SUFFIX)]
+      entry = entries.setdefault(key, {'paths': [], 'size': 0, 'atime': 0,
+                                       'live': False, 'orphan': True})
+      entry['paths'].append(path)
+      entry['size'] += info.st_size
+      entry['atime'] = max(entry['atime'], info.st_mtime)
+      if name == key:
+        entry['orphan'] = False
+        if (name in live_names or
+            (info.st_dev, info.st_ino) in live_inodes):
+          entry['live'] = True
+
+    evicted = 0
+    reclaimed = 0
+    total = sum(entry['size'] for entry in entries.values())
+    live = sum(entry['size'] for entry in entries.values() if entry['live'])
+    for entry in sorted(
+        entries.values(), key=lambda entry: (not entry['orphan'],
+                                             entry['atime'])):
+      if entry['live']:
+        continue
+      if total <= self._max_bytes and not entry['orphan']:
+        break
+      logging.info('Evicting %s from the cache', entry['paths'])
+      if not dry_run:
+        # Remove the sidecar first, so that a layer is never trusted without
+        # being hashed again.
+        for path in sorted(entry['paths'], reverse=True):
+          _unlink(path)
+      evicted += 1
+      reclaimed += entry['size']
+      total -= entry['size']
+
+    if live > self._max_bytes:
+      logging.info('The cache %s holds %d live bytes, beyond its cap of %d',
+                   self._directory, live, self._max_bytes)
+    return Result(
+        evicted=evicted,
+        reclaimed=reclaimed,
+        remaining=total,
+        live=live,
+        roots=len(roots))
+
+
+def _unlink(path):
+  try:
+    os.unlink(path)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise e
@@ -18,20 +18,29 @@ from __future__ import division
 
 from __future__ import print_function
 
+import collections
+import contextlib
 import errno
+import hashlib
 import io
 import json
 import os
+import random
+import shutil
 import tarfile
+import tempfile
 
 import concurrent.futures
 from containerregistry.client import docker_name
+from containerregistry.client import stream
 from containerregistry.client.v1 import docker_image as v1_image
 from containerregistry.client.v1 import save as v1_save
 from containerregistry.client.v2 import v1_compat
 from containerregistry.client.v2_2 import docker_digest
 from containerregistry.client.v2_2 import docker_http
 from containerregistry.client.v2_2 import docker_image as v2_2_image
+from containerregistry.client.v2_2 import layer_index
+from containerregistry.client.v2_2 import pull_cache
 from containerregistry.client.v2_2 import v2_compat
 
 import six
@@ -42,8 +51,8 @@ def _diff_id(v1_img, blob):
   try:
     return v1_img.diff_id(blob)
   except ValueError:
-    unzipped = v1_img.uncompressed_layer(blob)
-    return docker_digest.SHA256(unzipped)
+    with v1_img.uncompressed_layer_stream(blob) as reader:
+      return docker_digest.SHA256FromStream(reader)
 
 
 def multi_image_tarball(
@@ -141,10 +150,131 @@ def tarball(name, image,
   multi_image_tarball({name: image}, tar, {})
 
 
+# The extension of the sidecars recording that a cached layer was verified.
+VERIFIED_SUFFIX = pull_cache.VERIFIED_SUFFIX
+
+
+def _stat(path):
+  """What of path's metadata must be unchanged for it to stay verified."""
+  st = os.stat(path)
+  return {'size': st.st_size, 'mtime': st.st_mtime, 'inode': st.st_ino}
+
+
+@contextlib.contextmanager
+def _replacing(path):
+  """Yields a file to write, which is renamed over path if that succeeds.
+
+  Concurrent readers of the cache (e.g. other pulls) then never see partial
+  files, and a failed write leaves path as it was.
+
+  Args:
+    path: the path of the file to replace.
+
+  Yields:
+    The temporary file, open for writing, alongside path.
+  """
+  fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+  try:
+    with io.open(fd, u'wb') as f:
+      yield f
+    os.rename(temp, path)
+  finally:
+    if os.path.exists(temp):
+      os.unlink(temp)
+
+
+def _record_verified(cached_layer, digest):
+  """Records that cached_layer, as it is now, was found to hold digest."""
+  record = _stat(cached_layer)
+  record['digest'] = digest
+  with _replacing(cached_layer + VERIFIED_SUFFIX) as f:
+    f.write(json.dumps(record, sort_keys=True).encode('utf8'))
+
+
+def _verified(cached_layer, digest, reverify = 0.0):
+  """Whether cached_layer holds the blob digest.
+
+  Hashing every cached layer on every hit is slow, so the first time a layer
+  is verified (or written) that is recorded in a sidecar, alongside its size,
+  mtime and inode, and later hits only compare those.  A file replaced or
+  modified since fails the comparison, and is hashed (streaming) again.
+
+  Args:
+    cached_layer: the path of the cached layer, which may not exist.
+    digest: the 'sha256:...' digest of the blob it should hold.
+    reverify: the probability of hashing the layer again regardless, to
+        catch what the metadata can't (e.g. bit rot).
+
+  Returns:
+    Whether the cached layer exists and holds digest.
+  """
+  try:
+    with io.open(cached_layer + VERIFIED_SUFFIX, u'rb') as f:
+      record = json.loads(f.read().decode('utf8'))
+    expected = _stat(cached_layer)
+    expected['digest'] = digest
+    if record == expected and random.random() >= reverify:
+      return True
+  except (IOError, OSError) as e:
+    if e.errno != errno.ENOENT:
+      raise e
+  except ValueError:
+    # e.g. a partial sidecar left by an older version, so hash the layer.
+    pass
+
+  try:
+    with io.open(cached_layer, u'rb') as f:
+      if docker_digest.SHA256FromStream(f) != digest:
+        return False
+  except (IOError, OSError) as e:
+    if e.errno != errno.ENOENT:
+      raise e
+    return False
+  _record_verified(cached_layer, digest)
+  return True
+
+
+def _touch(path):
+  """Records a hit on the cached path, for pull_cache's LRU eviction."""
+  try:
+    os.utime(path, None)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise e
+
+
+def _build_index(fileobj):
+  return layer_index.Build(stream.Decompress(fileobj))
+
+
+@contextlib.contextmanager
+def _indexing(index_name):
+  """Yields a stream.Pipe indexing the layer written to it, if index_name."""
+  if not index_name:
+    yield None
+    return
+  with stream.Pipe(_build_index) as pipe:
+    yield pipe
+
+
+@contextlib.contextmanager
+def _cached(cache_directory, directory):
+  """Locks the cache against eviction, and registers directory with it."""
+  if not cache_directory:
+    yield
+    return
+  cache = pull_cache.PullCache(cache_directory)
+  with cache.lock(shared=True):
+    cache.register(directory)
+    yield
+
+
 def fast(image,
          directory,
          threads = 1,
-         cache_directory = None):
+         cache_directory = None,
+         index = False,
+         reverify = 0.0):
   """Produce a FromDisk compatible file layout under the provided directory.
 
   After calling this, the following filesystem will exist:
@@ -157,6 +287,8 @@ def fast(image,
       ...
       N.tar.gz      <-- the Nth layer's .tar.gz filesystem delta
       N.sha256      <-- the sha256 of N.tar.gz with a "sha256:" prefix.
+      N.index       <-- with index, the layer_index sidecar of N.tar.gz, for
+                        layers that are gzipped tarballs.
 
   We pad layer indices to only 3 digits because of a known ceiling on the number
   of filesystem layers Docker supports.
@@ -165,7 +297,13 @@ def fast(image,
     image: a docker image to save.
     directory: an existing empty directory under which to save the layout.
     threads: the number of threads to use when performing the upload.
-    cache_directory: directory that stores file cache.
+    cache_directory: directory that stores file cache, as a
+        pull_cache.PullCache, with which directory is registered so that the
+        layers it links to aren't evicted.
+    index: whether to index the files of each layer as it is pulled.  Indices
+        are cached alongside layers, keyed by diff_id.
+    reverify: the fraction of cached layers, sampled at random, to hash
+        again despite having been verified already (see _verified).
 
   Returns:
     A tuple whose first element is the path to the config file, and whose second
@@ -173,15 +311,88 @@ def fast(image,
     containing: (.sha256, .tar.gz) respectively.
   """
 
+  with _cached(cache_directory, directory), \
+      concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+    result, future_to_params, unused_links = _fast(
+        image, directory, executor, cache_directory, index, None, reverify)
+
+    # Wait for completion.
+    for future in concurrent.futures.as_completed(future_to_params):
+      future.result()
+
+  return result
+
+
+def _fast(image, directory, executor,
+          cache_directory, index, pulled, reverify):
+  """Schedules the layout of fast() on executor.
+
+  Args:
+    image: a docker image to save.
+    directory: an existing empty directory under which to save the layout.
+    executor: the executor on which to write the layout's files.
+    cache_directory: directory that stores file cache, or None.
+    index: whether to index the files of each layer as it is pulled.
+    pulled: None, or a dict mapping the digests of the layers already
+        scheduled to be pulled (by this or other images) to their
+        (layer, index) files, which are to be linked rather than pulled again.
+        Layers newly scheduled are added to it.
+    reverify: the fraction of cached layers to hash again, as with fast().
+
+  Returns:
+    A tuple of the return value of fast(), a dict of the futures writing the
+    layout to their filenames, and a list of (source, destination) pairs of
+    (layer, index) files to link once the futures are done.
+  """
+
   def write_file(name, accessor,
                  arg):
     with io.open(name, u'wb') as f:
       f.write(accessor(arg))
 
-  def write_file_and_store(name, accessor,
-                           arg, cached_layer):
-    write_file(cached_layer, accessor, arg)
+  def write_file_and_store(name, arg, cached_layer, index_name, diff_id,
+                           cached_index):
+    """Streams the blob arg into cached_layer, and links name to it."""
+    # Hash as we write, and only keep the layer once verified, so that the
+    # cache never holds a partial or corrupt one.
+    with _indexing(index_name) as pipe, \
+        _replacing(cached_layer) as f, image.blob_stream(arg) as reader:
+      sha256 = hashlib.sha256()
+      for chunk in iter(lambda: reader.read(stream.CHUNK_SIZE), b''):
+        sha256.update(chunk)
+        f.write(chunk)
+        if pipe:
+          pipe.write(chunk)
+      computed = 'sha256:' + sha256.hexdigest()
+      if computed != arg:
+        raise v2_2_image.DigestMismatchedError(
+            'The pulled layer\'s digest did not match its content-address, '
+            '%s vs. %s' % (arg, computed))
+    _record_verified(cached_layer, arg)
+    link(cached_layer, name)
+    if pipe:
+      write_index(index_name, diff_id, pipe.result, cached_index)
+
+  def link_or_store(name, arg, cached_layer, index_name, diff_id,
+                    cached_index):
+    """Links name to cached_layer if it holds arg, else pulls and caches it."""
+    if index_name and cached_index and os.path.exists(cached_index):
+      _touch(cached_index)
+      link(cached_index, index_name)
+      index_name = None
+    if not _verified(cached_layer, arg, reverify):
+      # The layer is indexed as it's pulled.
+      write_file_and_store(name, arg, cached_layer, index_name, diff_id,
+                           cached_index)
+      return
+    # The layer's own mtime is part of what was verified, so touch its
+    # sidecar instead.
+    _touch(cached_layer + VERIFIED_SUFFIX)
     link(cached_layer, name)
+    if index_name:
+      # Only a layer cached before it was ever indexed is read back.
+      with io.open(cached_layer, u'rb') as f:
+        write_index(index_name, diff_id, _build_index(f), cached_index)
 
   def link(source, dest):
     """Creates a symbolic link dest pointing to source.
@@ -205,63 +416,191 @@ def fast(image,
       else:
         raise e
 
-  def valid(cached_layer, digest):
-    with io.open(cached_layer, u'rb') as f:
-      current_digest = docker_digest.SHA256(f.read(), '')
-    return current_digest == digest
+  def write_index(name, diff_id, entries, cached_index):
+    """Writes the index entries into name, via the cache if any."""
+    if not cached_index:
+      with io.open(name, u'wb') as f:
+        layer_index.Write(diff_id, entries, f)
+      return
+    # Other pulls may be reading the cached index.
+    with _replacing(cached_index) as f:
+      layer_index.Write(diff_id, entries, f)
+    link(cached_index, name)
+
+  def write_file_and_index(name, arg, index_name, diff_id):
+    """Streams the blob arg into name, indexing it as it goes."""
+    with _indexing(index_name) as pipe, io.open(name, u'wb') as f, \
+        image.blob_stream(arg) as reader:
+      for chunk in iter(lambda: reader.read(stream.CHUNK_SIZE), b''):
+        f.write(chunk)
+        pipe.write(chunk)
+    write_index(index_name, diff_id, pipe.result, None)
+
+  future_to_params = {}
+  config_file = os.path.join(directory, 'config.json')
+  f = executor.submit(write_file, config_file,
+                      lambda unused: image.config_file().encode('utf8'),
+                      'unused')
+  future_to_params[f] = config_file
+
+  executor.submit(write_file, os.path.join(directory, 'digest'),
+                  lambda unused: image.digest().encode('utf8'), 'unused')
+  executor.submit(write_file, os.path.join(directory, 'manifest.json'),
+                  lambda unused: image.manifest().encode('utf8'),
+                  'unused')
+
+  # Only gzipped tarballs are indexed, rather than e.g. the in-toto
+  # statements that are the layers of attestations, which declare theirs.
+  indexable = set(
+      layer['digest']
+      for layer in json.loads(image.manifest()).get('layers', [])
+      if layer.get('mediaType', docker_http.LAYER_MIME) in
+      docker_http.GZIP_LAYER_MIMES)
+
+  idx = 0
+  layers = []
+  links = []
+  for blob in reversed(image.fs_layers()):
+    # Create a local copy
+    layer_name = os.path.join(directory, '%03d.tar.gz' % idx)
+    digest_name = os.path.join(directory, '%03d.sha256' % idx)
+    f = executor.submit(
+        write_file,
+        digest_name,
+        lambda blob: blob[7:].encode('utf8'),
+        blob)
+    future_to_params[f] = digest_name
+
+    index_name = None
+    if index and blob in indexable:
+      index_name = os.path.join(directory,
+                                '%03d%s' % (idx, layer_index.SUFFIX))
+    if pulled is not None and blob in pulled:
+      # Another image (or layer) pulls this blob, so link to its files.
+      links.append((pulled[blob], (layer_name, index_name)))
+      layers.append((digest_name, layer_name))
+      idx += 1
+      continue
+    if pulled is not None:
+      pulled[blob] = (layer_name, index_name)
+
+    diff_id = None
+    cached_index = None
+    if index_name:
+      diff_id = image.digest_to_diff_id(blob)
+      if cache_directory:
+        # Strip the sha256: prefix
+        cached_index = os.path.join(cache_directory,
+                                    diff_id[7:] + layer_index.SUFFIX)
+
+    if cache_directory:
+      # Search for a local cached copy, named by the digest sans prefix.
+      cached_layer = os.path.join(cache_directory, blob[7:])
+      f = executor.submit(link_or_store, layer_name, blob, cached_layer,
+                          index_name, diff_id, cached_index)
+      future_to_params[f] = layer_name
+    else:
+      if index_name:
+        f = executor.submit(write_file_and_index, layer_name, blob, index_name,
+                            diff_id)
+      else:
+        f = executor.submit(write_file, layer_name, image.blob, blob)
+      future_to_params[f] = layer_name
 
-  with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
-    future_to_params = {}
-    config_file = os.path.join(directory, 'config.json')
-    f = executor.submit(write_file, config_file,
-                        lambda unused: image.config_file().encode('utf8'),
-                        'unused')
-    future_to_params[f] = config_file
+    layers.append((digest_name, layer_name))
+    idx += 1
 
-    executor.submit(write_file, os.path.join(directory, 'digest'),
-                    lambda unused: image.digest().encode('utf8'), 'unused')
-    executor.submit(write_file, os.path.join(directory, 'manifest.json'),
-                    lambda unused: image.manifest().encode('utf8'),
-                    'unused')
+  return (config_file, layers), future_to_params, links
 
-    idx = 0
-    layers = []
-    for blob in reversed(image.fs_layers()):
-      # Create a local copy
-      layer_name = os.path.join(directory, '%03d.tar.gz' % idx)
-      digest_name = os.path.join(directory, '%03d.sha256' % idx)
-      # Strip the sha256: prefix
-      digest = blob[7:].encode('utf8')
-      f = executor.submit(
-          write_file,
-          digest_name,
-          lambda blob: blob[7:].encode('utf8'),
-          blob)
-      future_to_params[f] = digest_name
-      digest_str = str(digest)
 
-      if cache_directory:
-        # Search for a local cached copy
-        cached_layer = os.path.join(cache_directory, digest_str)
-        if os.path.exists(cached_layer) and valid(cached_layer, digest_str):
-          f = executor.submit(link, cached_layer, layer_name)
-          future_to_params[f] = layer_name
-        else:
-          f = executor.submit(write_file_and_store, layer_name, image.blob,
-                              blob, cached_layer)
-          future_to_params[f] = layer_name
-      else:
-        f = executor.submit(write_file, layer_name, image.blob, blob)
-        future_to_params[f] = layer_name
+def _hardlink(source, dest):
+  """Hardlinks dest to source, or copies source where that isn't possible."""
+  try:
+    os.unlink(dest)
+  except OSError as e:
+    if e.errno != errno.ENOENT:
+      raise e
+  try:
+    os.link(source, dest)
+  except OSError as e:
+    # e.g. the filesystem doesn't support hardlinks.
+    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+      raise e
+    shutil.copyfile(source, dest)
+
+
+def _platform_directory(platform):
+  """The name of the subdirectory of fast_all() for platform."""
+  parts = [platform.os(), platform.architecture()]
+  if platform.variant():
+    parts.append(platform.variant())
+  return '_'.join(parts)
+
+
+def fast_all(images,
+             directory,
+             threads = 1,
+             cache_directory = None,
+             index = False,
+             reverify = 0.0):
+  """Produce the layout of fast() for each of several images.
+
+  This is for saving every child of a manifest list at once, e.g.:
+    directory/
+      linux_amd64/     <-- the fast() layout of the linux/amd64 image
+      linux_arm64_v8/  <-- the fast() layout of the linux/arm64/v8 image
+      ...
 
-      layers.append((digest_name, layer_name))
-      idx += 1
+  Each image's subdirectory is named after its platform, or where that's
+  missing or shared (e.g. by attestations), after its digest.  The layers of
+  all the images are pulled together, on one pool of threads, and each
+  distinct blob only once: the images sharing it hardlink the one file.
+
+  Args:
+    images: a list of (platform, image) tuples, e.g. as returned by
+        docker_image_list.FromRegistry.resolve_all_platforms().
+    directory: an existing empty directory under which to save the layouts.
+    threads: the number of threads to use when performing the download.
+    cache_directory: directory that stores file cache.
+    index: whether to index the files of each layer as it is pulled.
+    reverify: the fraction of cached layers to hash again, as with fast().
+
+  Returns:
+    An OrderedDict mapping the path of each image's subdirectory to what
+    fast() returns for it.
+  """
+  names = [
+      _platform_directory(platform) if platform else None
+      for (platform, unused_image) in images
+  ]
+  results = collections.OrderedDict()
+  future_to_params = {}
+  links = []
+  pulled = {}
+  with _cached(cache_directory, directory), \
+      concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+    for name, (unused_platform, image) in zip(names, images):
+      if not name or names.count(name) > 1:
+        # Strip the sha256: prefix
+        name = image.digest()[7:]
+      subdirectory = os.path.join(directory, name)
+      os.mkdir(subdirectory)
+      result, futures, image_links = _fast(image, subdirectory, executor,
+                                           cache_directory, index, pulled,
+                                           reverify)
+      results[subdirectory] = result
+      future_to_params.update(futures)
+      links.extend(image_links)
 
     # Wait for completion.
     for future in concurrent.futures.as_completed(future_to_params):
       future.result()
 
-  return (config_file, layers)
+  for (source, dest) in links:
+    for (source_name, dest_name) in zip(source, dest):
+      if dest_name:
+        _hardlink(source_name, dest_name)
+  return results
 
 
 def uncompressed(image,
@@ -299,6 +638,11 @@ def uncompressed(image,
     with io.open(name, u'wb') as f:
       f.write(accessor(arg))
 
+  def stream_file(name, accessor, arg):
+    with io.open(name, u'wb') as f:
+      with accessor(arg) as reader:
+        shutil.copyfileobj(reader, f, stream.CHUNK_SIZE)
+
   with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
     future_to_params = {}
     config_file = os.path.join(directory, 'config.json')
@@ -327,8 +671,8 @@ def uncompressed(image,
       future_to_params[f] = digest_name
 
       layer_name = os.path.join(directory, '%03d.tar' % idx)
-      f = executor.submit(write_file, layer_name, image.uncompressed_layer,
-                          diff_id)
+      f = executor.submit(stream_file, layer_name,
+                          image.uncompressed_layer_stream, diff_id)
       future_to_params[f] = layer_name
 
       layers.append((digest_name, layer_name))
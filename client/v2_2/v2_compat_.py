@@ -140,7 +140,8 @@ class V22FromV2(v2_2_image.DockerImage):
 
   def _GetDiffId(self, digest):
     """Hash the uncompressed layer blob."""
-    return docker_digest.SHA256(self._v2_image.uncompressed_blob(digest))
+    with self._v2_image.uncompressed_blob_stream(digest) as reader:
+      return docker_digest.SHA256FromStream(reader)
 
   def manifest(self):
     """Override."""
@@ -154,10 +155,18 @@ class V22FromV2(v2_2_image.DockerImage):
     """Override."""
     return self._v2_image.uncompressed_blob(digest)
 
+  def uncompressed_blob_stream(self, digest):
+    """Override."""
+    return self._v2_image.uncompressed_blob_stream(digest)
+
   def blob(self, digest):
     """Override."""
     return self._v2_image.blob(digest)
 
+  def blob_stream(self, digest):
+    """Override."""
+    return self._v2_image.blob_stream(digest)
+
   # __enter__ and __exit__ allow use as a context manager.
   def __enter__(self):
     return self
@@ -300,6 +309,13 @@ class V2FromV22(v2_image.DockerImage):
       return super(V2FromV22, self).uncompressed_blob(EMPTY_TAR_DIGEST)
     return self._v2_2_image.uncompressed_blob(digest)
 
+  def uncompressed_blob_stream(self, digest):
+    """Override."""
+    if digest == EMPTY_TAR_DIGEST:
+      # See comment in blob().
+      return super(V2FromV22, self).uncompressed_blob_stream(EMPTY_TAR_DIGEST)
+    return self._v2_2_image.uncompressed_blob_stream(digest)
+
   def diff_id(self, digest):
     """Gets v22 diff_id."""
     return self._v2_2_image.digest_to_diff_id(digest)
@@ -314,6 +330,13 @@ class V2FromV22(v2_image.DockerImage):
       return EMPTY_TAR_BYTES
     return self._v2_2_image.blob(digest)
 
+  def blob_stream(self, digest):
+    """Override."""
+    if digest == EMPTY_TAR_DIGEST:
+      # See comment in blob().
+      return super(V2FromV22, self).blob_stream(EMPTY_TAR_DIGEST)
+    return self._v2_2_image.blob_stream(digest)
+
   # __enter__ and __exit__ allow use as a context manager.
   def __enter__(self):
     return self
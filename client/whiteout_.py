@@ -0,0 +1,154 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package tracks whiteouts while flattening image layers."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import os
+
+from six.moves import intern  # pylint: disable=redefined-builtin
+
+WHITEOUT_PREFIX = '.wh.'
+
+# Marks the directory containing it as opaque: the directory's contents in
+# lower layers are hidden, but its contents in this layer are not.
+OPAQUE_WHITEOUT = WHITEOUT_PREFIX + WHITEOUT_PREFIX + '.opq'
+
+# Stands in for a tombstone or non-directory, which hides itself and
+# any entries beneath it in lower layers.
+_HIDDEN = True
+
+
+class _Dir(dict):
+  """A directory in a PathTrie, mapping names to their _Dir or _HIDDEN."""
+
+  __slots__ = ('seen', 'opaque')
+
+  def __init__(self):
+    super(_Dir, self).__init__()
+    # Whether the directory itself has been added.
+    self.seen = False
+    # Whether a higher layer hides this directory's lower layer contents.
+    self.opaque = False
+
+
+def _split(name):
+  """Splits a normalized path into its components."""
+  relative = name.lstrip('/')
+  if relative == name:
+    return name.split('/')
+  # The root ('/', or '//' which POSIX keeps distinct) is a component too.
+  root = name[:len(name) - len(relative)]
+  return [root] + relative.split('/') if relative else [root]
+
+
+class PathTrie(object):
+  """Records the paths added while flattening layers, topmost layer first.
+
+  Paths are stored as a tree of their components, with each distinct
+  component name interned, which is far more compact than a set of full
+  paths for images with many files.  Whether an entry is hidden by a higher
+  layer is answered with a single walk from the root, without building the
+  names of its ancestor directories.
+  """
+
+  def __init__(self):
+    self._root = _Dir()
+    self._opaque = []
+
+  def add(self, name, isdir):
+    """Records an entry of the current layer.
+
+    Args:
+      name: the name of the entry in the layer's tarball.
+      isdir: whether the entry is a directory.
+
+    Returns:
+      Whether the entry belongs in the final filesystem, i.e. it is not a
+      whiteout, and was neither added nor hidden by a higher layer.
+    """
+    basename = os.path.basename(name)
+    dirname = os.path.dirname(name)
+    if basename == OPAQUE_WHITEOUT:
+      # This only applies to lower layers, so defer it to next_layer().
+      self._opaque.append(os.path.normpath(os.path.join('.', dirname)))
+      return False
+
+    tombstone = basename.startswith(WHITEOUT_PREFIX)
+    if tombstone:
+      basename = basename[len(WHITEOUT_PREFIX):]
+
+    parts = _split(os.path.normpath(os.path.join('.', dirname, basename)))
+    node = self._root
+    for part in parts[:-1]:
+      child = node.get(part)
+      if child is None:
+        child = node[intern(part)] = _Dir()
+      elif child is _HIDDEN or child.opaque:
+        return False
+      node = child
+
+    last = parts[-1]
+    child = node.get(last)
+    if child is _HIDDEN or (child is not None and child.seen):
+      return False
+
+    # A non-directory implicitly tombstones any entries with a matching
+    # (or child) name.
+    if tombstone or not isdir:
+      node[intern(last)] = _HIDDEN
+    else:
+      if child is None:
+        child = node[intern(last)] = _Dir()
+      child.seen = True
+    return not tombstone
+
+  def hides(self, name):
+    """Whether an entry named name in a lower layer would be skipped.
+
+    Args:
+      name: the name of an entry, as with add().
+
+    Returns:
+      Whether the entry was already added, or is hidden by a whiteout (or a
+      non-directory) in a higher layer.
+    """
+    parts = _split(os.path.normpath(os.path.join('.', name)))
+    node = self._root
+    for part in parts[:-1]:
+      node = node.get(part)
+      if node is None:
+        return False
+      if node is _HIDDEN or node.opaque:
+        return True
+    child = node.get(parts[-1])
+    return child is _HIDDEN or (child is not None and child.seen)
+
+  def next_layer(self):
+    """Marks the end of the current layer, before moving to a lower one."""
+    for name in self._opaque:
+      node = self._root
+      for part in _split(name):
+        child = node.get(part)
+        if child is None:
+          child = node[intern(part)] = _Dir()
+        elif child is _HIDDEN:
+          break
+        node = child
+      else:
+        node.opaque = True
+    self._opaque = []
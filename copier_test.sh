@@ -0,0 +1,87 @@
+#!/bin/bash -e
+
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for copier.par
+
+# Generate a fresh random image to avoid completely
+# incremental pushes.
+function generate_image() {
+  local target=$1
+
+  cat > Dockerfile <<EOF2
+FROM alpine
+RUN head -c100 /dev/urandom > /tmp/random.txt
+EOF2
+  docker build -t random .
+  docker save -o "${target}" random
+  docker rmi -f random
+}
+
+# Test copying a freshly pushed image, which keeps its digest, to each of
+# the destinations in turn.  The destinations share what they learn of the
+# registry, so later copies mount the blobs the earlier ones uploaded.
+function test_copier() {
+  local src=$1
+  shift
+  local random_image="direct.$RANDOM.tar"
+  local state=$(mktemp -d)
+  generate_image "${random_image}"
+
+  # Output has following format: {image} was published with digest: sha256:...
+  output="$(pusher.par --name="${src}" --tarball="${random_image}")"
+  push_digest="$(echo "${output##* }")"
+
+  for dst in "$@"; do
+    echo "TESTING: ${src} to ${dst}"
+    output="$(copier.par --src-image="${src}" --dst-image="${dst}" \
+      --known-blobs-directory="${state}/known_blobs" \
+      --registry-capabilities-directory="${state}/capabilities")"
+    copy_digest="$(echo "${output##* }")"
+    if [ "${push_digest}" != "${copy_digest}" ]; then
+      echo "Digests don't match."
+      rm -rf "${state}"
+      exit 1
+    fi
+  done
+  rm -rf "${state}"
+}
+
+# Test copying a manifest list by digest, along with its children.
+function test_copier_list() {
+  local src=$1
+  local dst=$2
+
+  echo "TESTING: ${src} to ${dst}"
+
+  output="$(copier.par --src-image="${src}" --dst-image="${dst}")"
+  copy_digest="$(echo "${output##* }")"
+  if [ "${src##*@}" != "${copy_digest}" ]; then
+    echo "Digests don't match."
+    exit 1
+  fi
+}
+
+
+# Test copying a trivial image.
+# The registered credential only has access to this repository, which is only used for testing.
+test_copier gcr.io/containerregistry-releases/copier-testing:latest \
+  gcr.io/containerregistry-releases/copier-testing:copy \
+  gcr.io/containerregistry-releases/copier-testing/other:copy
+
+# Test copying a manifest list from DockerHub
+test_copier_list \
+  index.docker.io/library/busybox@sha256:1669a6aa7350e1cdd28f972ddad5aceba2912f589f19a090ac75b7083da748db \
+  gcr.io/containerregistry-releases/copier-testing:list
@@ -0,0 +1,98 @@
+#!/bin/bash -e
+
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Unit tests for mirror.par
+
+# Generate a fresh random image to avoid completely
+# incremental pushes.
+function generate_image() {
+  local target=$1
+
+  cat > Dockerfile <<EOF2
+FROM alpine
+RUN head -c100 /dev/urandom > /tmp/random.txt
+EOF2
+  docker build -t random .
+  docker save -o "${target}" random
+  docker rmi -f random
+}
+
+function expect_output() {
+  local output=$1
+  local expected=$2
+
+  if [[ "${output}" != *"${expected}"* ]]; then
+    echo "Expected '${expected}' in:"
+    echo "${output}"
+    return 1
+  fi
+}
+
+# Test mirroring a repository holding a freshly pushed image, then mirroring
+# it again, which finds nothing left to copy.
+function test_mirror() {
+  local src=$1
+  local dst=$2
+  local random_image="direct.$RANDOM.tar"
+  local state=$(mktemp -d)
+  generate_image "${random_image}"
+
+  echo "TESTING: ${src}=${dst}"
+
+  pusher.par --name="${src}:latest" --tarball="${random_image}"
+
+  output="$(mirror.par --repository="${src}=${dst}" \
+    --state-directory="${state}")"
+  expect_output "${output}" "${dst}: 1 copied, 0 unchanged, 0 failed"
+
+  output="$(mirror.par --repository="${src}=${dst}" \
+    --state-directory="${state}")"
+  expect_output "${output}" "${dst}: 0 copied, 1 unchanged, 0 failed"
+  expect_output "${output}" "0 bytes uploaded in total."
+
+  rm -rf "${state}"
+}
+
+# Test mirroring the repositories listed in a file.
+function test_mirror_file() {
+  local src=$1
+  local dst=$2
+  local state=$(mktemp -d)
+
+  echo "TESTING: ${src}=${dst} from --repositories-file"
+
+  cat > "${state}/repositories" <<EOF2
+# Comments and blank lines are skipped.
+
+${src}=${dst}
+EOF2
+
+  output="$(mirror.par --repositories-file="${state}/repositories" \
+    --state-directory="${state}/state")"
+  expect_output "${output}" "${dst}: "
+  expect_output "${output}" " 0 failed"
+
+  rm -rf "${state}"
+}
+
+
+# Test mirroring a trivial repository.
+# The registered credential only has access to this repository, which is only used for testing.
+test_mirror gcr.io/containerregistry-releases/mirror-testing/src \
+  gcr.io/containerregistry-releases/mirror-testing/dst
+
+test_mirror_file gcr.io/containerregistry-releases/mirror-testing/src \
+  gcr.io/containerregistry-releases/mirror-testing/file
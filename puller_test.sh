@@ -50,6 +50,92 @@ function test_puller_multiplatform() {
   fi
 }
 
+# Test pulling every platform of a manifest list, each into a subdirectory.
+# The arguments following the image are pairs of a platform's subdirectory
+# and the digest expected there.
+function test_puller_all_platforms() {
+  local image=$1
+  shift
+
+  local tmpdir=$(mktemp -d)
+
+  echo "TESTING: ${image} --all-platforms"
+
+  puller.par --name="${image}" --directory="${tmpdir}" --all-platforms
+
+  while [[ $# -gt 0 ]]; do
+    digest=$(cat "${tmpdir}/$1/digest")
+    if [[ "${digest}" != "$2" ]]; then
+      echo "Expected digest '$2' in $1, got '${digest}'"
+      rm -rf "${tmpdir}"
+      return 1
+    fi
+    shift 2
+  done
+  rm -rf "${tmpdir}"
+}
+
+# Test that pulling with --index writes an index beside each layer.
+function test_puller_index() {
+  local image=$1
+
+  local tmpdir=$(mktemp -d)
+
+  echo "TESTING: ${image} --index"
+
+  puller.par --name="${image}" --directory="${tmpdir}" --index
+
+  for layer in "${tmpdir}"/*.tar.gz; do
+    if [[ ! -s "${layer%.tar.gz}.index" ]]; then
+      echo "Expected an index of ${layer}"
+      rm -rf "${tmpdir}"
+      return 1
+    fi
+  done
+  rm -rf "${tmpdir}"
+}
+
+# Test that pulling with --cache-size evicts the cached layers of images
+# that are gone, and keeps those of images still linking to them.  The two
+# images must share no layers.
+function test_puller_cache_size() {
+  local evicted_image=$1
+  local kept_image=$2
+
+  local cache=$(mktemp -d)
+  local evicted_dir=$(mktemp -d)
+  local kept_dir=$(mktemp -d)
+
+  echo "TESTING: ${kept_image} --cache-size"
+
+  puller.par --name="${evicted_image}" --directory="${evicted_dir}" \
+    --cache="${cache}"
+  local evicted=""
+  for digest in "${evicted_dir}"/*.sha256; do
+    evicted="${evicted} $(cat "${digest}")"
+  done
+  rm -rf "${evicted_dir}"
+
+  puller.par --name="${kept_image}" --directory="${kept_dir}" \
+    --cache="${cache}" --cache-size=0
+
+  local status=0
+  for digest in ${evicted}; do
+    if [[ -e "${cache}/${digest}" ]]; then
+      echo "Expected ${digest} to be evicted from the cache"
+      status=1
+    fi
+  done
+  for digest in "${kept_dir}"/*.sha256; do
+    if [[ ! -e "${cache}/$(cat "${digest}")" ]]; then
+      echo "Expected $(cat "${digest}") to be kept in the cache"
+      status=1
+    fi
+  done
+  rm -rf "${cache}" "${kept_dir}"
+  return ${status}
+}
+
 # Test pulling an image from inside a docker container with a
 # certain base / entrypoint
 function test_base() {
@@ -172,8 +258,22 @@ test_puller_multiplatform index.docker.io/library/busybox:1.29.3 \
   sha256:d9ba6331ecef10de2a6d3eb403c815d86838a2ffb8368f7d75bb8faafc5aaa3e \
   --os linux --architecture arm --variant v5
 
+# Test pulling every platform of a manifest list
+test_puller_all_platforms gcr.io/google-containers/pause:3.1 \
+  linux_amd64 \
+  sha256:59eec8837a4d942cc19a52b8c09ea75121acc38114a2c68b98983ce9356b8610 \
+  linux_ppc64le \
+  sha256:bcf9771c0b505e68c65440474179592ffdfa98790eb54ffbf129969c5e429990
+
 # TODO: add multiplatform test cases on --os-features and --features
 
+# Test indexing the layers as they are pulled
+test_puller_index gcr.io/google-appengine/python:latest
+
+# Test evicting from the cache after a pull
+test_puller_cache_size gcr.io/google-containers/pause:2.0 \
+  index.docker.io/library/busybox:latest
+
 # TODO(user): Add an authenticated pull test.
 
 clear_cache_directory
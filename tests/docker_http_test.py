@@ -0,0 +1,56 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.docker_http."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import unittest
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client.v2_2 import docker_http
+from containerregistry.tests import fake_registry
+
+
+class TransportTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = fake_registry.Registry(bearer=True)
+    self.name = docker_name.Tag('{host}/dst/app:latest'.format(
+        host=self.registry.host))
+
+  def _transport(self, scopes = None):
+    return docker_http.Transport(self.name, docker_creds.Anonymous(),
+                                 self.registry, docker_http.PUSH,
+                                 scopes=scopes)
+
+  def test_denied_scope(self):
+    self.registry.denied.add('secret/app')
+    with self.assertRaises(docker_http.TokenRefreshException):
+      self._transport(scopes=['repository:secret/app:pull'])
+
+  def test_add_scopes_rolls_back(self):
+    self.registry.denied.add('secret/app')
+    transport = self._transport()
+    with self.assertRaises(docker_http.TokenRefreshException):
+      transport.AddScopes(['repository:secret/app:pull'])
+    # The denied scope isn't requested again along with the next ones.
+    transport.AddScopes(['repository:src/app:pull'])
+
+
+if __name__ == '__main__':
+  unittest.main()
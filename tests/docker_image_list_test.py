@@ -0,0 +1,114 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.docker_image_list."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import unittest
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client.v2_2 import docker_http
+from containerregistry.client.v2_2 import docker_image_list
+from containerregistry.tests import fake_registry
+
+
+def _Platform(architecture, variant = None):
+  platform = {'os': 'linux', 'architecture': architecture}
+  if variant:
+    platform['variant'] = variant
+  return platform
+
+
+class ResolveTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = fake_registry.Registry()
+    self.platforms = {}
+    manifests = {}
+    for platform in (_Platform('amd64'), _Platform('arm64'),
+                     _Platform('arm', 'v7'), _Platform('ppc64le')):
+      manifest, digest = self.registry.put_image('foo/bar', None, [
+          fake_registry.Tarball([('etc/arch', platform['architecture'].encode(
+              'utf8'))])
+      ], platform=platform)
+      self.platforms[digest] = platform
+      manifests[platform['architecture']] = (manifest, platform)
+    # A list nested in the list, holding the arm and ppc64le images.
+    nested, self.nested = self.registry.put_list(
+        'foo/bar', None, [manifests['arm'], manifests['ppc64le']])
+    self.registry.put_list('foo/bar', 'latest', [
+        manifests['amd64'], (nested, None), manifests['arm64']])
+
+  def _list(self, threads):
+    return docker_image_list.FromRegistry(
+        docker_name.Tag('{host}/foo/bar:latest'.format(
+            host=self.registry.host)), docker_creds.Anonymous(),
+        self.registry, threads=threads)
+
+  def _fail(self, digest):
+    """Fails the requests for the manifest digest."""
+
+    def fault(method, path, unused_query, unused_headers):
+      if method == 'GET' and path.endswith('/manifests/' + digest):
+        return fake_registry.Error(500, 'UNKNOWN')
+
+    self.registry.faults.append(fault)
+
+  def _check_all_platforms(self, threads):
+    with self._list(threads) as image_list:
+      children = image_list.resolve_all_platforms()
+    resolved = []
+    for platform, image in children:
+      with image:
+        resolved.append((image.digest(), dict(platform)))
+    # Sorted by digest, each with its own platform, nested or not.
+    self.assertEqual(sorted(self.platforms.items()), resolved)
+    # Each manifest, of the lists and the images, was fetched once.
+    self.assertEqual(2 + len(self.platforms),
+                     self.registry.count('GET', '/manifests/'))
+
+  def test_resolve_all_platforms(self):
+    self._check_all_platforms(threads=1)
+
+  def test_resolve_all_platforms_threads(self):
+    self._check_all_platforms(threads=4)
+
+  def test_resolve(self):
+    target = docker_image_list.Platform(_Platform('arm', 'v7'))
+    with self._list(threads=4) as image_list:
+      image = image_list.resolve(target)
+    with image:
+      self.assertEqual(_Platform('arm', 'v7'), self.platforms[image.digest()])
+
+  def test_nested_list_error(self):
+    self._fail(self.nested)
+    with self._list(threads=4) as image_list:
+      with self.assertRaises(docker_http.V2DiagnosticException):
+        image_list.resolve_all_platforms()
+
+  def test_image_error(self):
+    digest = [digest for (digest, platform) in self.platforms.items()
+              if platform['architecture'] == 'ppc64le'][0]
+    self._fail(digest)
+    with self._list(threads=4) as image_list:
+      with self.assertRaises(docker_http.V2DiagnosticException):
+        image_list.resolve_all_platforms()
+
+
+if __name__ == '__main__':
+  unittest.main()
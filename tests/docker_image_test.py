@@ -0,0 +1,281 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.docker_image."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client import stream
+from containerregistry.client.v2_2 import docker_http
+from containerregistry.client.v2_2 import docker_image
+from containerregistry.client.v2_2 import oci_compat
+from containerregistry.tests import fake_registry
+
+try:
+  import zstandard  # pylint: disable=g-import-not-at-top
+except ImportError:
+  zstandard = None
+
+
+def _Flatten(image):
+  """Extracts the final filesystem of image, as a dict of its files."""
+  buf = io.BytesIO()
+  with tarfile.open(fileobj=buf, mode='w:') as tar:
+    docker_image.extract(image, tar)
+  buf.seek(0)
+  with tarfile.open(fileobj=buf, mode='r:') as tar:
+    return {
+        member.name: tar.extractfile(member).read()
+        for member in tar.getmembers()
+    }
+
+
+def _Padded(entries):
+  """A gzipped layer, whose stream runs on well past its tarball."""
+  return fake_registry.Gzip(
+      fake_registry.Tarball(entries) + os.urandom(4 * stream.CHUNK_SIZE))
+
+
+class FlattenTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = fake_registry.Registry()
+    self.lower = fake_registry.Tarball([('etc/os-release', b'lower'),
+                                        ('etc/hosts', b'hosts')])
+    self.upper = fake_registry.Tarball([('etc/os-release', b'upper')])
+    self.manifest, unused_digest = self.registry.put_image(
+        'foo/bar', 'latest', [self.lower, self.upper])
+
+  def _image(self):
+    return docker_image.FromRegistry(
+        docker_name.Tag('{host}/foo/bar:latest'.format(
+            host=self.registry.host)), docker_creds.Anonymous(),
+        self.registry)
+
+  def _tamper(self, index, layer):
+    """Replaces the blob of the index'th layer, keeping its digest."""
+    digest = json.loads(self.manifest.decode('utf8'))['layers'][index]['digest']
+    self.registry.blobs['foo/bar'][digest] = layer
+
+  def _extract(self):
+    with self._image() as image:
+      return _Flatten(image)
+
+  def test_extract(self):
+    self.assertEqual({
+        'etc/os-release': b'upper',
+        'etc/hosts': b'hosts'
+    }, self._extract())
+
+  def test_extract_rejects_tampered_layer(self):
+    # A well-formed layer, which tarfile reads to its end-of-archive marker
+    # without complaint, served in place of the one the manifest names.
+    self._tamper(0, _Padded([('etc/hosts', b'evil')]))
+    with self.assertRaises(docker_image.DigestMismatchedError):
+      self._extract()
+
+  def test_extract_paths_rejects_tampered_layer(self):
+    self._tamper(1, _Padded([('etc/os-release', b'evil')]))
+    with self._image() as image:
+      with self.assertRaises(docker_image.DigestMismatchedError):
+        docker_image.extract_paths(image, ['/etc/os-release'])
+
+
+class ExtractPathsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = fake_registry.Registry()
+    self.registry.put_image('foo/bar', 'latest', [
+        fake_registry.Tarball([('usr/bin/python3.11', b'python'),
+                               ('etc/os-release', b'lower')]),
+        fake_registry.Tarball([
+            ('usr/bin/python3.11', b'python'),
+            fake_registry.Link('usr/bin/python3', 'usr/bin/python3.11',
+                               hardlink=True),
+            fake_registry.Link('usr/bin/python', 'python3'),
+            fake_registry.Link('usr/bin/missing', 'usr/bin/absent',
+                               hardlink=True),
+        ]),
+    ])
+
+  def _image(self):
+    return docker_image.FromRegistry(
+        docker_name.Tag('{host}/foo/bar:latest'.format(
+            host=self.registry.host)), docker_creds.Anonymous(),
+        self.registry)
+
+  def test_extract_file(self):
+    with self._image() as image:
+      self.assertEqual(
+          b'lower', docker_image.extract_file(image, '/etc/os-release').read())
+      self.assertIsNone(docker_image.extract_file(image, '/etc/absent'))
+
+  def test_symlink(self):
+    with self._image() as image:
+      tarinfo, fileobj = docker_image.extract_paths(
+          image, ['/usr/bin/python'])['/usr/bin/python']
+    self.assertTrue(tarinfo.issym())
+    self.assertEqual('python3', tarinfo.linkname)
+    self.assertIsNone(fileobj)
+
+  def test_hardlink(self):
+    with self._image() as image:
+      fileobj = docker_image.extract_file(image, '/usr/bin/python3')
+      self.assertEqual(b'python', fileobj.read())
+      found = docker_image.extract_paths(
+          image, ['/usr/bin/python3', 'usr/bin/python3', '/usr/bin/missing'])
+    for path in ('/usr/bin/python3', 'usr/bin/python3'):
+      tarinfo, fileobj = found[path]
+      self.assertTrue(tarinfo.isfile())
+      self.assertEqual(('usr/bin/python3', 6, ''),
+                       (tarinfo.name, tarinfo.size, tarinfo.linkname))
+      self.assertEqual(b'python', fileobj.read())
+    # A link to a file missing from its layer is returned as it is.
+    tarinfo, fileobj = found['/usr/bin/missing']
+    self.assertTrue(tarinfo.islnk())
+    self.assertIsNone(fileobj)
+
+
+class FromTarballTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.tarball = os.path.join(self.directory, 'image.tar')
+    self.lower = fake_registry.Tarball([('etc/os-release', b'lower')])
+    self.upper = fake_registry.Tarball([('etc/os-release', b'upper')])
+    # The tarball holds the upper layer gzipped already.
+    fake_registry.Save(self.tarball,
+                       [self.lower, fake_registry.Gzip(self.upper)])
+    # Spool layers into a directory of our own, to see what is left there.
+    self.spool = os.path.join(self.directory, 'spool')
+    os.mkdir(self.spool)
+    tempdir = tempfile.tempdir
+    tempfile.tempdir = self.spool
+    self.addCleanup(setattr, tempfile, 'tempdir', tempdir)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _check(self, threads):
+    with docker_image.FromTarball(self.tarball, threads=threads) as image:
+      manifest = json.loads(image.manifest())
+      self.assertEqual(docker_http.MANIFEST_SCHEMA2_MIME, manifest['mediaType'])
+      config = image.blob(manifest['config']['digest'])
+      self.assertEqual(
+          (manifest['config']['digest'], manifest['config']['size']),
+          (fake_registry.Digest(config), len(config)))
+      self.assertEqual([docker_http.LAYER_MIME] * 2,
+                       [layer['mediaType'] for layer in manifest['layers']])
+      layers = []
+      for layer in manifest['layers']:
+        blob = image.blob(layer['digest'])
+        self.assertEqual((layer['digest'], layer['size']),
+                         (fake_registry.Digest(blob), len(blob)))
+        with image.blob_stream(layer['digest']) as f:
+          self.assertEqual(blob, f.read())
+        layers.append(blob)
+      self.assertEqual(self.lower, stream.Gunzip(io.BytesIO(layers[0])).read())
+      # The gzipped layer is passed through as it is.
+      self.assertEqual(fake_registry.Gzip(self.upper), layers[1])
+      self.assertEqual(
+          [fake_registry.Digest(self.lower), fake_registry.Digest(self.upper)],
+          json.loads(image.config_file())['rootfs']['diff_ids'])
+      # Only the uncompressed layer was spooled, and only once.
+      self.assertEqual(1, len(os.listdir(self.spool)))
+    self.assertEqual([], os.listdir(self.spool))
+
+  def test_from_tarball(self):
+    self._check(threads=1)
+
+  def test_from_tarball_threads(self):
+    self._check(threads=4)
+
+  def test_extract(self):
+    with docker_image.FromTarball(self.tarball, threads=4) as image:
+      self.assertEqual({'etc/os-release': b'upper'}, _Flatten(image))
+    self.assertEqual([], os.listdir(self.spool))
+
+
+@unittest.skipUnless(zstandard, 'zstd requires the zstandard module')
+class ZstdTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.tarball = os.path.join(self.directory, 'image.tar')
+    self.lower = fake_registry.Tarball([('etc/os-release', b'lower'),
+                                        ('etc/hosts', b'hosts')])
+    self.upper = fake_registry.Tarball([('etc/os-release', b'upper')])
+    # The tarball holds the upper layer zstd compressed already.
+    fake_registry.Save(self.tarball, [self.lower, stream.Zstd(self.upper)])
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _image(self):
+    return docker_image.FromTarball(
+        self.tarball, compression=docker_image.ZSTD)
+
+  def test_manifest(self):
+    with self._image() as image:
+      manifest = json.loads(image.manifest())
+      self.assertEqual(docker_http.OCI_MANIFEST_MIME, manifest['mediaType'])
+      self.assertEqual(docker_http.OCI_CONFIG_JSON_MIME,
+                       manifest['config']['mediaType'])
+      self.assertEqual([docker_http.OCI_ZSTD_LAYER_MIME] * 2,
+                       [layer['mediaType'] for layer in manifest['layers']])
+      layers = []
+      for layer in manifest['layers']:
+        blob = image.blob(layer['digest'])
+        self.assertEqual((layer['digest'], layer['size']),
+                         (fake_registry.Digest(blob), len(blob)))
+        with image.blob_stream(layer['digest']) as f:
+          self.assertEqual(blob, f.read())
+        with stream.Decompress(io.BytesIO(blob)) as f:
+          layers.append(f.read())
+      self.assertEqual([self.lower, self.upper], layers)
+      # The compressed layer is passed through as it is.
+      self.assertEqual(stream.Zstd(self.upper),
+                       image.blob(manifest['layers'][1]['digest']))
+
+  def test_extract(self):
+    with self._image() as image:
+      self.assertEqual({
+          'etc/os-release': b'upper',
+          'etc/hosts': b'hosts'
+      }, _Flatten(image))
+
+  def test_oci_compat(self):
+    with self._image() as image:
+      manifest = json.loads(oci_compat.OCIFromV22(image).manifest())
+      self.assertEqual([docker_http.OCI_ZSTD_LAYER_MIME] * 2,
+                       [layer['mediaType'] for layer in manifest['layers']])
+      # Schema 2 can't describe zstd layers.
+      with self.assertRaises(ValueError):
+        oci_compat.V22FromOCI(image).manifest()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,468 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.docker_session."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client import known_blobs
+from containerregistry.client import registry_capabilities
+from containerregistry.client.v2_2 import docker_http
+from containerregistry.client.v2_2 import docker_image
+from containerregistry.client.v2_2 import docker_image_list
+from containerregistry.client.v2_2 import docker_session
+from containerregistry.tests import fake_registry
+
+
+class PushTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = fake_registry.Registry(bearer=True)
+    self.layer = fake_registry.Tarball([('etc/os-release', b'debian')])
+    self.manifest, self.digest = self.registry.put_image(
+        'src/app', 'latest', [self.layer])
+    self.directory = tempfile.mkdtemp()
+    self.known_blobs = known_blobs.KnownBlobs(
+        os.path.join(self.directory, 'known_blobs'))
+    self.capabilities = registry_capabilities.Capabilities(
+        os.path.join(self.directory, 'capabilities'))
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _name(self, reference):
+    return docker_name.from_string('{host}/{reference}'.format(
+        host=self.registry.host, reference=reference))
+
+  def _push(self, reference, **kwargs):
+    with docker_image.FromRegistry(self._name('src/app:latest'),
+                                   docker_creds.Anonymous(),
+                                   self.registry) as image:
+      with docker_session.Push(self._name(reference), docker_creds.Anonymous(),
+                               self.registry, **kwargs) as session:
+        session.upload(image)
+
+  def _pushed(self, repository):
+    return self.registry.manifests[repository]['latest'][0]
+
+  def test_push(self):
+    self._push('dst/app:latest')
+    self.assertEqual(self.manifest, self._pushed('dst/app'))
+
+  def test_discovered_mount_denied(self):
+    # known_blobs knows of another repository holding the image's blobs,
+    # from which we may not pull.
+    for digest in self.registry.blobs['src/app']:
+      self.known_blobs.add(self._name('secret/app:latest'), digest)
+    self.registry.denied.add('secret/app')
+
+    self._push('dst/app:latest', known_blobs=self.known_blobs)
+    self.assertEqual(self.manifest, self._pushed('dst/app'))
+    self.assertEqual(self.registry.blobs['src/app'],
+                     self.registry.blobs['dst/app'])
+
+  def test_mount_denied(self):
+    self.registry.blobs['secret/app'] = dict(self.registry.blobs['src/app'])
+    self.registry.denied.add('secret/app')
+    self._push('dst/app:latest', mount=[self._name('secret/app')])
+    self.assertEqual(self.manifest, self._pushed('dst/app'))
+    self.assertEqual(self.registry.blobs['src/app'],
+                     self.registry.blobs['dst/app'])
+
+  def test_mount(self):
+    self._push('dst/app:latest', mount=[self._name('src/app')])
+    self.assertEqual(self.manifest, self._pushed('dst/app'))
+    self.assertEqual(0, self.registry.count('PATCH'))
+
+  def _fault(self, method, status, code, times = None, query = None):
+    """Fails requests with method (and query), times or always."""
+    remaining = [times]
+
+    def fault(request_method, unused_path, request_query, unused_headers):
+      if request_method != method or remaining[0] == 0:
+        return None
+      if query and query not in request_query:
+        return None
+      if remaining[0]:
+        remaining[0] -= 1
+      return fake_registry.Error(status, code)
+
+    self.registry.faults.append(fault)
+
+  def test_unsupported_monolithic_upload(self):
+    self._fault('POST', 405, 'UNSUPPORTED', query='digest')
+    self._push('dst/app:latest', registry_capabilities=self.capabilities)
+    self.assertEqual(self.manifest, self._pushed('dst/app'))
+    self.assertEqual(
+        False,
+        self.capabilities.get(self.registry.host)[
+            registry_capabilities.MONOLITHIC])
+
+  def test_transient_error(self):
+    self._fault('POST', 429, 'TOOMANYREQUESTS', times=1, query='digest')
+    with self.assertRaises(docker_http.V2DiagnosticException):
+      self._push('dst/app:latest', registry_capabilities=self.capabilities)
+    self.assertNotIn(registry_capabilities.MONOLITHIC,
+                     self.capabilities.get(self.registry.host))
+
+  def test_resume_without_range(self):
+    for capability in (registry_capabilities.MONOLITHIC,
+                       registry_capabilities.PUT):
+      self.capabilities.set(self.registry.host, capability, False)
+    interrupted = []
+
+    def interrupt(method, unused_path, unused_query, unused_headers):
+      if method == 'PATCH' and not interrupted:
+        interrupted.append(True)
+        raise socket.error('connection reset')
+
+    self.registry.faults.append(interrupt)
+    self._push('dst/app:latest', registry_capabilities=self.capabilities)
+    self.assertEqual(self.manifest, self._pushed('dst/app'))
+    self.assertEqual(self.registry.blobs['src/app'],
+                     self.registry.blobs['dst/app'])
+    # The GET of the upload's status had no Range, so it started over.
+    self.assertEqual(1, self.registry.count('GET', '/blobs/uploads/'))
+
+
+class StreamTest(unittest.TestCase):
+  """Pushes of layers streamed from the image, a PATCH at a time."""
+
+  def setUp(self):
+    self.registry = fake_registry.Registry()
+    self.manifest, unused_digest = self.registry.put_image(
+        'src/app', 'latest', [os.urandom(1000)])
+    self.digest = json.loads(self.manifest.decode('utf8'))['layers'][0][
+        'digest']
+    self.layer = self.registry.blobs['src/app'][self.digest]
+    self.directory = tempfile.mkdtemp()
+    self.capabilities = registry_capabilities.Capabilities(
+        os.path.join(self.directory, 'capabilities'))
+    self.addCleanup(setattr, docker_session, '_PATCH_SIZE',
+                    docker_session._PATCH_SIZE)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _name(self, reference):
+    return docker_name.from_string('{host}/{reference}'.format(
+        host=self.registry.host, reference=reference))
+
+  def _push(self, reference):
+    with docker_image.FromRegistry(self._name('src/app:latest'),
+                                   docker_creds.Anonymous(),
+                                   self.registry) as image:
+      with docker_session.Push(
+          self._name(reference),
+          docker_creds.Anonymous(),
+          self.registry,
+          registry_capabilities=self.capabilities,
+          stream_blobs=True) as session:
+        session.upload(image)
+    self.assertEqual(self.manifest,
+                     self.registry.manifests['dst/app']['latest'][0])
+    self.assertEqual(self.layer, self.registry.blobs['dst/app'][self.digest])
+
+  def test_single_chunk(self):
+    # A layer that fits in a single PATCH is uploaded as any other would be.
+    self._push('dst/app:latest')
+    self.assertEqual(0, self.registry.count('PATCH'))
+
+  def test_single_chunk_without_monolithic_upload(self):
+    self.capabilities.set(self.registry.host, registry_capabilities.MONOLITHIC,
+                          False)
+    self._push('dst/app:latest')
+    self.assertEqual(0, self.registry.count('PATCH'))
+    self.assertEqual(2, self.registry.count('PUT', '/blobs/uploads/'))
+
+  def test_chunks(self):
+    docker_session._PATCH_SIZE = 300
+    self._push('dst/app:latest')
+    self.assertEqual(4, self.registry.count('PATCH'))
+
+  def test_resume(self):
+    docker_session._PATCH_SIZE = 300
+    interrupted = []
+
+    def interrupt(method, unused_path, unused_query, headers):
+      if (method == 'PATCH' and not interrupted and
+          headers.get('content-range', '').startswith('300-')):
+        interrupted.append(True)
+        raise socket.error('connection reset')
+
+    self.registry.faults.append(interrupt)
+    self._push('dst/app:latest')
+    # The second chunk is sent again, once the upload's status says none of
+    # it was received.
+    self.assertEqual(1, self.registry.count('GET', '/blobs/uploads/'))
+    self.assertEqual(5, self.registry.count('PATCH'))
+
+  def test_no_resume_without_range(self):
+    docker_session._PATCH_SIZE = 300
+    self.capabilities.set(self.registry.host, registry_capabilities.RANGE,
+                          False)
+
+    def interrupt(method, unused_path, unused_query, unused_headers):
+      if method == 'PATCH':
+        raise socket.error('connection reset')
+
+    self.registry.faults.append(interrupt)
+    with self.assertRaises(socket.error):
+      self._push('dst/app:latest')
+
+
+class _Keychain(object):
+
+  def Resolve(self, unused_name):
+    return docker_creds.Anonymous()
+
+
+class MultiPushTest(unittest.TestCase):
+
+  def setUp(self):
+    self.source = fake_registry.Registry()
+    self.manifest, unused_digest = self.source.put_image(
+        'src/app', 'latest', [os.urandom(1000)])
+    self.digest = json.loads(self.manifest.decode('utf8'))['layers'][0][
+        'digest']
+    self.layer = self.source.blobs['src/app'][self.digest]
+    self.registries = [fake_registry.Registry(), fake_registry.Registry()]
+    self.transport = fake_registry.Hosts(self.source, *self.registries)
+    self.addCleanup(setattr, docker_session, '_PATCH_SIZE',
+                    docker_session._PATCH_SIZE)
+
+  def _name(self, registry, reference):
+    return docker_name.from_string('{host}/{reference}'.format(
+        host=registry.host, reference=reference))
+
+  def _push(self, threads = 1):
+    names = [
+        self._name(registry, reference)
+        for registry in self.registries
+        for reference in ('dst/app:latest', 'dst/other:latest')
+    ]
+    with docker_image.FromRegistry(
+        self._name(self.source, 'src/app:latest'), docker_creds.Anonymous(),
+        self.transport) as image:
+      with docker_session.MultiPush(names, _Keychain(), self.transport,
+                                    threads=threads) as session:
+        return session.upload(image)
+
+  def _check(self, registry):
+    for repository in ('dst/app', 'dst/other'):
+      self.assertEqual(self.manifest,
+                       registry.manifests[repository]['latest'][0])
+      self.assertEqual(self.layer, registry.blobs[repository][self.digest])
+
+  def test_push(self):
+    report = self._push()
+    self.assertEqual([None] * 4, list(report.values()))
+    for registry in self.registries:
+      self._check(registry)
+      # The second repository mounts both blobs from the first.
+      self.assertEqual(2, registry.count('POST', '/dst/other/'))
+      self.assertEqual(0, registry.count('PUT', '/dst/other/blobs/'))
+    # The layer is read once, for both registries.
+    self.assertEqual(1, self.source.count('GET', '/blobs/' + self.digest))
+
+  def test_chunks(self):
+    docker_session._PATCH_SIZE = 300
+    self.assertEqual([None] * 4, list(self._push(threads=4).values()))
+    for registry in self.registries:
+      self._check(registry)
+      self.assertEqual(4, registry.count('PATCH'))
+    self.assertEqual(1, self.source.count('GET', '/blobs/' + self.digest))
+
+  def test_failure(self):
+    docker_session._PATCH_SIZE = 300
+    failing, working = self.registries
+
+    def fault(method, unused_path, unused_query, unused_headers):
+      if method == 'PATCH':
+        return fake_registry.Error(500, 'UNKNOWN')
+
+    failing.faults.append(fault)
+    report = self._push(threads=4)
+    for (name, e) in report.items():
+      if name.registry == failing.host:
+        self.assertIsInstance(e, docker_http.V2DiagnosticException)
+      else:
+        self.assertIsNone(e)
+    self._check(working)
+    self.assertEqual(1, failing.count('PATCH'))
+
+  def test_slow_destination(self):
+    docker_session._PATCH_SIZE = 300
+    self.registries.append(fake_registry.Registry())
+    self.transport = fake_registry.Hosts(self.source, *self.registries)
+    slow, fast, failing = self.registries
+    # The slow registry takes its first chunk only once the fast one has
+    # taken its second, which it can't if they're uploaded to in turn.
+    overtaken = threading.Event()
+    waited = []
+
+    def wait(method, unused_path, unused_query, unused_headers):
+      if method == 'PATCH' and not waited:
+        waited.append(overtaken.wait(5))
+
+    def overtake(method, unused_path, unused_query, headers):
+      if method == 'PATCH' and headers.get('content-range', '').startswith(
+          '300-'):
+        overtaken.set()
+
+    def fail(method, unused_path, unused_query, unused_headers):
+      if method == 'PATCH':
+        return fake_registry.Error(500, 'UNKNOWN')
+
+    slow.faults.append(wait)
+    fast.faults.append(overtake)
+    failing.faults.append(fail)
+    report = self._push()
+    self.assertEqual([True], waited)
+    for (name, e) in report.items():
+      if name.registry == failing.host:
+        self.assertIsInstance(e, docker_http.V2DiagnosticException)
+      else:
+        self.assertIsNone(e)
+    self._check(slow)
+    self._check(fast)
+    self.assertEqual(1, failing.count('PATCH'))
+    self.assertEqual(1, self.source.count('GET', '/blobs/' + self.digest))
+
+
+class CopyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.source = fake_registry.Registry()
+    self.registry = fake_registry.Registry()
+    self.transport = fake_registry.Hosts(self.source, self.registry)
+    self.manifest, self.digest = self.source.put_image(
+        'src/app', 'latest', [fake_registry.Tarball([('etc/os-release',
+                                                      b'debian')])])
+    children = []
+    for arch in ('amd64', 'arm64'):
+      platform = {'os': 'linux', 'architecture': arch}
+      manifest, unused_digest = self.source.put_image(
+          'src/list', None, [fake_registry.Tarball([('arch', arch.encode())])],
+          platform=platform)
+      children.append((manifest, platform))
+    self.list, self.list_digest = self.source.put_list('src/list', 'latest',
+                                                       children)
+
+  def _name(self, registry, reference):
+    return docker_name.from_string('{host}/{reference}'.format(
+        host=registry.host, reference=reference))
+
+  def _copy(self, src, dst):
+    return docker_session.Copy(src, docker_creds.Anonymous(), dst,
+                               docker_creds.Anonymous(), self.transport,
+                               threads=4)
+
+  def test_copy(self):
+    self.assertEqual(
+        self.digest,
+        self._copy(self._name(self.source, 'src/app:latest'),
+                   self._name(self.registry, 'dst/app:latest')))
+    self.assertEqual(self.manifest,
+                     self.registry.manifests['dst/app']['latest'][0])
+    self.assertEqual(self.source.blobs['src/app'],
+                     self.registry.blobs['dst/app'])
+
+  def test_copy_list(self):
+    self.assertEqual(
+        self.list_digest,
+        self._copy(self._name(self.source, 'src/list@' + self.list_digest),
+                   self._name(self.registry, 'dst/list:latest')))
+    self.assertEqual(self.list,
+                     self.registry.manifests['dst/list']['latest'][0])
+    self.assertEqual(self.source.blobs['src/list'],
+                     self.registry.blobs['dst/list'])
+
+  def test_same_registry(self):
+    self._copy(self._name(self.source, 'src/app:latest'),
+               self._name(self.source, 'dst/app:latest'))
+    self.assertEqual(self.source.blobs['src/app'],
+                     self.source.blobs['dst/app'])
+    # The blobs were mounted, rather than uploaded.
+    self.assertEqual([], [
+        path for (method, path, query) in self.source.requests
+        if method in ('POST', 'PUT', 'PATCH') and '/blobs/uploads/' in path
+        and 'mount' not in query
+    ])
+
+  def test_missing(self):
+    with self.assertRaises(ValueError):
+      self._copy(self._name(self.source, 'src/app:missing'),
+                 self._name(self.registry, 'dst/app:latest'))
+
+
+class PushListTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = fake_registry.Registry()
+    self.children = []
+    for arch in ('amd64', 'arm64'):
+      platform = {'os': 'linux', 'architecture': arch}
+      manifest, unused_digest = self.registry.put_image(
+          'src/app', None, [fake_registry.Tarball([('arch', arch.encode())])],
+          platform=platform)
+      self.children.append((manifest, platform))
+    self.manifest, unused_digest = self.registry.put_list(
+        'src/app', 'latest', self.children)
+
+  def _name(self, reference):
+    return docker_name.from_string('{host}/{reference}'.format(
+        host=self.registry.host, reference=reference))
+
+  def _push(self, reference):
+    with docker_image_list.FromRegistry(self._name('src/app:latest'),
+                                        docker_creds.Anonymous(),
+                                        self.registry) as image:
+      with docker_session.Push(self._name(reference), docker_creds.Anonymous(),
+                               self.registry, threads=4) as session:
+        session.upload(image)
+
+  def test_push(self):
+    self._push('dst/app:latest')
+    self.assertEqual(self.manifest,
+                     self.registry.manifests['dst/app']['latest'][0])
+    for (manifest, unused_platform) in self.children:
+      self.assertIn(fake_registry.Digest(manifest),
+                    self.registry.manifests['dst/app'])
+
+  def test_existing_child(self):
+    manifest, unused_platform = self.children[0]
+    self.registry.put_manifest('dst/app', None, manifest,
+                               docker_http.MANIFEST_SCHEMA2_MIME)
+    self._push('dst/app:latest')
+    self.assertEqual(self.manifest,
+                     self.registry.manifests['dst/app']['latest'][0])
+    # Only the other child's manifest and the list's are pushed.
+    self.assertEqual(2, self.registry.count('PUT', '/manifests/'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,87 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.estargz."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import io
+import os
+import tarfile
+import unittest
+
+from containerregistry.client import stream
+from containerregistry.client.v2_2 import estargz
+from containerregistry.tests import fake_registry
+
+
+def _Fetcher(blob):
+  return lambda offset, length: blob[offset:offset + length]
+
+
+class EstargzTest(unittest.TestCase):
+
+  def setUp(self):
+    self.large = os.urandom(3000)
+    layer = fake_registry.Tarball([
+        ('etc/os-release', b'debian'),
+        ('usr/lib/large.so', self.large),
+        fake_registry.Link('usr/lib/link.so', 'usr/lib/large.so',
+                           hardlink=True),
+    ])
+    out = io.BytesIO()
+    self.diff_id, self.toc_digest, self.size = estargz.Build(
+        io.BytesIO(layer), out, chunk_size=1024)
+    self.blob = out.getvalue()
+
+  def test_read(self):
+    reader = estargz.Reader(
+        _Fetcher(self.blob), len(self.blob), toc_digest=self.toc_digest)
+    self.assertEqual(self.toc_digest, reader.toc_digest())
+    self.assertEqual(b'debian', reader.read('/etc/os-release'))
+    self.assertEqual(self.large, reader.read('usr/lib/large.so'))
+    self.assertEqual(self.large, reader.open('usr/lib/link.so').read())
+    with self.assertRaises(KeyError):
+      reader.read('etc/missing')
+
+  def test_tarball(self):
+    # The blob is an ordinary gzipped tarball, of the layer and its TOC.
+    with stream.Decompress(io.BytesIO(self.blob)) as f:
+      uncompressed = f.read()
+    self.assertEqual(
+        (self.diff_id, self.size),
+        (fake_registry.Digest(uncompressed), len(uncompressed)))
+    with tarfile.open(fileobj=io.BytesIO(uncompressed), mode='r:') as tar:
+      self.assertEqual(
+          ['etc/os-release', 'usr/lib/large.so', 'usr/lib/link.so',
+           estargz.TOC_TAR_NAME], tar.getnames())
+
+  def test_toc_digest_mismatch(self):
+    with self.assertRaises(estargz.DigestMismatchedError):
+      estargz.Reader(
+          _Fetcher(self.blob), len(self.blob), toc_digest='sha256:' + '0' * 64)
+
+  def test_not_seekable(self):
+    blob = fake_registry.Gzip(fake_registry.Tarball([('etc/os-release',
+                                                      b'debian')]))
+    self.assertFalse(estargz.IsSeekable(blob))
+    self.assertTrue(estargz.IsSeekable(self.blob))
+    with self.assertRaises(estargz.NotSeekableError):
+      estargz.Reader(_Fetcher(blob), len(blob))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,439 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""An in-memory Docker Registry, for tests to pull from and push to."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import gzip
+import hashlib
+import io
+import json
+import re
+import tarfile
+import threading
+import uuid
+
+from containerregistry.client import stream
+from containerregistry.client.v2_2 import docker_http
+import httplib2
+import six
+import six.moves.urllib.parse
+
+_UPLOAD = re.compile(r'^/v2/(.+)/blobs/uploads/([^/]*)$')
+_BLOB = re.compile(r'^/v2/(.+)/blobs/(sha256:[0-9a-f]{64})$')
+_MANIFEST = re.compile(r'^/v2/(.+)/manifests/([^/]+)$')
+_TAGS = re.compile(r'^/v2/(.+)/tags/list$')
+_SCOPE = re.compile(r'^repository:(.+):([a-z,*]+)$')
+
+
+def Digest(content):
+  return 'sha256:' + hashlib.sha256(content).hexdigest()
+
+
+def Tarball(entries):
+  """Returns an uncompressed layer holding entries.
+
+  Args:
+    entries: (name, content) tuples for regular files, or tarfile.TarInfo
+        for anything else (e.g. symlinks, hardlinks and directories).
+
+  Returns:
+    The bytes of the tarball.
+  """
+  buf = io.BytesIO()
+  with tarfile.open(fileobj=buf, mode='w:', format=tarfile.GNU_FORMAT) as tar:
+    for entry in entries:
+      if isinstance(entry, tarfile.TarInfo):
+        tar.addfile(entry)
+        continue
+      name, content = entry
+      info = tarfile.TarInfo(name)
+      info.size = len(content)
+      info.mode = 0o644
+      tar.addfile(info, io.BytesIO(content))
+  return buf.getvalue()
+
+
+def Link(name, target, hardlink = False):
+  """Returns the TarInfo of a (sym or hard) link, for Tarball."""
+  info = tarfile.TarInfo(name)
+  info.type = tarfile.LNKTYPE if hardlink else tarfile.SYMTYPE
+  info.linkname = target
+  return info
+
+
+def Gzip(content):
+  """Compresses content, reproducibly."""
+  buf = io.BytesIO()
+  with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+    f.write(content)
+  return buf.getvalue()
+
+
+def Save(filename, layers, tag = 'foo/bar:latest'):
+  """Writes the `docker save` tarball of an image of the given layers.
+
+  Args:
+    filename: the path at which to write the tarball.
+    layers: the layers, bottom first, as the tarball is to hold them, i.e.
+        uncompressed tarballs or compressed already.
+    tag: the tag of the image.
+  """
+  diff_ids = []
+  for layer in layers:
+    with stream.Decompress(io.BytesIO(layer)) as f:
+      diff_ids.append(Digest(f.read()))
+  config = json.dumps({'rootfs': {'type': 'layers', 'diff_ids': diff_ids}},
+                      sort_keys=True).encode('utf8')
+  names = ['%03d/layer.tar' % i for i in range(len(layers))]
+  manifest = json.dumps([{
+      'Config': 'config.json',
+      'RepoTags': [tag],
+      'Layers': names,
+  }]).encode('utf8')
+  with open(filename, 'wb') as f:
+    f.write(Tarball([('manifest.json', manifest), ('config.json', config)] +
+                    list(zip(names, layers))))
+
+
+def _Response(status, headers = None):
+  info = {'status': str(status)}
+  info.update(headers or {})
+  return httplib2.Response(info)
+
+
+def Error(status, code):
+  """A registry's error response, e.g. for faults to serve."""
+  return _Response(status), json.dumps(
+      {'errors': [{'code': code, 'message': code.lower()}]}).encode('utf8')
+
+
+class Registry(object):
+  """An in-memory registry, served through an httplib2-like request().
+
+  Pass it as the transport of the client's sessions and images.  Tests may
+  seed and inspect its repositories directly, inspect the requests it
+  served, and inject faults.
+
+  Args:
+    bearer: whether to challenge clients for Bearer tokens, exchanged at
+        https://<registry>/token, rather than serve them anonymously.
+  """
+
+  def __init__(self, bearer = False):
+    self._bearer = bearer
+    # Transports share what they learn of a registry by its host, so each
+    # fake gets a host of its own.
+    self.host = 'registry-{id}.example.com'.format(id=uuid.uuid4().hex[:12])
+    self._lock = threading.Lock()
+    # Maps each repository to the blobs it holds, by digest.
+    self.blobs = {}
+    # Maps each repository to its manifests, as (content, media type) by tag
+    # and by digest.
+    self.manifests = {}
+    # Maps each upload's id to its repository and what it received so far.
+    self.uploads = {}
+    # The (method, path, query) of every request served, in order.
+    self.requests = []
+    # The repositories whose pull scope the token exchange refuses.
+    self.denied = set()
+    # Callables taking (method, path, query, headers), which may return a
+    # (response, content) tuple to serve in place of the registry's own.
+    self.faults = []
+
+  def put_blob(self, repository, content):
+    digest = Digest(content)
+    self.blobs.setdefault(repository, {})[digest] = content
+    return digest
+
+  def put_manifest(self, repository, tag, manifest, media_type):
+    manifest = manifest if isinstance(manifest, bytes) else manifest.encode(
+        'utf8')
+    digest = Digest(manifest)
+    manifests = self.manifests.setdefault(repository, {})
+    manifests[digest] = (manifest, media_type)
+    if tag:
+      manifests[tag] = (manifest, media_type)
+    return digest
+
+  def put_image(self,
+                repository,
+                tag,
+                layers,
+                platform = None,
+                layer_media_type = docker_http.LAYER_MIME):
+    """Seeds repository with an image of the given uncompressed layers.
+
+    Args:
+      repository: the repository to hold the image, e.g. 'foo/bar'.
+      tag: the tag to point at the image, or None.
+      layers: the uncompressed tarballs of the layers, bottom first, which
+          are gzipped unless layer_media_type isn't a tar.
+      platform: the dict of the image's 'os' and 'architecture', if any.
+      layer_media_type: the media type of the layers.
+
+    Returns:
+      A tuple of the image's manifest and its digest.
+    """
+    config = {'rootfs': {'type': 'layers', 'diff_ids': []}}
+    config.update(platform or {})
+    descriptors = []
+    for layer in layers:
+      blob = layer
+      if layer_media_type == docker_http.LAYER_MIME:
+        blob = Gzip(layer)
+      config['rootfs']['diff_ids'].append(Digest(layer))
+      descriptors.append({
+          'mediaType': layer_media_type,
+          'size': len(blob),
+          'digest': self.put_blob(repository, blob),
+      })
+    config = json.dumps(config, sort_keys=True).encode('utf8')
+    manifest = json.dumps({
+        'schemaVersion': 2,
+        'mediaType': docker_http.MANIFEST_SCHEMA2_MIME,
+        'config': {
+            'mediaType': docker_http.CONFIG_JSON_MIME,
+            'size': len(config),
+            'digest': self.put_blob(repository, config),
+        },
+        'layers': descriptors,
+    }, sort_keys=True).encode('utf8')
+    return manifest, self.put_manifest(repository, tag, manifest,
+                                       docker_http.MANIFEST_SCHEMA2_MIME)
+
+  def put_list(self, repository, tag, children):
+    """Seeds repository with a manifest list of the given children.
+
+    Args:
+      repository: the repository to hold the list.
+      tag: the tag to point at the list, or None.
+      children: (manifest, platform) tuples, where manifest was seeded (e.g.
+          by put_image) in repository, and platform is a dict or None.
+
+    Returns:
+      A tuple of the list's manifest and its digest.
+    """
+    manifests = []
+    for (manifest, platform) in children:
+      descriptor = {
+          'mediaType': json.loads(manifest.decode('utf8'))['mediaType'],
+          'size': len(manifest),
+          'digest': Digest(manifest),
+      }
+      if platform:
+        descriptor['platform'] = platform
+      manifests.append(descriptor)
+    manifest = json.dumps({
+        'schemaVersion': 2,
+        'mediaType': docker_http.MANIFEST_LIST_MIME,
+        'manifests': manifests,
+    }, sort_keys=True).encode('utf8')
+    return manifest, self.put_manifest(repository, tag, manifest,
+                                       docker_http.MANIFEST_LIST_MIME)
+
+  def count(self, method, pattern = ''):
+    """The number of requests served with method, to paths with pattern."""
+    return len([
+        path for (m, path, unused_query) in self.requests
+        if m == method and re.search(pattern, path)
+    ])
+
+  # pylint: disable=invalid-name,unused-argument
+  def request(self, uri, method = 'GET', body = None, headers = None,
+              **kwargs):
+    """Serves a request, as httplib2.Http.request() would."""
+    headers = {k.lower(): v for (k, v) in six.iteritems(headers or {})}
+    if isinstance(body, six.text_type):
+      body = body.encode('utf8')
+    parts = six.moves.urllib.parse.urlsplit(uri)
+    path = six.moves.urllib.parse.unquote(parts.path)
+    query = six.moves.urllib.parse.parse_qs(parts.query)
+    with self._lock:
+      self.requests.append((method, path, query))
+      for fault in self.faults:
+        response = fault(method, path, query, headers)
+        if response is not None:
+          return response
+      return self._serve(parts.netloc, method, path, query, headers, body)
+
+  def _serve(self, host, method, path, query, headers, body):
+    if path == '/token':
+      return self._token(query)
+    if path == '/v2/':
+      if self._bearer:
+        return _Response(
+            401, {
+                'www-authenticate':
+                    'Bearer realm="https://{host}/token",service="{host}"'
+                    .format(host=host)
+            }), b''
+      return _Response(200), b''
+    if self._bearer and not headers.get('authorization', '').startswith(
+        'Bearer '):
+      return Error(401, 'UNAUTHORIZED')
+
+    m = _UPLOAD.match(path)
+    if m:
+      return self._upload(host, method, m.group(1), m.group(2), query,
+                          headers, body)
+    m = _BLOB.match(path)
+    if m:
+      return self._blob(method, m.group(1), m.group(2), headers)
+    m = _MANIFEST.match(path)
+    if m:
+      return self._manifest(method, m.group(1), m.group(2), body, headers)
+    m = _TAGS.match(path)
+    if m:
+      tags = [
+          ref for ref in self.manifests.get(m.group(1), {})
+          if not ref.startswith('sha256:')
+      ]
+      return _Response(200), json.dumps({
+          'name': m.group(1),
+          'tags': sorted(tags)
+      }).encode('utf8')
+    return Error(404, 'NAME_UNKNOWN')
+
+  def _token(self, query):
+    for scope in query.get('scope', []):
+      m = _SCOPE.match(scope)
+      if m and m.group(1) in self.denied:
+        return Error(403, 'DENIED')
+    return _Response(200), json.dumps({
+        'token': uuid.uuid4().hex,
+        'expires_in': 300
+    }).encode('utf8')
+
+  def _blob(self, method, repository, digest, headers):
+    content = self.blobs.get(repository, {}).get(digest)
+    if content is None:
+      return Error(404, 'BLOB_UNKNOWN')
+    if method == 'HEAD':
+      return _Response(200, {
+          'content-length': str(len(content)),
+          'docker-content-digest': digest
+      }), b''
+    m = re.match(r'bytes=(\d+)-(\d+)', headers.get('range', ''))
+    if not m:
+      return _Response(200, {'docker-content-digest': digest}), content
+    start, end = int(m.group(1)), int(m.group(2))
+    if start >= len(content):
+      return _Response(416), b''
+    part = content[start:end + 1]
+    return _Response(
+        206, {
+            'content-range':
+                'bytes {start}-{end}/{size}'.format(
+                    start=start, end=start + len(part) - 1,
+                    size=len(content))
+        }), part
+
+  def _location(self, host, repository, upload):
+    received = len(self.uploads[upload][1])
+    headers = {
+        'location': 'https://{host}/v2/{repository}/blobs/uploads/{upload}'
+                    .format(host=host, repository=repository, upload=upload),
+        'docker-upload-uuid': upload,
+    }
+    if received:
+      headers['range'] = '0-%d' % (received - 1)
+    return headers
+
+  def _store(self, host, repository, digest, content):
+    if Digest(content) != digest:
+      return Error(400, 'DIGEST_INVALID')
+    self.blobs.setdefault(repository, {})[digest] = content
+    return _Response(
+        201, {
+            'location': 'https://{host}/v2/{repository}/blobs/{digest}'.format(
+                host=host, repository=repository, digest=digest),
+            'docker-content-digest': digest
+        }), b''
+
+  def _upload(self, host, method, repository, upload, query, headers, body):
+    if method == 'POST':
+      digest = query.get('digest', [None])[0]
+      if digest and body:
+        return self._store(host, repository, digest, body)
+      mount = query.get('mount', [None])[0]
+      for source in query.get('from', []):
+        content = self.blobs.get(source, {}).get(mount)
+        if content is not None:
+          return self._store(host, repository, mount, content)
+      upload = uuid.uuid4().hex
+      self.uploads[upload] = (repository, bytearray())
+      response = self._location(host, repository, upload)
+      response['range'] = '0-0'
+      return _Response(202, response), b''
+
+    if upload not in self.uploads:
+      return Error(404, 'BLOB_UPLOAD_UNKNOWN')
+    unused_repository, received = self.uploads[upload]
+    if method == 'GET':
+      return _Response(204, self._location(host, repository, upload)), b''
+    if method == 'PATCH':
+      m = re.match(r'(\d+)-', headers.get('content-range', ''))
+      if m and int(m.group(1)) != len(received):
+        return _Response(416, self._location(host, repository, upload)), b''
+      received.extend(body or b'')
+      return _Response(202, self._location(host, repository, upload)), b''
+    if method == 'PUT':
+      received.extend(body or b'')
+      del self.uploads[upload]
+      return self._store(host, repository, query['digest'][0],
+                         bytes(received))
+    return Error(405, 'UNSUPPORTED')
+
+  def _manifest(self, method, repository, reference, body, headers):
+    if method == 'PUT':
+      digest = self.put_manifest(repository, None if reference.startswith(
+          'sha256:') else reference, body, headers.get('content-type'))
+      return _Response(201, {'docker-content-digest': digest}), b''
+    if method == 'DELETE':
+      if self.manifests.get(repository, {}).pop(reference, None) is None:
+        return Error(404, 'MANIFEST_UNKNOWN')
+      return _Response(202), b''
+    entry = self.manifests.get(repository, {}).get(reference)
+    if entry is None:
+      return Error(404, 'MANIFEST_UNKNOWN')
+    manifest, media_type = entry
+    response = _Response(
+        200, {
+            'content-type': media_type,
+            'content-length': str(len(manifest)),
+            'docker-content-digest': Digest(manifest)
+        })
+    return response, b'' if method == 'HEAD' else manifest
+
+
+class Hosts(object):
+  """Routes each request to whichever of several fake Registries it names.
+
+  Pass it as the transport of clients talking to more than one registry.
+
+  Args:
+    registries: the fake Registry instances to serve.
+  """
+
+  def __init__(self, *registries):
+    self._registries = {registry.host: registry for registry in registries}
+
+  def request(self, uri, *args, **kwargs):
+    """Serves a request, as httplib2.Http.request() would."""
+    host = six.moves.urllib.parse.urlsplit(uri).netloc
+    return self._registries[host].request(uri, *args, **kwargs)
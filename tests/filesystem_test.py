@@ -0,0 +1,106 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.filesystem."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from containerregistry.client import filesystem
+from containerregistry.tests import fake_registry
+
+
+class WriterTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.output = os.path.join(self.directory, 'output')
+    # Stands in for the host's filesystem, e.g. /etc.
+    self.host = os.path.join(self.directory, 'host')
+    os.mkdir(self.host)
+    with open(os.path.join(self.host, 'shadow'), 'wb') as f:
+      f.write(b'secret')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _write(self, entries):
+    buf = io.BytesIO(fake_registry.Tarball(entries))
+    with tarfile.open(fileobj=buf, mode='r:') as tar:
+      with filesystem.Writer(self.output) as writer:
+        for tarinfo in tar:
+          writer.add(tarinfo, tar.extractfile(tarinfo)
+                     if tarinfo.isfile() else None)
+
+  def _read(self, name):
+    with open(os.path.join(self.output, name), 'rb') as f:
+      return f.read()
+
+  def test_links(self):
+    self._write([('etc/os-release', b'debian'),
+                 fake_registry.Link('etc/hard', 'etc/os-release',
+                                    hardlink=True),
+                 fake_registry.Link('etc/soft', 'os-release'),
+                 fake_registry.Link('etc/absolute', '/etc/os-release')])
+    self.assertEqual(b'debian', self._read('etc/hard'))
+    self.assertEqual(b'debian', self._read('etc/soft'))
+    self.assertEqual(
+        os.stat(os.path.join(self.output, 'etc/os-release')).st_ino,
+        os.stat(os.path.join(self.output, 'etc/hard')).st_ino)
+    # Symlinks are kept as they are, to be resolved within the image's root.
+    self.assertEqual('/etc/os-release',
+                     os.readlink(os.path.join(self.output, 'etc/absolute')))
+
+  def test_skips_parent_directory(self):
+    self._write([('../escaped', b'evil'), ('ok', b'ok')])
+    self.assertEqual(b'ok', self._read('ok'))
+    self.assertFalse(os.path.exists(os.path.join(self.directory, 'escaped')))
+
+  def test_skips_hardlink_through_symlink(self):
+    self._write([fake_registry.Link('lnk', self.host),
+                 fake_registry.Link('stolen', 'lnk/shadow', hardlink=True)])
+    self.assertTrue(os.path.islink(os.path.join(self.output, 'lnk')))
+    self.assertFalse(os.path.lexists(os.path.join(self.output, 'stolen')))
+
+  def test_skips_hardlink_into_symlinked_directory(self):
+    self._write([('payload', b'evil'),
+                 fake_registry.Link('lnk', self.host),
+                 fake_registry.Link('lnk/planted', 'payload', hardlink=True)])
+    self.assertFalse(os.path.lexists(os.path.join(self.host, 'planted')))
+
+  def test_skips_file_through_symlink(self):
+    self._write([fake_registry.Link('lnk', self.host),
+                 ('lnk/shadow', b'evil'),
+                 ('lnk/planted', b'evil')])
+    with open(os.path.join(self.host, 'shadow'), 'rb') as f:
+      self.assertEqual(b'secret', f.read())
+    self.assertFalse(os.path.lexists(os.path.join(self.host, 'planted')))
+
+  def test_skips_file_through_existing_symlink(self):
+    os.mkdir(self.output)
+    os.symlink(self.host, os.path.join(self.output, 'lnk'))
+    self._write([('lnk/planted', b'evil')])
+    self.assertFalse(os.path.lexists(os.path.join(self.host, 'planted')))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,149 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.flatten_cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client.v2_2 import docker_image
+from containerregistry.client.v2_2 import flatten_cache
+from containerregistry.tests import fake_registry
+
+_LOWER = 'sha256:' + 'a' * 64
+_UPPER = 'sha256:' + 'b' * 64
+_OTHER = 'sha256:' + 'c' * 64
+
+
+def _Writer(entries):
+  """A callable writing entries, (name, content) pairs, into a tarfile."""
+
+  def write(tar):
+    for (name, content) in entries:
+      tarinfo = tarfile.TarInfo(name)
+      tarinfo.size = len(content)
+      tar.addfile(tarinfo, fileobj=io.BytesIO(content))
+
+  return write
+
+
+def _Read(reader):
+  with reader:
+    with tarfile.open(fileobj=reader, mode='r|') as tar:
+      return {member.name: tar.extractfile(member).read() for member in tar}
+
+
+class FlattenCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_put(self):
+    cache = flatten_cache.FlattenCache(
+        os.path.join(self.directory, 'cache'), 1024 * 1024)
+    self.assertIsNone(cache.open(_LOWER))
+    self.assertEqual({'etc/hosts': b'hosts'},
+                     _Read(cache.put(_LOWER, _Writer([('etc/hosts',
+                                                       b'hosts')]))))
+    self.assertEqual({'etc/hosts': b'hosts'}, _Read(cache.open(_LOWER)))
+
+  def _age(self, chain_id):
+    old = time.time() - 60
+    os.utime(os.path.join(self.directory, chain_id[7:] + '.tar'), (old, old))
+
+  def test_evicts_least_recently_used(self):
+    # Each entry is a tarball of 10KiB, so the cache holds two.
+    cache = flatten_cache.FlattenCache(self.directory, 25 * 1024)
+    _Read(cache.put(_LOWER, _Writer([('lower', b'lower')])))
+    _Read(cache.put(_UPPER, _Writer([('upper', b'upper')])))
+    self._age(_LOWER)
+    self._age(_UPPER)
+
+    # Opening an entry makes it the most recently used.
+    reader = cache.open(_LOWER)
+    _Read(cache.put(_OTHER, _Writer([('other', b'other')])))
+    self.assertIsNone(cache.open(_UPPER))
+    self.assertEqual({'lower': b'lower'}, _Read(cache.open(_LOWER)))
+
+    # An entry that is open remains readable once evicted.
+    self._age(_LOWER)
+    _Read(cache.put(_UPPER, _Writer([('upper', b'upper')])))
+    self.assertIsNone(cache.open(_LOWER))
+    self.assertEqual({'lower': b'lower'}, _Read(reader))
+
+
+class ExtractTest(unittest.TestCase):
+  """docker_image.extract() through a FlattenCache."""
+
+  def setUp(self):
+    self.registry = fake_registry.Registry()
+    manifest, unused_digest = self.registry.put_image(
+        'foo/bar', 'latest', [
+            fake_registry.Tarball([('etc/hosts', b'hosts'),
+                                   ('etc/os-release', b'lower')]),
+            fake_registry.Tarball([('etc/os-release', b'middle')]),
+            fake_registry.Tarball([('etc/.wh.hosts', b''),
+                                   ('etc/motd', b'upper')]),
+        ])
+    self.layers = [
+        layer['digest']
+        for layer in json.loads(manifest.decode('utf8'))['layers']
+    ]
+    self.directory = tempfile.mkdtemp()
+    self.cache = flatten_cache.FlattenCache(self.directory, 1024 * 1024)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _extract(self):
+    buf = io.BytesIO()
+    with docker_image.FromRegistry(
+        docker_name.Tag('{host}/foo/bar:latest'.format(
+            host=self.registry.host)), docker_creds.Anonymous(),
+        self.registry) as image:
+      with tarfile.open(fileobj=buf, mode='w:') as tar:
+        docker_image.extract(image, tar, cache=self.cache)
+    buf.seek(0)
+    return _Read(buf)
+
+  def _fetched(self, digest):
+    return self.registry.count('GET', '/blobs/' + digest)
+
+  def test_extract(self):
+    expected = {'etc/os-release': b'middle', 'etc/motd': b'upper'}
+    self.assertEqual(expected, self._extract())
+    self.assertEqual([1, 1, 1], [self._fetched(d) for d in self.layers])
+
+    # All but the topmost layer were cached, so only it is fetched again.
+    self.assertEqual(expected, self._extract())
+    self.assertEqual([1, 1, 2], [self._fetched(d) for d in self.layers])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,97 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.known_blobs."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from containerregistry.client import docker_name
+from containerregistry.client import known_blobs
+
+_DIGEST = 'sha256:' + 'a' * 64
+
+
+def _Age(directory, seconds):
+  """Makes every entry under directory seconds older."""
+  for (root, unused_dirs, files) in os.walk(directory):
+    for name in files:
+      path = os.path.join(root, name)
+      mtime = os.stat(path).st_mtime - seconds
+      os.utime(path, (mtime, mtime))
+
+
+class KnownBlobsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.known = known_blobs.KnownBlobs(
+        os.path.join(self.directory, 'known_blobs'), ttl=60)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_add(self):
+    name = docker_name.Tag('gcr.io/foo/bar:latest')
+    self.assertFalse(self.known.contains(name, _DIGEST))
+    self.known.add(name, _DIGEST)
+    self.assertTrue(self.known.contains(name, _DIGEST))
+    # Entries are per repository, whatever the tag.
+    self.assertTrue(
+        self.known.contains(docker_name.Repository('gcr.io/foo/bar'), _DIGEST))
+    self.assertFalse(
+        self.known.contains(docker_name.Repository('gcr.io/foo/baz'), _DIGEST))
+    self.assertFalse(
+        self.known.contains(docker_name.Repository('quay.io/foo/bar'),
+                            _DIGEST))
+    self.assertFalse(self.known.contains(name, 'sha256:' + 'b' * 64))
+
+  def test_repositories(self):
+    self.known.add(docker_name.Repository('gcr.io/foo/old'), _DIGEST)
+    _Age(self.directory, 10)
+    self.known.add(docker_name.Repository('gcr.io/foo/new'), _DIGEST)
+    self.known.add(docker_name.Repository('quay.io/foo/other'), _DIGEST)
+    # Most recently confirmed first.
+    self.assertEqual(['gcr.io/foo/new', 'gcr.io/foo/old'],
+                     [str(repo) for repo in self.known.repositories(
+                         'gcr.io', _DIGEST)])
+    self.assertEqual([],
+                     self.known.repositories('gcr.io', 'sha256:' + 'b' * 64))
+
+  def test_ttl(self):
+    name = docker_name.Repository('gcr.io/foo/bar')
+    self.known.add(name, _DIGEST)
+    _Age(self.directory, 120)
+    self.assertFalse(self.known.contains(name, _DIGEST))
+    self.assertEqual([], self.known.repositories('gcr.io', _DIGEST))
+
+    # Confirming the blob again refreshes the entry.
+    self.known.add(name, _DIGEST)
+    self.assertTrue(self.known.contains(name, _DIGEST))
+
+  def test_shared(self):
+    name = docker_name.Repository('gcr.io/foo/bar')
+    self.known.add(name, _DIGEST)
+    other = known_blobs.KnownBlobs(os.path.join(self.directory, 'known_blobs'))
+    self.assertTrue(other.contains(name, _DIGEST))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,82 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.layer_index."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import io
+import unittest
+
+from containerregistry.client.v2_2 import layer_index
+from containerregistry.tests import fake_registry
+
+
+def _Index(entries):
+  layer = fake_registry.Tarball(entries)
+  return fake_registry.Digest(layer), layer_index.Build(io.BytesIO(layer))
+
+
+class LayerIndexTest(unittest.TestCase):
+
+  def test_build(self):
+    layer = fake_registry.Tarball([('etc/os-release', b'debian'),
+                                   fake_registry.Link('etc/issue',
+                                                      'os-release')])
+    entries = layer_index.Build(io.BytesIO(layer))
+    self.assertEqual(['etc/os-release', 'etc/issue'],
+                     [entry.path for entry in entries])
+    release = entries[0]
+    self.assertEqual((6, fake_registry.Digest(b'debian')),
+                     (release.size, release.sha256))
+    # The offset locates the payload within the uncompressed layer.
+    self.assertEqual(b'debian',
+                     layer[release.offset:release.offset + release.size])
+    self.assertIsNone(entries[1].sha256)
+
+  def test_write(self):
+    diff_id, entries = _Index([('etc/os-release', b'debian')])
+    buf = io.BytesIO()
+    layer_index.Write(diff_id, entries, buf)
+    buf.seek(0)
+    self.assertEqual((diff_id, entries), layer_index.Read(buf))
+
+  def test_flatten(self):
+    # Topmost layer first.
+    indices = [
+        _Index([('etc/.wh.hosts', b''), ('etc/os-release', b'upper')]),
+        _Index([('etc/hosts', b'hosts'), ('etc/os-release', b'lower'),
+                ('usr/bin/python', b'python' * 10)]),
+    ]
+    upper, lower = [diff_id for (diff_id, unused_entries) in indices]
+    self.assertEqual(
+        [(upper, 'etc/os-release'), (lower, 'usr/bin/python')],
+        [(diff_id, entry.path)
+         for (diff_id, entry) in layer_index.Flatten(indices)])
+
+    diff_id, entry = layer_index.Find(indices, '/etc/os-release')
+    self.assertEqual((upper, fake_registry.Digest(b'upper')),
+                     (diff_id, entry.sha256))
+    self.assertIsNone(layer_index.Find(indices, '/etc/hosts'))
+
+    self.assertEqual(
+        ['usr/bin/python'],
+        [entry.path for (unused_diff_id, entry) in layer_index.Largest(
+            indices, 1)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.mirror."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import shutil
+import tempfile
+import unittest
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client.v2_2 import mirror
+from containerregistry.tests import fake_registry
+
+
+class _Keychain(object):
+
+  def Resolve(self, unused_name):
+    return docker_creds.Anonymous()
+
+
+class MirrorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.source = fake_registry.Registry()
+    self.mirror = fake_registry.Registry()
+    self.transport = fake_registry.Hosts(self.source, self.mirror)
+    self.digests = {}
+    for tag in ('v1', 'v2'):
+      unused_manifest, self.digests[tag] = self.source.put_image(
+          'src/app', tag, [fake_registry.Tarball([('tag', tag.encode())])])
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _repository(self, registry, repository):
+    return docker_name.Repository('{host}/{repository}'.format(
+        host=registry.host, repository=repository))
+
+  def _sync(self, dst_registry = None):
+    dst = self._repository(dst_registry or self.mirror, 'dst/app')
+    session = mirror.Mirror(_Keychain(), self.transport,
+                            mirror.State(self.directory), threads=4)
+    report = session.sync([(self._repository(self.source, 'src/app'), dst)])
+    self.assertEqual([dst], list(report))
+    return report[dst]
+
+  def _mirrored(self, registry = None):
+    manifests = (registry or self.mirror).manifests['dst/app']
+    return {
+        tag: fake_registry.Digest(manifests[tag][0]) for tag in self.digests
+    }
+
+  def test_sync(self):
+    result = self._sync()
+    self.assertEqual((['v1', 'v2'], 0, {}),
+                     (result.copied, result.unchanged, result.failed))
+    self.assertLess(0, result.bytes_uploaded)
+    self.assertEqual(self.digests, self._mirrored())
+
+    # Syncing again finds nothing to copy.
+    result = self._sync()
+    self.assertEqual(([], 2, {}, 0), tuple(result))
+    self.assertEqual(2, self.mirror.count('PUT', '/manifests/v'))
+
+  def test_moved_tag(self):
+    self._sync()
+    unused_manifest, self.digests['v1'] = self.source.put_image(
+        'src/app', 'v1', [fake_registry.Tarball([('tag', b'v1.1')])])
+    result = self._sync()
+    self.assertEqual((['v1'], 1, {}),
+                     (result.copied, result.unchanged, result.failed))
+    self.assertEqual(self.digests, self._mirrored())
+
+  def test_failure(self):
+
+    def fault(method, path, unused_query, unused_headers):
+      if method == 'PUT' and path.endswith('/manifests/v2'):
+        return fake_registry.Error(500, 'UNKNOWN')
+
+    self.mirror.faults.append(fault)
+    result = self._sync()
+    self.assertEqual((['v1'], 0, ['v2']),
+                     (result.copied, result.unchanged, list(result.failed)))
+
+    # The next sync resumes with the tag that failed.
+    self.mirror.faults.remove(fault)
+    result = self._sync()
+    self.assertEqual((['v2'], 1, {}),
+                     (result.copied, result.unchanged, result.failed))
+    self.assertEqual(self.digests, self._mirrored())
+
+  def test_same_registry(self):
+    result = self._sync(self.source)
+    self.assertEqual((['v1', 'v2'], 0, {}),
+                     (result.copied, result.unchanged, result.failed))
+    self.assertEqual(self.digests, self._mirrored(self.source))
+    # The blobs were mounted, so only the manifests were uploaded.
+    self.assertEqual(
+        sum(len(self.source.manifests['dst/app'][tag][0])
+            for tag in self.digests), result.bytes_uploaded)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,94 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.negotiate."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import json
+import unittest
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client.v2 import docker_image as v2_image
+from containerregistry.client.v2_2 import docker_http
+from containerregistry.client.v2_2 import docker_image as v2_2_image
+from containerregistry.client.v2_2 import docker_image_list as image_list
+from containerregistry.client.v2_2 import negotiate
+from containerregistry.tests import fake_registry
+
+
+class NegotiateTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = fake_registry.Registry()
+    layer = fake_registry.Tarball([('etc/os-release', b'debian')])
+    self.image, self.digest = self.registry.put_image('foo/bar', 'image',
+                                                      [layer])
+    self.list, unused_digest = self.registry.put_list(
+        'foo/bar', 'list', [(self.image, {
+            'os': 'linux',
+            'architecture': 'amd64'
+        })])
+    self.schema1 = json.dumps({
+        'schemaVersion': 1,
+        'name': 'foo/bar',
+        'tag': 'schema1',
+        'fsLayers': [],
+        'history': [],
+    }).encode('utf8')
+    self.registry.put_manifest('foo/bar', 'schema1', self.schema1,
+                               docker_http.MANIFEST_SCHEMA1_MIME)
+
+  def _open(self, reference):
+    return negotiate.FromRegistry(
+        docker_name.from_string('{host}/foo/bar{reference}'.format(
+            host=self.registry.host, reference=reference)),
+        docker_creds.Anonymous(), self.registry)
+
+  def _manifest(self, reference, kind):
+    with self._open(reference) as image:
+      self.assertIsInstance(image, kind)
+      manifest = image.manifest()
+    # The manifest was fetched once, and served from that since.
+    self.assertEqual(1, self.registry.count('GET', '/manifests/'))
+    return manifest
+
+  def test_image(self):
+    self.assertEqual(self.image.decode('utf8'),
+                     self._manifest(':image', v2_2_image.FromRegistry))
+
+  def test_image_by_digest(self):
+    self.assertEqual(self.image.decode('utf8'),
+                     self._manifest('@' + self.digest, v2_2_image.FromRegistry))
+
+  def test_list(self):
+    self.assertEqual(self.list.decode('utf8'),
+                     self._manifest(':list', image_list.FromRegistry))
+
+  def test_schema1(self):
+    self.assertEqual(self.schema1.decode('utf8'),
+                     self._manifest(':schema1', v2_image.FromRegistry))
+
+  def test_unknown_media_type(self):
+    self.registry.put_manifest('foo/bar', 'other', b'{"mediaType": "other"}',
+                               'application/vnd.example+json')
+    with self.assertRaises(image_list.InvalidMediaTypeError):
+      self._open(':other')
+
+
+if __name__ == '__main__':
+  unittest.main()
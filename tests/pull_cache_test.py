@@ -0,0 +1,106 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.pull_cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from containerregistry.client.v2_2 import pull_cache
+
+
+class PullCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache_directory = os.path.join(self.directory, 'cache')
+    self.cache = pull_cache.PullCache(self.cache_directory)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _entry(self, name, size, atime):
+    path = os.path.join(self.cache_directory, name)
+    with open(path, 'wb') as f:
+      f.write(b'x' * size)
+    os.utime(path, (atime, atime))
+    return path
+
+  def _image(self, name, entry):
+    """An image directory, linking to entry."""
+    directory = os.path.join(self.directory, name)
+    os.mkdir(directory)
+    os.symlink(entry, os.path.join(directory, '001.tar.gz'))
+    with self.cache.lock(shared=True):
+      self.cache.register(directory)
+    return directory
+
+  def _gc(self, **kwargs):
+    with self.cache.lock(shared=False):
+      return self.cache.gc(**kwargs)
+
+  def test_evicts_least_recently_used(self):
+    old = self._entry('sha256:old', 10, 1000)
+    new = self._entry('sha256:new', 10, 2000)
+    result = self._gc()
+    self.assertEqual((2, 20, 0, 0, 0), tuple(result))
+    self.assertFalse(os.path.exists(old) or os.path.exists(new))
+
+    self.cache = pull_cache.PullCache(self.cache_directory, max_bytes=10)
+    old = self._entry('sha256:old', 10, 1000)
+    new = self._entry('sha256:new', 10, 2000)
+    self._gc()
+    self.assertFalse(os.path.exists(old))
+    self.assertTrue(os.path.exists(new))
+
+  def test_keeps_live_entries(self):
+    live = self._entry('sha256:live', 10, 1000)
+    image = self._image('image', live)
+    self.assertEqual(1, self._gc().roots)
+    self.assertTrue(os.path.exists(live))
+    # Passing a registered directory again doesn't count it twice.
+    self.assertEqual(1, self._gc(directories=[image]).roots)
+
+    # Once the image directory is deleted, its root is forgotten.
+    shutil.rmtree(image)
+    result = self._gc()
+    self.assertEqual((1, 0), (result.evicted, result.roots))
+    self.assertFalse(os.path.exists(live))
+
+  def test_removes_abandoned_root(self):
+    roots = os.path.join(self.cache_directory, 'roots')
+    live = self._entry('sha256:live', 10, 1000)
+    self._image('image', live)
+    # A pull that died registering its directory.
+    with open(os.path.join(roots, 'tmpabandoned'), 'wb') as f:
+      f.write(b'/partial')
+    self.assertEqual(1, self._gc().roots)
+    self.assertEqual(1, len(os.listdir(roots)))
+    self.assertTrue(os.path.exists(live))
+
+  def test_locked(self):
+    with self.cache.lock(shared=True):
+      with self.assertRaises(pull_cache.LockedError):
+        with self.cache.lock(shared=False, blocking=False):
+          pass
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.registry_capabilities."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from containerregistry.client import registry_capabilities
+
+
+class CapabilitiesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.capabilities = registry_capabilities.Capabilities(
+        os.path.join(self.directory, 'capabilities'), ttl=60)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _path(self, registry):
+    return os.path.join(self.directory, 'capabilities', registry + '.json')
+
+  def test_set(self):
+    self.assertEqual({}, self.capabilities.get('gcr.io'))
+    self.capabilities.set('gcr.io', registry_capabilities.MONOLITHIC, False)
+    self.capabilities.set('gcr.io', registry_capabilities.CHUNK_MIN_LENGTH,
+                          1024)
+    self.assertEqual(
+        {
+            registry_capabilities.MONOLITHIC: False,
+            registry_capabilities.CHUNK_MIN_LENGTH: 1024
+        }, self.capabilities.get('gcr.io'))
+    # Each registry has a record of its own.
+    self.assertEqual({}, self.capabilities.get('quay.io'))
+
+  def test_shared(self):
+    self.capabilities.set('gcr.io', registry_capabilities.PUT, True)
+    other = registry_capabilities.Capabilities(
+        os.path.join(self.directory, 'capabilities'))
+    self.assertEqual({registry_capabilities.PUT: True}, other.get('gcr.io'))
+
+  def test_ttl(self):
+    self.capabilities.set('gcr.io', registry_capabilities.MOUNT, False)
+    mtime = time.time() - 120
+    os.utime(self._path('gcr.io'), (mtime, mtime))
+    self.assertEqual({}, self.capabilities.get('gcr.io'))
+
+    # Learning something afresh starts a new record.
+    self.capabilities.set('gcr.io', registry_capabilities.RANGE, True)
+    self.assertEqual({registry_capabilities.RANGE: True},
+                     self.capabilities.get('gcr.io'))
+
+  def test_unreadable_record(self):
+    self.capabilities.set('gcr.io', registry_capabilities.MOUNT, False)
+    with open(self._path('gcr.io'), 'wb') as f:
+      f.write(b'{"mount": fal')
+    self.assertEqual({}, self.capabilities.get('gcr.io'))
+
+
+if __name__ == '__main__':
+  unittest.main()
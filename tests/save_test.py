@@ -0,0 +1,211 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v2_2.save."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client.v2_2 import docker_image
+from containerregistry.client.v2_2 import docker_image_list
+from containerregistry.client.v2_2 import layer_index
+from containerregistry.client.v2_2 import save
+from containerregistry.tests import fake_registry
+
+
+class FastTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = fake_registry.Registry()
+    self.layer = fake_registry.Tarball([('etc/os-release', b'debian')])
+    self.manifest, unused_digest = self.registry.put_image(
+        'foo/bar', 'latest', [self.layer])
+    self.blob = json.loads(
+        self.manifest.decode('utf8'))['layers'][0]['digest']
+    self.directory = tempfile.mkdtemp()
+    self.cache = os.path.join(self.directory, 'cache')
+    os.mkdir(self.cache)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _fast(self, name, cached = True, **kwargs):
+    directory = os.path.join(self.directory, name)
+    os.mkdir(directory)
+    with docker_image.FromRegistry(
+        docker_name.Tag('{host}/foo/bar:latest'.format(
+            host=self.registry.host)), docker_creds.Anonymous(),
+        self.registry) as image:
+      save.fast(image, directory,
+                cache_directory=self.cache if cached else None, **kwargs)
+    return directory
+
+  def _index(self, directory):
+    with open(os.path.join(directory, '000' + layer_index.SUFFIX), 'rb') as f:
+      unused_diff_id, entries = layer_index.Read(f)
+    return [entry.path for entry in entries]
+
+  def _layer(self, directory):
+    with open(os.path.join(directory, '000.tar.gz'), 'rb') as f:
+      return f.read()
+
+  def _builds(self):
+    """Records the layers indexed, by layer_index.Build."""
+    builds = []
+    build = layer_index.Build
+
+    def recording(fileobj):
+      builds.append(fileobj)
+      return build(fileobj)
+
+    layer_index.Build = recording
+    self.addCleanup(setattr, layer_index, 'Build', build)
+    return builds
+
+  def test_cached(self):
+    builds = self._builds()
+    first = self._fast('first', index=True)
+    self.assertEqual(fake_registry.Gzip(self.layer), self._layer(first))
+    self.assertTrue(
+        os.path.exists(os.path.join(self.cache, self.blob[7:] +
+                                    save.VERIFIED_SUFFIX)))
+    self.assertEqual(['etc/os-release'], self._index(first))
+    self.assertEqual(1, len(builds))
+
+    fetched = self.registry.count('GET', '/blobs/' + self.blob)
+    second = self._fast('second', index=True)
+    self.assertEqual(fake_registry.Gzip(self.layer), self._layer(second))
+    self.assertEqual(fetched, self.registry.count('GET', '/blobs/' + self.blob))
+    self.assertEqual(['etc/os-release'], self._index(second))
+    # The cached index is linked, rather than the layer indexed again.
+    self.assertEqual(1, len(builds))
+
+  def test_index_cached_layer(self):
+    self._fast('first')
+    fetched = self.registry.count('GET', '/blobs/' + self.blob)
+    builds = self._builds()
+    # The layer was cached without an index, so is indexed from the cache.
+    second = self._fast('second', index=True)
+    self.assertEqual(fetched, self.registry.count('GET', '/blobs/' + self.blob))
+    self.assertEqual(['etc/os-release'], self._index(second))
+    self.assertEqual(1, len(builds))
+
+  def test_index(self):
+    builds = self._builds()
+    directory = self._fast('first', cached=False, index=True)
+    self.assertEqual(fake_registry.Gzip(self.layer), self._layer(directory))
+    self.assertEqual(['etc/os-release'], self._index(directory))
+    self.assertEqual(1, len(builds))
+
+  def test_rejects_tampered_indexed_layer(self):
+    self.registry.blobs['foo/bar'][self.blob] = fake_registry.Gzip(b'evil')
+    with self.assertRaises(docker_image.DigestMismatchedError):
+      self._fast('first', index=True)
+    self.assertEqual(['.lock', 'roots'], sorted(os.listdir(self.cache)))
+
+  def test_reverify(self):
+    self._fast('first')
+    fetched = self.registry.count('GET', '/blobs/' + self.blob)
+    # Corrupt the cached layer, keeping the metadata its sidecar records.
+    cached = os.path.join(self.cache, self.blob[7:])
+    info = os.stat(cached)
+    with open(cached, 'r+b') as f:
+      f.write(b'\0')
+    os.utime(cached, (info.st_atime, info.st_mtime))
+
+    second = self._fast('second', reverify=1.0)
+    self.assertEqual(fake_registry.Gzip(self.layer), self._layer(second))
+    self.assertLess(fetched, self.registry.count('GET', '/blobs/' + self.blob))
+
+  def test_rejects_tampered_layer(self):
+    self.registry.blobs['foo/bar'][self.blob] = fake_registry.Gzip(b'evil')
+    with self.assertRaises(docker_image.DigestMismatchedError):
+      self._fast('first')
+    # Nothing is cached: neither the layer, nor what it was written to.
+    self.assertEqual(['.lock', 'roots'], sorted(os.listdir(self.cache)))
+
+
+class FastAllTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = fake_registry.Registry()
+    shared = fake_registry.Tarball([('etc/os-release', b'debian')])
+    children = []
+    for arch in ('amd64', 'arm64'):
+      platform = {'os': 'linux', 'architecture': arch}
+      manifest, unused_digest = self.registry.put_image(
+          'foo/bar', None,
+          [shared, fake_registry.Tarball([('arch', arch.encode('utf8'))])],
+          platform=platform)
+      children.append((manifest, platform))
+    # An attestation, whose layer is an in-toto statement.
+    manifest, unused_digest = self.registry.put_image(
+        'foo/bar', None, [b'{"_type": "https://in-toto.io/Statement/v0.1"}'],
+        layer_media_type='application/vnd.in-toto+json')
+    children.append((manifest, {'os': 'unknown', 'architecture': 'unknown'}))
+    self.registry.put_list('foo/bar', 'latest', children)
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _fast_all(self, **kwargs):
+    with docker_image_list.FromRegistry(
+        docker_name.Tag('{host}/foo/bar:latest'.format(
+            host=self.registry.host)), docker_creds.Anonymous(),
+        self.registry) as image_list:
+      children = image_list.resolve_all_platforms()
+      entered = []
+      try:
+        for (unused_platform, child) in children:
+          child.__enter__()
+          entered.append(child)
+        return save.fast_all(children, self.directory, **kwargs)
+      finally:
+        for child in entered:
+          child.__exit__(None, None, None)
+
+  def test_index(self):
+    cache = os.path.join(self.directory, 'cache')
+    os.mkdir(cache)
+    results = self._fast_all(index=True, cache_directory=cache)
+    self.assertEqual(3, len(results))
+    indices = {}
+    for subdirectory in results:
+      indices[os.path.basename(subdirectory)] = sorted(
+          name for name in os.listdir(subdirectory)
+          if name.endswith(layer_index.SUFFIX))
+    self.assertEqual(['000.index', '001.index'], indices.pop('linux_amd64'))
+    self.assertEqual(['000.index', '001.index'], indices.pop('linux_arm64'))
+    # Only the attestation is left, which isn't indexed.
+    self.assertEqual([[]], list(indices.values()))
+
+  def test_shared_layers(self):
+    self._fast_all(threads=4)
+    amd64 = os.stat(os.path.join(self.directory, 'linux_amd64', '000.tar.gz'))
+    arm64 = os.stat(os.path.join(self.directory, 'linux_arm64', '000.tar.gz'))
+    self.assertEqual(amd64.st_ino, arm64.st_ino)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,178 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.stream."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import io
+import os
+import struct
+import tarfile
+import unittest
+import zlib
+
+from containerregistry.client import stream
+from containerregistry.client.v2_2 import estargz
+from containerregistry.client.v2_2 import layer_index
+from containerregistry.tests import fake_registry
+
+try:
+  import zstandard  # pylint: disable=g-import-not-at-top
+except ImportError:
+  zstandard = None
+
+
+class _Mismatch(Exception):
+  pass
+
+
+def _Layer():
+  """A gzipped layer, whose stream runs on well past its tarball."""
+  return fake_registry.Gzip(
+      fake_registry.Tarball([('etc/os-release', b'debian')]) +
+      os.urandom(4 * stream.CHUNK_SIZE))
+
+
+def _Truncated():
+  # Drop the gzip trailer, holding the CRC32 and size.
+  return _Layer()[:-8]
+
+
+def _Corrupted():
+  layer = _Layer()
+  crc = struct.unpack('<I', layer[-8:-4])[0]
+  return layer[:-8] + struct.pack('<I', crc ^ 1) + layer[-4:]
+
+
+class StreamTest(unittest.TestCase):
+
+  def test_gunzip(self):
+    content = os.urandom(3 * stream.CHUNK_SIZE)
+    with stream.Decompress(io.BytesIO(fake_registry.Gzip(content))) as f:
+      self.assertEqual(content, f.read())
+
+  def test_gunzip_rejects_truncated_stream(self):
+    with stream.Decompress(io.BytesIO(_Truncated())) as f:
+      with self.assertRaises(EOFError):
+        stream.Drain(f)
+
+  def test_gunzip_rejects_bad_crc(self):
+    with stream.Decompress(io.BytesIO(_Corrupted())) as f:
+      with self.assertRaises(zlib.error):
+        stream.Drain(f)
+
+  def test_verified(self):
+    content = os.urandom(3 * stream.CHUNK_SIZE)
+    with stream.Verified(
+        io.BytesIO(content), fake_registry.Digest(content), _Mismatch) as f:
+      self.assertEqual(content, f.read())
+
+  def test_verified_rejects_mismatch_past_tarball(self):
+    layer = fake_registry.Tarball([('etc/os-release', b'debian')])
+    layer += os.urandom(4 * stream.CHUNK_SIZE)
+    with stream.Verified(io.BytesIO(layer), 'sha256:' + '0' * 64,
+                         _Mismatch) as f:
+      with tarfile.open(mode='r|', fileobj=f) as tar:
+        self.assertEqual(['etc/os-release'], [t.name for t in tar])
+      with self.assertRaises(_Mismatch):
+        stream.Drain(f)
+
+
+@unittest.skipUnless(zstandard, 'zstd requires the zstandard module')
+class ZstdTest(unittest.TestCase):
+
+  def test_decompress(self):
+    content = os.urandom(3 * stream.CHUNK_SIZE)
+    compressed = stream.Zstd(content)
+    self.assertTrue(stream.IsZstd(compressed))
+    self.assertFalse(stream.IsGzipped(compressed))
+    # Frames are read across, as concatenated gzip members are.
+    with stream.Decompress(io.BytesIO(compressed + compressed)) as f:
+      self.assertEqual(content + content, f.read())
+
+  def test_decompress_uncompressed(self):
+    content = fake_registry.Tarball([('etc/os-release', b'debian')])
+    self.assertFalse(stream.IsZstd(content))
+    with stream.Decompress(io.BytesIO(content)) as f:
+      self.assertEqual(content, f.read())
+
+  def test_compress(self):
+    content = os.urandom(3 * stream.CHUNK_SIZE)
+    out = io.BytesIO()
+    digest, size = stream.Compress(
+        io.BytesIO(content), out, stream.ZSTD_LEVEL, zstd=True)
+    compressed = out.getvalue()
+    self.assertEqual((fake_registry.Digest(compressed), len(compressed)),
+                     (digest, size))
+    with stream.Unzstd(io.BytesIO(compressed)) as f:
+      self.assertEqual(content, f.read())
+
+
+class PipeTest(unittest.TestCase):
+
+  def _write(self, pipe, content):
+    for i in range(0, len(content), stream.CHUNK_SIZE):
+      pipe.write(content[i:i + stream.CHUNK_SIZE])
+
+  def test_pipe(self):
+    layer = _Layer()
+    with stream.Pipe(
+        lambda f: layer_index.Build(stream.Decompress(f))) as pipe:
+      self._write(pipe, layer)
+    self.assertEqual(['etc/os-release'], [e.path for e in pipe.result])
+
+  def test_pipe_raises_consumer_failure(self):
+    with self.assertRaises(EOFError):
+      with stream.Pipe(
+          lambda f: layer_index.Build(stream.Decompress(f))) as pipe:
+        self._write(pipe, _Truncated())
+
+  def test_pipe_drops_unread_chunks(self):
+    # The consumer stops reading, but doesn't hold up the writer.
+    with stream.Pipe(lambda f: f.read(1), depth=1) as pipe:
+      self._write(pipe, os.urandom(8 * stream.CHUNK_SIZE))
+    self.assertEqual(1, len(pipe.result))
+
+  def test_pipe_aborts_consumer(self):
+    with self.assertRaises(_Mismatch):
+      with stream.Pipe(stream.Drain) as pipe:
+        pipe.write(b'partial')
+        raise _Mismatch()
+
+
+class TrailerTest(unittest.TestCase):
+  """Readers of layers check the gzip trailer, past the tarball."""
+
+  def test_layer_index(self):
+    entries = layer_index.Build(stream.Decompress(io.BytesIO(_Layer())))
+    self.assertEqual(['etc/os-release'], [entry.path for entry in entries])
+
+  def test_layer_index_rejects_truncated_layer(self):
+    with self.assertRaises(EOFError):
+      layer_index.Build(stream.Decompress(io.BytesIO(_Truncated())))
+
+  def test_layer_index_rejects_bad_crc(self):
+    with self.assertRaises(zlib.error):
+      layer_index.Build(stream.Decompress(io.BytesIO(_Corrupted())))
+
+  def test_estargz_rejects_truncated_layer(self):
+    with self.assertRaises(EOFError):
+      estargz.Build(stream.Decompress(io.BytesIO(_Truncated())), io.BytesIO())
+
+
+if __name__ == '__main__':
+  unittest.main()
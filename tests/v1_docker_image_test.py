@@ -0,0 +1,110 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.v1.docker_image."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from containerregistry.client import stream
+from containerregistry.client.v1 import docker_image
+from containerregistry.tests import fake_registry
+
+
+class FromShardedTarballTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.layers = {
+        'base': fake_registry.Tarball([('etc/os-release', b'base')]),
+        'top': fake_registry.Tarball([('etc/os-release', b'top')]),
+    }
+    self.entries = {
+        'base': [
+            ('base/json', json.dumps({'id': 'base'}).encode('utf8')),
+            ('base/layer.tar', self.layers['base']),
+        ],
+        'top': [
+            ('top/json',
+             json.dumps({'id': 'top', 'parent': 'base'}).encode('utf8')),
+            ('top/layer.tar', self.layers['top']),
+            ('repositories',
+             json.dumps({'foo/bar': {'latest': 'top'}}).encode('utf8')),
+        ],
+    }
+    # Each layer is in a shard of its own.
+    self.shards = {}
+    for layer_id, entries in self.entries.items():
+      self.shards[layer_id] = self._write(layer_id + '.tar', entries)
+    # Spool layers into a directory of our own, to see what is left there.
+    self.spool = os.path.join(self.directory, 'spool')
+    os.mkdir(self.spool)
+    tempdir = tempfile.tempdir
+    tempfile.tempdir = self.spool
+    self.addCleanup(setattr, tempfile, 'tempdir', tempdir)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _write(self, name, entries):
+    filename = os.path.join(self.directory, name)
+    with open(filename, 'wb') as f:
+      f.write(fake_registry.Tarball(entries))
+    return filename
+
+  def _check(self, image):
+    with image:
+      self.assertEqual({'foo/bar': {'latest': 'top'}}, image.repositories())
+      self.assertEqual(['top', 'base'], image.ancestry('top'))
+      for layer_id in ('top', 'base'):
+        layer = image.layer(layer_id)
+        self.assertEqual(self.layers[layer_id],
+                         stream.Gunzip(io.BytesIO(layer)).read())
+        with image.uncompressed_layer_stream(layer_id) as f:
+          self.assertEqual(self.layers[layer_id], f.read())
+        # Each layer is gzipped once, then served from its temporary file.
+        self.assertEqual(layer, image.layer(layer_id))
+      self.assertEqual(2, len(os.listdir(self.spool)))
+    self.assertEqual([], os.listdir(self.spool))
+
+  def _sharded(self, threads):
+    return docker_image.FromShardedTarball(
+        lambda layer_id: self.shards[layer_id], 'top', threads=threads)
+
+  def test_from_sharded_tarball(self):
+    self._check(self._sharded(threads=1))
+
+  def test_from_sharded_tarball_threads(self):
+    self._check(self._sharded(threads=4))
+
+  def test_from_tarball(self):
+    # A single tarball holding every layer.
+    tarball = self._write('image.tar',
+                          self.entries['base'] + self.entries['top'])
+    for threads in (1, 4):
+      image = docker_image.FromTarball(tarball, threads=threads)
+      self.assertEqual('top', image.top())
+      self._check(image)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,145 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks whiteout.PathTrie against the flat dict it replaced.
+
+Flattening a layer records every path it holds, to tell which entries of
+lower layers are hidden.  This times that bookkeeping, and measures the
+memory it retains, for a synthetic layer of many files (laid out like a
+node_modules heavy image), added once and then again as a fully shadowed
+lower layer:
+
+  python -m containerregistry.tests.whiteout_benchmark --files=1000000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import argparse
+import os
+import time
+
+from containerregistry.client import whiteout
+
+try:
+  import tracemalloc  # pylint: disable=g-import-not-at-top
+except ImportError:
+  # e.g. Python 2, where only the time is measured.
+  tracemalloc = None
+
+
+class DictBookkeeping(object):
+  """The bookkeeping of extract() before PathTrie, as a baseline.
+
+  Every path seen is a key of a dict, whose value is whether it hides the
+  entries beneath it (a tombstone or non-directory), and each entry is
+  checked against the names of all of its ancestor directories.  Opaque
+  whiteouts are treated as tombstones of a file named '.wh..opq'.
+  """
+
+  def __init__(self):
+    self._fs = {}
+
+  def _in_whiteout_dir(self, name):
+    while name:
+      dirname = os.path.dirname(name)
+      if name == dirname:
+        break
+      if self._fs.get(dirname):
+        return True
+      name = dirname
+    return False
+
+  def add(self, name, isdir):
+    basename = os.path.basename(name)
+    dirname = os.path.dirname(name)
+    tombstone = basename.startswith(whiteout.WHITEOUT_PREFIX)
+    if tombstone:
+      basename = basename[len(whiteout.WHITEOUT_PREFIX):]
+    name = os.path.normpath(os.path.join('.', dirname, basename))
+    if name in self._fs or self._in_whiteout_dir(name):
+      return False
+    self._fs[name] = tombstone or not isdir
+    return not tombstone
+
+  def next_layer(self):
+    pass
+
+
+def _Names(files):
+  for i in range(files):
+    yield ('./usr/lib/node_modules/pkg%d/lib/sub%d/file%d.js' %
+           (i // 200, i // 20 % 10, i % 20))
+
+
+def _Record(bookkeeping, files):
+  fs = bookkeeping()
+  for name in _Names(files):
+    fs.add(name, False)
+  fs.next_layer()
+  for name in _Names(files):
+    fs.add(name, False)
+  return fs
+
+
+def Run(bookkeeping, files):
+  """Records two layers of files, returning the seconds and bytes taken.
+
+  The memory is measured in a second run, as tracing allocations slows the
+  first one down.
+
+  Args:
+    bookkeeping: the class to benchmark, e.g. whiteout.PathTrie.
+    files: the number of files in each layer.
+
+  Returns:
+    A tuple of the seconds taken, and the peak bytes allocated, i.e. by the
+    bookkeeping once complete (or None without tracemalloc).
+  """
+  start = time.time()
+  _Record(bookkeeping, files)
+  elapsed = time.time() - start
+  if not tracemalloc:
+    return elapsed, None
+  tracemalloc.start()
+  try:
+    _Record(bookkeeping, files)
+    unused_current, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return elapsed, peak
+
+
+_BOOKKEEPING = {'dict': DictBookkeeping, 'trie': whiteout.PathTrie}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      '--files', type=int, default=1000000,
+      help='The number of files in each of the two layers.')
+  parser.add_argument(
+      '--bookkeeping', choices=sorted(_BOOKKEEPING), action='append',
+      help='Which bookkeeping to benchmark; by default, both.')
+  args = parser.parse_args()
+
+  for name in args.bookkeeping or sorted(_BOOKKEEPING):
+    elapsed, peak = Run(_BOOKKEEPING[name], args.files)
+    print('%s: %.1fs' % (name, elapsed) +
+          (', %.0f MiB at peak' % (peak / 2**20) if peak is not None else ''))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,87 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for containerregistry.client.whiteout."""
+
+from __future__ import absolute_import
+from __future__ import division
+
+from __future__ import print_function
+
+import random
+import unittest
+
+from containerregistry.client import whiteout
+from containerregistry.tests import whiteout_benchmark
+
+
+class PathTrieTest(unittest.TestCase):
+
+  def test_shadowed(self):
+    fs = whiteout.PathTrie()
+    self.assertTrue(fs.add('./etc', True))
+    self.assertTrue(fs.add('./etc/hosts', False))
+    fs.next_layer()
+    self.assertFalse(fs.add('./etc', True))
+    self.assertFalse(fs.add('etc/hosts', False))
+    self.assertTrue(fs.add('./etc/passwd', False))
+    self.assertTrue(fs.hides('etc/hosts'))
+    self.assertFalse(fs.hides('etc/shadow'))
+
+  def test_tombstone(self):
+    fs = whiteout.PathTrie()
+    self.assertFalse(fs.add('./usr/.wh.lib', False))
+    fs.next_layer()
+    self.assertFalse(fs.add('./usr/lib', True))
+    self.assertFalse(fs.add('./usr/lib/libc.so', False))
+    self.assertTrue(fs.add('./usr/libexec', True))
+
+  def test_non_directory_hides_children(self):
+    fs = whiteout.PathTrie()
+    self.assertTrue(fs.add('./bin', False))
+    fs.next_layer()
+    self.assertFalse(fs.add('./bin/sh', False))
+
+  def test_opaque(self):
+    fs = whiteout.PathTrie()
+    self.assertFalse(fs.add('./etc/.wh..wh..opq', False))
+    # The same layer's entries are kept.
+    self.assertTrue(fs.add('./etc/hosts', False))
+    self.assertTrue(fs.add('./etc', True))
+    fs.next_layer()
+    self.assertFalse(fs.add('./etc', True))
+    self.assertFalse(fs.add('./etc/passwd', False))
+    self.assertTrue(fs.add('./etcetera', False))
+
+  def test_matches_dict_bookkeeping(self):
+    # Apart from opaque whiteouts, PathTrie decides as extract() used to,
+    # including for odd names.
+    rand = random.Random(1)
+    components = ['a', 'b', 'c', '.wh.a', '.wh.b', 'd', '..', '.', '', '/']
+    for unused_trial in range(1000):
+      old = whiteout_benchmark.DictBookkeeping()
+      new = whiteout.PathTrie()
+      for unused_layer in range(4):
+        for unused_entry in range(rand.randint(0, 15)):
+          name = rand.choice(['/', './', '', '']) + '/'.join(
+              rand.choice(components) for _ in range(rand.randint(1, 4)))
+          if rand.random() < 0.2:
+            name += '/'
+          isdir = rand.random() < 0.5
+          self.assertEqual(old.add(name, isdir), new.add(name, isdir), name)
+        old.next_layer()
+        new.next_layer()
+
+
+if __name__ == '__main__':
+  unittest.main()
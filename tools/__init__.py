@@ -56,6 +56,18 @@ from containerregistry.tools import fast_pusher_
 setattr(x, 'fast_pusher', fast_pusher_)
 
 
+from containerregistry.tools import fast_copier_
+setattr(x, 'fast_copier', fast_copier_)
+
+
+from containerregistry.tools import fast_mirror_
+setattr(x, 'fast_mirror', fast_mirror_)
+
+
+from containerregistry.tools import fast_cache_gc_
+setattr(x, 'fast_cache_gc', fast_cache_gc_)
+
+
 from containerregistry.tools import image_digester_
 setattr(x, 'image_digester', image_digester_)
 
@@ -47,6 +47,11 @@ parser.add_argument(
     '--dst-image', action='store', help='The name of the new image.',
     required=True)
 
+parser.add_argument(
+    '--estargz',
+    action='store_true',
+    help='Append the tarball as a seekable (eStargz) layer.')
+
 _THREADS = 8
 
 
@@ -69,7 +74,7 @@ def main():
   logging.info('Pulling v2.2 image from %r ...', src)
   with v2_2_image.FromRegistry(src, creds, transport) as src_image:
     with open(args.tarball, 'rb') as f:
-      new_img = append.Layer(src_image, f.read())
+      new_img = append.Layer(src_image, f.read(), seekable=args.estargz)
 
   creds = docker_creds.DefaultKeychain.Resolve(dst)
   with docker_session.Push(dst, creds, transport, threads=_THREADS,
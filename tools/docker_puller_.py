@@ -23,9 +23,8 @@ import tarfile
 from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
 from containerregistry.client.v2 import docker_image as v2_image
-from containerregistry.client.v2_2 import docker_http
-from containerregistry.client.v2_2 import docker_image as v2_2_image
 from containerregistry.client.v2_2 import docker_image_list as image_list
+from containerregistry.client.v2_2 import negotiate
 from containerregistry.client.v2_2 import save
 from containerregistry.client.v2_2 import v2_compat
 from containerregistry.tools import logging_setup
@@ -89,15 +88,6 @@ def main():
   else:
     name = docker_name.Tag(args.name)
 
-  # OCI Image Manifest is compatible with Docker Image Manifest Version 2,
-  # Schema 2. We indicate support for both formats by passing both media types
-  # as 'Accept' headers.
-  #
-  # For reference:
-  #   OCI: https://github.com/opencontainers/image-spec
-  #   Docker: https://docs.docker.com/registry/spec/manifest-v2-2/
-  accept = docker_http.SUPPORTED_MANIFEST_MIMES
-
   # Resolve the appropriate credential to use based on the standard Docker
   # client logic.
   try:
@@ -109,27 +99,24 @@ def main():
 
   try:
     with tarfile.open(name=args.tarball, mode='w:') as tar:
-      logging.info('Pulling manifest list from %r ...', name)
-      with image_list.FromRegistry(name, creds, transport) as img_list:
-        if img_list.exists():
+      # A single request for the manifest tells us which kind of image it is.
+      logging.info('Pulling %r ...', name)
+      with negotiate.FromRegistry(name, creds, transport) as img:
+        if isinstance(img, image_list.DockerImageList):
           platform = platform_args.FromArgs(args)
           # pytype: disable=wrong-arg-types
-          with img_list.resolve(platform) as default_child:
+          with img.resolve(platform) as default_child:
             save.tarball(_make_tag_if_digest(name), default_child, tar)
             return
           # pytype: enable=wrong-arg-types
 
-      logging.info('Pulling v2.2 image from %r ...', name)
-      with v2_2_image.FromRegistry(name, creds, transport, accept) as v2_2_img:
-        if v2_2_img.exists():
-          save.tarball(_make_tag_if_digest(name), v2_2_img, tar)
-          return
-
-      logging.info('Pulling v2 image from %r ...', name)
-      with v2_image.FromRegistry(name, creds, transport) as v2_img:
-        with v2_compat.V22FromV2(v2_img) as v2_2_img:
-          save.tarball(_make_tag_if_digest(name), v2_2_img, tar)
-          return
+        if isinstance(img, v2_image.DockerImage):
+          with v2_compat.V22FromV2(img) as v2_2_img:
+            save.tarball(_make_tag_if_digest(name), v2_2_img, tar)
+            return
+
+        save.tarball(_make_tag_if_digest(name), img, tar)
+        return
   # pylint: disable=broad-except
   except Exception as e:
     logging.fatal('Error pulling and saving image %s: %s', name, e)
@@ -0,0 +1,88 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package garbage collects the layer cache of fast_puller."""
+
+from __future__ import absolute_import
+
+from __future__ import print_function
+
+import argparse
+import logging
+import sys
+
+from containerregistry.client.v2_2 import pull_cache
+from containerregistry.tools import logging_setup
+
+
+parser = argparse.ArgumentParser(
+    description='Garbage collect the --cache directory of fast_puller.')
+
+parser.add_argument(
+    '--cache',
+    action='store',
+    help='The cache directory to garbage collect.',
+    required=True)
+
+parser.add_argument(
+    '--cache-size',
+    action='store',
+    type=int,
+    default=0,
+    help=('The cap on the size of --cache, in bytes, beyond which the least '
+          'recently used entries are evicted.  By default, every entry that '
+          'no image directory links to is.'))
+
+parser.add_argument(
+    '--directory',
+    action='append',
+    default=[],
+    help=('An image directory whose entries to keep, besides those the '
+          'cache registered when they were pulled. May be repeated.'))
+
+parser.add_argument(
+    '--dry-run',
+    action='store_true',
+    help='Only report what would be reclaimed.')
+
+parser.add_argument(
+    '--no-wait',
+    action='store_true',
+    help='Exit, rather than wait, while pulls are using the cache.')
+
+
+def main():
+  logging_setup.DefineCommandLineArgs(parser)
+  args = parser.parse_args()
+  logging_setup.Init(args=args)
+
+  cache = pull_cache.PullCache(args.cache, args.cache_size)
+  try:
+    with cache.lock(shared=False, blocking=not args.no_wait):
+      result = cache.gc(directories=args.directory, dry_run=args.dry_run)
+  except pull_cache.LockedError as e:
+    logging.fatal('%s', e)
+    sys.exit(1)
+
+  print(('{verb} {size} bytes in {evicted} entries; {remaining} bytes remain, '
+         'of which {live} are linked from {roots} image directories.'.format(
+             verb='Would reclaim' if args.dry_run else 'Reclaimed',
+             size=result.reclaimed,
+             evicted=result.evicted,
+             remaining=result.remaining,
+             live=result.live,
+             roots=result.roots)))
+
+
+if __name__ == '__main__':
+  main()
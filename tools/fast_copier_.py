@@ -0,0 +1,138 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package copies images between Docker Registries, faaaaast.
+
+Blobs are streamed from one registry to the other without touching disk.
+"""
+
+from __future__ import absolute_import
+
+from __future__ import print_function
+
+import argparse
+import logging
+import sys
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client import known_blobs
+from containerregistry.client import registry_capabilities
+from containerregistry.client.v2_2 import docker_session
+from containerregistry.tools import logging_setup
+from containerregistry.tools import patched
+from containerregistry.transport import retry
+from containerregistry.transport import transport_pool
+
+import httplib2
+
+
+parser = argparse.ArgumentParser(
+    description='Copy images between Docker Registries, faaaaast.')
+
+parser.add_argument(
+    '--src-image',
+    action='store',
+    help=('The name of the docker image (or manifest list) to copy. '
+          'Supports fully-qualified tag or digest references.'),
+    required=True)
+
+parser.add_argument(
+    '--dst-image',
+    action='store',
+    help=('The name to copy it to. '
+          'Supports fully-qualified tag or digest references.'),
+    required=True)
+
+parser.add_argument(
+    '--client-config-dir',
+    action='store',
+    help='The path to the directory where the client configuration files are '
+    'located. Overiddes the value from DOCKER_CONFIG')
+
+parser.add_argument(
+    '--known-blobs-directory',
+    action='store',
+    help=('An optional directory recording the blobs known to exist in each '
+          'repository, which is shared across pushes to skip checking for '
+          'them.'))
+
+parser.add_argument(
+    '--registry-capabilities-directory',
+    action='store',
+    help=('An optional directory recording the upload strategies that '
+          'registries support, which is shared across pushes to skip '
+          'those a registry rejects.'))
+
+_THREADS = 8
+
+
+def _Name(name):
+  if '@' in name:
+    return docker_name.Digest(name)
+  return docker_name.Tag(name)
+
+
+def main():
+  logging_setup.DefineCommandLineArgs(parser)
+  args = parser.parse_args()
+  logging_setup.Init(args=args)
+
+  src = _Name(args.src_image)
+  dst = _Name(args.dst_image)
+
+  # If the user provided a client config directory, instruct the keychain
+  # resolver to use it to look for the docker client config
+  if args.client_config_dir is not None:
+    docker_creds.DefaultKeychain.setCustomConfigDir(args.client_config_dir)
+
+  retry_factory = retry.Factory()
+  retry_factory = retry_factory.WithSourceTransportCallable(httplib2.Http)
+  transport = transport_pool.Http(retry_factory.Build, size=_THREADS)
+
+  # Resolve the appropriate credential to use based on the standard Docker
+  # client logic.
+  try:
+    src_creds = docker_creds.DefaultKeychain.Resolve(src)
+    dst_creds = docker_creds.DefaultKeychain.Resolve(dst)
+  # pylint: disable=broad-except
+  except Exception as e:
+    logging.fatal('Error resolving credentials: %s', e)
+    sys.exit(1)
+
+  known = None
+  if args.known_blobs_directory:
+    known = known_blobs.KnownBlobs(args.known_blobs_directory)
+
+  capabilities = None
+  if args.registry_capabilities_directory:
+    capabilities = registry_capabilities.Capabilities(
+        args.registry_capabilities_directory)
+
+  try:
+    logging.info('Copying %s to %s ...', src, dst)
+    digest = docker_session.Copy(
+        src, src_creds, dst, dst_creds, transport, threads=_THREADS,
+        known_blobs=known,
+        registry_capabilities=capabilities)
+    print(('{name} was published with digest: {digest}'.format(
+        name=dst, digest=digest)))
+  # pylint: disable=broad-except
+  except Exception as e:
+    logging.fatal('Error copying %s to %s: %s', src, dst, e)
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  with patched.Httplib2():
+    main()
@@ -11,7 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""This package flattens image metadata into a single tarball."""
+"""This package flattens image metadata into a single tarball or directory."""
 
 from __future__ import absolute_import
 
@@ -21,7 +21,10 @@ import argparse
 import logging
 import tarfile
 
+from containerregistry.client import filesystem
+from containerregistry.client import stream
 from containerregistry.client.v2_2 import docker_image as v2_2_image
+from containerregistry.client.v2_2 import flatten_cache
 from containerregistry.tools import logging_setup
 from six.moves import zip  # pylint: disable=redefined-builtin
 
@@ -54,12 +57,76 @@ parser.add_argument(
 parser.add_argument(
     '--diff_id', action='append', help='The list of diff_ids in order.')
 
+parser.add_argument(
+    '--prefetch',
+    action='store',
+    type=int,
+    default=0,
+    help=('The number of layers to read and decompress ahead of the one '
+          'being written to the filesystem tarball.'))
+
+parser.add_argument(
+    '--memory_budget',
+    action='store',
+    type=int,
+    default=stream.PREFETCH_BUDGET,
+    help=('The cap on the bytes of layer data buffered by --prefetch, '
+          'across all of the layers read ahead.'))
+
 # Output arguments.
 parser.add_argument(
     '--filesystem',
     action='store',
     help='The name of where to write the filesystem tarball.')
 
+parser.add_argument(
+    '--directory',
+    action='store',
+    help=('The name of a directory in which to write the filesystem, '
+          'as an alternative (or in addition) to --filesystem.'))
+
+parser.add_argument(
+    '--threads',
+    action='store',
+    type=int,
+    default=8,
+    help='The number of threads with which to write files to --directory.')
+
+parser.add_argument(
+    '--content_store',
+    action='store',
+    help=('An optional directory of file contents shared across flattened '
+          'images, from which identical files are linked into --directory.'))
+
+parser.add_argument(
+    '--content_store_mode',
+    action='store',
+    choices=[filesystem.REFLINK, filesystem.HARDLINK],
+    default=filesystem.REFLINK,
+    help=('How files are linked from --content_store.  Hardlinked files '
+          'share their inode with every other copy.'))
+
+parser.add_argument(
+    '--cache_directory',
+    action='store',
+    help=('An optional directory in which to cache the flattened filesystems '
+          'of the bottom layers of images, for reuse by images sharing them.'))
+
+parser.add_argument(
+    '--cache_size',
+    action='store',
+    type=int,
+    default=10 * 1024 * 1024 * 1024,
+    help='The cap on the size of --cache_directory, in bytes.')
+
+parser.add_argument(
+    '--cache_layers',
+    action='store',
+    type=int,
+    default=-1,
+    help=('The number of bottom layers whose flattened filesystem to cache, '
+          'or if negative the number of top layers to leave out.'))
+
 parser.add_argument(
     '--metadata',
     action='store',
@@ -88,14 +155,40 @@ def main():
   layers = list(zip(args.digest or [], args.layer or []))
   uncompressed_layers = list(
       zip(args.diff_id or [], args.uncompressed_layer or []))
+  cache = None
+  if args.cache_directory:
+    cache = flatten_cache.FlattenCache(args.cache_directory, args.cache_size)
+
   logging.info('Loading v2.2 image From Disk ...')
   with v2_2_image.FromDisk(
       config_file=config,
       layers=layers,
       uncompressed_layers=uncompressed_layers,
       legacy_base=args.tarball) as v2_2_img:
-    with tarfile.open(args.filesystem, 'w:', encoding='utf-8') as tar:
-      v2_2_image.extract(v2_2_img, tar)
+    if args.filesystem:
+      with tarfile.open(args.filesystem, 'w:', encoding='utf-8') as tar:
+        v2_2_image.extract(
+            v2_2_img,
+            tar,
+            prefetch=args.prefetch,
+            memory_budget=args.memory_budget,
+            cache=cache,
+            cache_layers=args.cache_layers)
+
+    if args.directory:
+      content_store = None
+      if args.content_store:
+        content_store = filesystem.ContentStore(args.content_store,
+                                                args.content_store_mode)
+      v2_2_image.extract_to_directory(
+          v2_2_img,
+          args.directory,
+          prefetch=args.prefetch,
+          memory_budget=args.memory_budget,
+          threads=args.threads,
+          content_store=content_store,
+          cache=cache,
+          cache_layers=args.cache_layers)
 
     with open(args.metadata, 'w') as f:
       f.write(v2_2_img.config_file())
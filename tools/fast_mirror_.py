@@ -0,0 +1,171 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This package incrementally mirrors repositories between registries."""
+
+from __future__ import absolute_import
+
+from __future__ import print_function
+
+import argparse
+import logging
+import sys
+
+from containerregistry.client import docker_creds
+from containerregistry.client import docker_name
+from containerregistry.client import known_blobs
+from containerregistry.client import registry_capabilities
+from containerregistry.client.v2_2 import mirror
+from containerregistry.tools import logging_setup
+from containerregistry.tools import patched
+from containerregistry.transport import retry
+from containerregistry.transport import transport_pool
+
+import httplib2
+
+
+parser = argparse.ArgumentParser(
+    description='Incrementally mirror repositories between registries.')
+
+parser.add_argument(
+    '--repository',
+    action='append',
+    default=[],
+    help=('A repository to mirror, as SRC=DST, e.g. '
+          'gcr.io/foo/bar=mirror.example.com/foo/bar. May be repeated.'))
+
+parser.add_argument(
+    '--repositories-file',
+    action='store',
+    help='A file listing repositories to mirror, as SRC=DST, one per line.')
+
+parser.add_argument(
+    '--state-directory',
+    action='store',
+    help=('Where to record the digest each tag was mirrored at, from which '
+          'later (or interrupted) syncs resume.'),
+    required=True)
+
+parser.add_argument(
+    '--threads',
+    action='store',
+    type=int,
+    default=8,
+    help='The number of requests to have in flight, across all repositories.')
+
+parser.add_argument(
+    '--client-config-dir',
+    action='store',
+    help='The path to the directory where the client configuration files are '
+    'located. Overiddes the value from DOCKER_CONFIG')
+
+parser.add_argument(
+    '--known-blobs-directory',
+    action='store',
+    help=('An optional directory recording the blobs known to exist in each '
+          'repository, which is shared across pushes to skip checking for '
+          'them.'))
+
+parser.add_argument(
+    '--registry-capabilities-directory',
+    action='store',
+    help=('An optional directory recording the upload strategies that '
+          'registries support, which is shared across pushes to skip '
+          'those a registry rejects.'))
+
+
+def _Repositories(args):
+  """Parses the SRC=DST pairs to mirror."""
+  pairs = list(args.repository)
+  if args.repositories_file:
+    with open(args.repositories_file) as f:
+      pairs.extend(
+          line.strip() for line in f
+          if line.strip() and not line.startswith('#'))
+
+  repositories = []
+  for pair in pairs:
+    if '=' not in pair:
+      raise ValueError('Expected SRC=DST, got: %s' % pair)
+    src, dst = pair.split('=', 1)
+    repositories.append((docker_name.Repository(src.strip()),
+                         docker_name.Repository(dst.strip())))
+  return repositories
+
+
+def main():
+  logging_setup.DefineCommandLineArgs(parser)
+  args = parser.parse_args()
+  logging_setup.Init(args=args)
+
+  try:
+    repositories = _Repositories(args)
+  # pylint: disable=broad-except
+  except Exception as e:
+    logging.fatal('Error reading the repositories to mirror: %s', e)
+    sys.exit(1)
+
+  if not repositories:
+    logging.fatal('Either --repository or --repositories-file must be '
+                  'specified.')
+    sys.exit(1)
+
+  # If the user provided a client config directory, instruct the keychain
+  # resolver to use it to look for the docker client config
+  if args.client_config_dir is not None:
+    docker_creds.DefaultKeychain.setCustomConfigDir(args.client_config_dir)
+
+  retry_factory = retry.Factory()
+  retry_factory = retry_factory.WithSourceTransportCallable(httplib2.Http)
+  transport = transport_pool.Http(retry_factory.Build, size=args.threads)
+
+  known = None
+  if args.known_blobs_directory:
+    known = known_blobs.KnownBlobs(args.known_blobs_directory)
+
+  capabilities = None
+  if args.registry_capabilities_directory:
+    capabilities = registry_capabilities.Capabilities(
+        args.registry_capabilities_directory)
+
+  session = mirror.Mirror(
+      docker_creds.DefaultKeychain,
+      transport,
+      mirror.State(args.state_directory),
+      threads=args.threads,
+      known_blobs=known,
+      registry_capabilities=capabilities)
+  report = session.sync(repositories)
+
+  total = 0
+  for dst, result in report.items():
+    total += result.bytes_uploaded
+    print(('{dst}: {copied} copied, {unchanged} unchanged, {failed} failed, '
+           '{size} bytes uploaded'.format(
+               dst=dst,
+               copied=len(result.copied),
+               unchanged=result.unchanged,
+               failed=len(result.failed),
+               size=result.bytes_uploaded)))
+    for tag, error in sorted(result.failed.items(), key=lambda t: t[0] or ''):
+      print(('  {tag} failed: {error}'.format(
+          tag=tag or '(listing tags)', error=error)))
+  print(('{size} bytes uploaded in total.'.format(size=total)))
+
+  if any(result.failed for result in report.values()):
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  with patched.Httplib2():
+    main()
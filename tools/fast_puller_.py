@@ -24,10 +24,11 @@ import sys
 
 from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
+from containerregistry.client import known_blobs
 from containerregistry.client.v2 import docker_image as v2_image
-from containerregistry.client.v2_2 import docker_http
-from containerregistry.client.v2_2 import docker_image as v2_2_image
 from containerregistry.client.v2_2 import docker_image_list as image_list
+from containerregistry.client.v2_2 import negotiate
+from containerregistry.client.v2_2 import pull_cache
 from containerregistry.client.v2_2 import save
 from containerregistry.client.v2_2 import v2_compat
 from containerregistry.tools import logging_setup
@@ -55,6 +56,13 @@ parser.add_argument(
 
 platform_args.AddArguments(parser)
 
+parser.add_argument(
+    '--all-platforms',
+    action='store_true',
+    help=('For multi-platform manifest lists, pull every platform, each '
+          'into its own subdirectory of --directory, rather than the one '
+          'selected by the platform flags.'))
+
 parser.add_argument(
     '--client-config-dir',
     action='store',
@@ -63,6 +71,35 @@ parser.add_argument(
 parser.add_argument(
     '--cache', action='store', help='Image\'s files cache directory.')
 
+parser.add_argument(
+    '--cache-size',
+    action='store',
+    type=int,
+    help=('An optional cap on the size of --cache, in bytes, beyond which '
+          'the least recently used layers that no image directory links to '
+          'are evicted after the pull.'))
+
+parser.add_argument(
+    '--reverify',
+    action='store',
+    type=float,
+    default=0.0,
+    help=('The fraction of the layers found in --cache, sampled at random, '
+          'to hash again despite having been verified when cached, to catch '
+          'their corruption on disk.'))
+
+parser.add_argument(
+    '--index',
+    action='store_true',
+    help=('Whether to write an index of the files in each layer alongside '
+          'it, for queries that need not decompress the layer.'))
+
+parser.add_argument(
+    '--known-blobs-directory',
+    action='store',
+    help=('An optional directory in which to record the pulled blobs, from '
+          'which pushes sharing it may mount them.'))
+
 _THREADS = 8
 
 
@@ -85,14 +122,9 @@ def main():
   if args.client_config_dir is not None:
     docker_creds.DefaultKeychain.setCustomConfigDir(args.client_config_dir)
 
-  # OCI Image Manifest is compatible with Docker Image Manifest Version 2,
-  # Schema 2. We indicate support for both formats by passing both media types
-  # as 'Accept' headers.
-  #
-  # For reference:
-  #   OCI: https://github.com/opencontainers/image-spec
-  #   Docker: https://docs.docker.com/registry/spec/manifest-v2-2/
-  accept = docker_http.SUPPORTED_MANIFEST_MIMES
+  known = None
+  if args.known_blobs_directory:
+    known = known_blobs.KnownBlobs(args.known_blobs_directory)
 
   # Resolve the appropriate credential to use based on the standard Docker
   # client logic.
@@ -103,40 +135,79 @@ def main():
     logging.fatal('Error resolving credentials for %s: %s', name, e)
     sys.exit(1)
 
+  _Pull(args, name, creds, transport, known)
+
+  if args.cache and args.cache_size is not None:
+    cache = pull_cache.PullCache(args.cache, args.cache_size)
+    try:
+      with cache.lock(shared=False, blocking=False):
+        cache.gc()
+    except pull_cache.LockedError:
+      # Another pull is using the cache, and a later eviction catches up.
+      logging.info('Skipping eviction from the locked cache %s', args.cache)
+
+
+def _Pull(args, name, creds, transport, known):
+  """Pulls name, and saves it into args.directory."""
   try:
-    logging.info('Pulling manifest list from %r ...', name)
-    with image_list.FromRegistry(name, creds, transport) as img_list:
-      if img_list.exists():
+    # A single request for the manifest tells us which kind of image it is.
+    logging.info('Pulling %r ...', name)
+    with negotiate.FromRegistry(
+        name, creds, transport, known_blobs=known,
+        threads=_THREADS) as img:
+      if isinstance(img, image_list.DockerImageList) and args.all_platforms:
+        children = img.resolve_all_platforms()
+        # Only the children entered are exited, should entering one fail.
+        entered = []
+        try:
+          for (unused_platform, child) in children:
+            child.__enter__()
+            entered.append(child)
+          save.fast_all(
+              children,
+              args.directory,
+              threads=_THREADS,
+              cache_directory=args.cache,
+              index=args.index,
+              reverify=args.reverify)
+        finally:
+          for child in entered:
+            child.__exit__(None, None, None)
+        return
+
+      if isinstance(img, image_list.DockerImageList):
         platform = platform_args.FromArgs(args)
         # pytype: disable=wrong-arg-types
-        with img_list.resolve(platform) as default_child:
+        with img.resolve(platform) as default_child:
           save.fast(
               default_child,
               args.directory,
               threads=_THREADS,
-              cache_directory=args.cache)
+              cache_directory=args.cache,
+              index=args.index,
+              reverify=args.reverify)
           return
         # pytype: enable=wrong-arg-types
 
-    logging.info('Pulling v2.2 image from %r ...', name)
-    with v2_2_image.FromRegistry(name, creds, transport, accept) as v2_2_img:
-      if v2_2_img.exists():
-        save.fast(
-            v2_2_img,
-            args.directory,
-            threads=_THREADS,
-            cache_directory=args.cache)
-        return
+      if isinstance(img, v2_image.DockerImage):
+        with v2_compat.V22FromV2(img) as v2_2_img:
+          save.fast(
+              v2_2_img,
+              args.directory,
+              threads=_THREADS,
+              cache_directory=args.cache,
+              index=args.index,
+              reverify=args.reverify)
+          return
 
-    logging.info('Pulling v2 image from %r ...', name)
-    with v2_image.FromRegistry(name, creds, transport) as v2_img:
-      with v2_compat.V22FromV2(v2_img) as v2_2_img:
-        save.fast(
-            v2_2_img,
-            args.directory,
-            threads=_THREADS,
-            cache_directory=args.cache)
-        return
+      save.fast(
+          img,
+          args.directory,
+          threads=_THREADS,
+          cache_directory=args.cache,
+          index=args.index,
+          reverify=args.reverify)
+      return
   # pylint: disable=broad-except
   except Exception as e:
     logging.fatal('Error pulling and saving image %s: %s', name, e)
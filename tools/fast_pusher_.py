@@ -28,6 +28,8 @@ import sys
 
 from containerregistry.client import docker_creds
 from containerregistry.client import docker_name
+from containerregistry.client import known_blobs
+from containerregistry.client import registry_capabilities
 from containerregistry.client.v2_2 import docker_image as v2_2_image
 from containerregistry.client.v2_2 import docker_session
 from containerregistry.client.v2_2 import oci_compat
@@ -44,7 +46,9 @@ parser = argparse.ArgumentParser(
     description='Push images to a Docker Registry, faaaaaast.')
 
 parser.add_argument(
-    '--name', action='store', help='The name of the docker image to push.',
+    '--name', action='append',
+    help=('The name of the docker image to push; may be repeated to push it '
+          'to several names at once.'),
     required=True)
 
 # The name of this flag was chosen for compatibility with docker_pusher.py
@@ -86,6 +90,20 @@ parser.add_argument(
     help='The path to the directory where the client configuration files are '
     'located. Overiddes the value from DOCKER_CONFIG')
 
+parser.add_argument(
+    '--known-blobs-directory',
+    action='store',
+    help=('An optional directory recording the blobs known to exist in '
+          'registries, which is shared across pushes to skip redundant '
+          'existence checks.'))
+
+parser.add_argument(
+    '--registry-capabilities-directory',
+    action='store',
+    help=('An optional directory recording the upload strategies that '
+          'registries support, which is shared across pushes to skip '
+          'those a registry rejects.'))
+
 _THREADS = 8
 
 
@@ -119,7 +137,7 @@ def main():
   # This library can support push-by-digest, but the likelihood of a user
   # correctly providing us with the digest without using this library
   # directly is essentially nil.
-  name = Tag(args.name, args.stamp_info_file)
+  names = [Tag(name, args.stamp_info_file) for name in args.name]
 
   if not args.config and (args.layer or args.digest):
     logging.fatal(
@@ -169,29 +187,57 @@ def main():
     # Resolve the appropriate credential to use based on the standard Docker
     # client logic.
     try:
-      creds = docker_creds.DefaultKeychain.Resolve(name)
+      creds = docker_creds.DefaultKeychain.Resolve(names[0])
     # pylint: disable=broad-except
     except Exception as e:
-      logging.fatal('Error resolving credentials for %s: %s', name, e)
+      logging.fatal('Error resolving credentials for %s: %s', names[0], e)
       sys.exit(1)
 
+    known = None
+    if args.known_blobs_directory:
+      known = known_blobs.KnownBlobs(args.known_blobs_directory)
+
+    capabilities = None
+    if args.registry_capabilities_directory:
+      capabilities = registry_capabilities.Capabilities(
+          args.registry_capabilities_directory)
+
     try:
-      with docker_session.Push(
-          name, creds, transport, threads=_THREADS) as session:
+      if len(names) == 1:
+        session = docker_session.Push(
+            names[0], creds, transport, threads=_THREADS,
+            known_blobs=known,
+            registry_capabilities=capabilities)
+      else:
+        # MultiPush resolves the credentials for each repository itself.
+        session = docker_session.MultiPush(
+            names, docker_creds.DefaultKeychain, transport, threads=_THREADS,
+            known_blobs=known,
+            registry_capabilities=capabilities)
+      with session:
         logging.info('Starting upload ...')
+        # MultiPush reports which names failed, rather than raising.
         if args.oci:
           with oci_compat.OCIFromV22(v2_2_img) as oci_img:
-            session.upload(oci_img)
+            report = session.upload(oci_img) or {}
             digest = oci_img.digest()
         else:
-          session.upload(v2_2_img)
+          report = session.upload(v2_2_img) or {}
           digest = v2_2_img.digest()
 
-        print(('{name} was published with digest: {digest}'.format(
-            name=name, digest=digest)))
+        for name in names:
+          if report.get(name):
+            print(('{name} failed: {error}'.format(
+                name=name, error=report[name])))
+          else:
+            print(('{name} was published with digest: {digest}'.format(
+                name=name, digest=digest)))
     # pylint: disable=broad-except
     except Exception as e:
-      logging.fatal('Error publishing %s: %s', name, e)
+      logging.fatal('Error publishing %s: %s', ', '.join(map(str, names)), e)
+      sys.exit(1)
+
+    if any(report.values()):
       sys.exit(1)
 
 